@@ -5,9 +5,9 @@ import sys
 import os
 from .frontend import ConsoleFrontend
 from .controller import Controller
-from .runtime import RuntimeControllerDependencyInjector
+from .runtime import RuntimeControllerDependencyInjector, create_backup_verifier
 
 def main() -> None:
     """ Defines the main function of the Todoist backup utility """
-    ConsoleFrontend(Controller, RuntimeControllerDependencyInjector).run(
+    ConsoleFrontend(Controller, RuntimeControllerDependencyInjector, create_backup_verifier).run(
         sys.argv[0], sys.argv[1:], os.environ)
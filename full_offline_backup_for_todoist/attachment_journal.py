@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+""" Journal of the attachments downloaded so far, to resume interrupted downloads """
+import json
+import os
+import shutil
+from typing import IO, Dict, NamedTuple, Optional
+from .attachment_store import AttachmentStore
+
+class _AttachmentJournalEntry(NamedTuple):
+    """ Represents an attachment recorded in the journal """
+    url: str
+    sha256: str
+    size: int
+
+class AttachmentJournal:
+    """ Journal of the attachments downloaded so far, so that if the download is interrupted
+        (e.g. by a network error or a crash), a restarted download doesn't need to download
+        them again. The contents of the attachments are kept in an attachment store, and each
+        completed attachment is recorded by appending a line to the journal file """
+    __JOURNAL_FILE_NAME = "journal.jsonl"
+    __FILES_FOLDER_NAME = "files"
+
+    __directory: str
+    __store: AttachmentStore
+    __entries: Dict[str, _AttachmentJournalEntry]
+
+    def __init__(self, directory: str):
+        self.__directory = directory
+        self.__store = AttachmentStore(os.path.join(directory, self.__FILES_FOLDER_NAME))
+        self.__entries = self.__load()
+
+    def __load(self) -> Dict[str, _AttachmentJournalEntry]:
+        entries = {}
+        try:
+            with open(os.path.join(self.__directory, self.__JOURNAL_FILE_NAME),
+                      encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break # The last line may be incomplete if we crashed while writing it
+                    entries[record["path"]] = _AttachmentJournalEntry(
+                        record["url"], record["sha256"], record["size"])
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def is_empty(self) -> bool:
+        """ Checks if no attachments are recorded in the journal """
+        return not self.__entries
+
+    def get(self, path: str, url: str) -> Optional[str]:
+        """ Gets the file with the contents of the attachment with the given path and URL,
+            if it was already downloaded """
+        entry = self.__entries.get(path)
+        if entry is None or entry.url != url:
+            return None
+
+        file_path = self.__store.get_path(entry.sha256)
+        try:
+            if os.path.getsize(file_path) != entry.size:
+                return None
+        except FileNotFoundError:
+            return None
+        return file_path
+
+    def add(self, path: str, url: str, data: IO[bytes]) -> None:
+        """ Records that the attachment with the given path and URL was downloaded,
+            with the contents of the given (seekable) file object """
+        digest = self.__store.add(data)
+        entry = _AttachmentJournalEntry(url, digest, data.seek(0, os.SEEK_END))
+
+        # Make sure the record is on disk before going on, so it survives a crash
+        with open(os.path.join(self.__directory, self.__JOURNAL_FILE_NAME), 'a',
+                  encoding='utf-8') as journal_file:
+            journal_file.write(json.dumps({"path": path, "url": entry.url,
+                                           "sha256": entry.sha256, "size": entry.size}) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.__entries[path] = entry
+
+    def clear(self) -> None:
+        """ Removes the journal, once the attachments have been packed to the backup.
+            Only the files created by the journal are removed, not the rest of the directory """
+        try:
+            os.remove(os.path.join(self.__directory, self.__JOURNAL_FILE_NAME))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(os.path.join(self.__directory, self.__FILES_FOLDER_NAME),
+                      ignore_errors=True)
+        self.__entries = {}
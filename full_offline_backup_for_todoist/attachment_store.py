@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+""" Content-addressed store of attachments, shared across backups """
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import IO
+
+class AttachmentStore:
+    """ Content-addressed store of attachments, shared across backups.
+        Each distinct content is stored once, in a file named after its SHA-256 hash,
+        so attachments that don't change between backups take no additional space. """
+    __CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, directory: str):
+        self.__directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, digest: str) -> str:
+        """ Gets the path where the content with the given SHA-256 hash is stored """
+        # Spread the files over subdirectories, since some filesystems don't cope
+        # well with a huge amount of files in a single directory
+        return os.path.join(self.__directory, digest[:2], digest)
+
+    def add(self, data: IO[bytes]) -> str:
+        """ Stores the contents of the given (seekable) file object, unless they were already
+            stored, and returns their SHA-256 hash """
+        data.seek(0)
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: data.read(self.__CHUNK_SIZE), b''):
+            sha256.update(chunk)
+        digest = sha256.hexdigest()
+
+        path = self.get_path(digest)
+        if os.path.exists(path):
+            return digest
+
+        # Write to a temporary file first, so the store never contains a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                data.seek(0)
+                shutil.copyfileobj(data, temp_file, self.__CHUNK_SIZE)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return digest
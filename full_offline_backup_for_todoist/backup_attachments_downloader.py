@@ -2,16 +2,25 @@
 """ Utility to download the attachments associated with a Todoist backup VFS
     The downloaded attachments are packed to the same VFS """
 
+import concurrent.futures
 import csv
+import io
 import re
 import json
 import itertools
 import os
-from typing import Set, List, Optional
-from .utils import sanitize_file_name
+import shutil
+import tempfile
+import threading
+from types import TracebackType
+from typing import IO, Callable, Dict, Iterator, NamedTuple, Set, List, Optional, Tuple, Type
+from .utils import sanitize_file_name, parallel_ordered_map, process_ordered_map
+from .utils import async_ordered_map
 from .virtual_fs import VirtualFs
 from .tracer import Tracer
 from .url_downloader import URLDownloader
+from .attachment_store import AttachmentStore
+from .attachment_journal import AttachmentJournal
 
 class TodoistAttachmentInfo:
     """ Represents the properties of a Todoist attachment """
@@ -22,71 +31,325 @@ class TodoistAttachmentInfo:
         self.file_name = file_name
         self.file_url = file_url
 
-class TodoistBackupAttachmentsDownloader:
-    """ Provides utilities for downloading the attachments of a Todoist backup """
-
-    __TODOIST_ATTACHMENT_REGEXP = re.compile(r"\[\[\s*file\s*(.+)\s*\]\]")
-    __ATTACHMENT_FOLDER = "attachments/"
+_TODOIST_ATTACHMENT_REGEXP = re.compile(r"\[\[\s*file\s*(.+)\s*\]\]")
 
-    __tracer: Tracer
-    __urldownloader: URLDownloader
+# The CSV files are parsed by module-level functions, so they can run on a process pool
 
-    def __init__(self, tracer: Tracer, urldownloader: URLDownloader):
-        self.__tracer = tracer
-        self.__urldownloader = urldownloader
+def _fetch_attachment_info_from_json(json_str: str) -> Optional[TodoistAttachmentInfo]:
+    """ Fetches the information of an attachment of a Todoist backup CSV file,
+        given the JSON content of a task with an attachment """
+    json_data = json.loads(json_str)
 
-    @staticmethod
-    def __fetch_attachment_info_from_json(json_str: str) -> Optional[TodoistAttachmentInfo]:
-        """ Fetches the information of an attachment of a Todoist backup CSV file,
-            given the JSON content of a task with an attachment """
-        json_data = json.loads(json_str)
+    # Exclude those files that are created from e.g. external website links
+    if "file_name" not in json_data or "file_url" not in json_data:
+        return None
 
-        # Exclude those files that are created from e.g. external website links
-        if "file_name" not in json_data or "file_url" not in json_data:
-            return None
+    return TodoistAttachmentInfo(sanitize_file_name(json_data["file_name"]),
+                                 json_data["file_url"])
 
-        return TodoistAttachmentInfo(sanitize_file_name(json_data["file_name"]),
-                                     json_data["file_url"])
+def _fetch_attachment_infos_from_csv(csv_file: IO[bytes]) -> List[TodoistAttachmentInfo]:
+    """ Fetches the information of all the attachments of a Todoist backup CSV file,
+        which is read row by row, so it doesn't need to be held in memory at once """
+    attachment_infos: List[TodoistAttachmentInfo] = []
 
-    def __fetch_attachment_infos_from_csv(self, csv_string: str) -> List[TodoistAttachmentInfo]:
-        """ Fetches the information of all the attachments of a Todoist backup CSV file,
-            given a CSV file as a single string """
-        attachment_infos = []
+    with io.TextIOWrapper(csv_file, encoding='utf-8-sig', newline='') as csv_text_file:
+        csv_reader = csv.reader(csv_text_file)
+        header = next(csv_reader, [])
+        if "CONTENT" not in header:
+            return attachment_infos
 
-        csv_reader = csv.DictReader(csv_string.split('\n'))
+        content_index = header.index("CONTENT")
         for row in csv_reader:
-            matches = self.__TODOIST_ATTACHMENT_REGEXP.findall(row["CONTENT"])
+            # Most rows have no attachments, and a substring search is much faster
+            # than the regular expression, so try it first
+            if len(row) <= content_index or "[[" not in row[content_index]:
+                continue
+
+            matches = _TODOIST_ATTACHMENT_REGEXP.findall(row[content_index])
             for matchstr in matches:
-                attachment_info = self.__fetch_attachment_info_from_json(matchstr)
+                attachment_info = _fetch_attachment_info_from_json(matchstr)
                 if attachment_info:
                     attachment_infos.append(attachment_info)
 
-        return attachment_infos
+    return attachment_infos
+
+def _fetch_attachment_infos_from_csv_data(csv_data: bytes) -> List[TodoistAttachmentInfo]:
+    """ Fetches the information of all the attachments of a Todoist backup CSV file,
+        given its contents """
+    return _fetch_attachment_infos_from_csv(io.BytesIO(csv_data))
+
+class _AttachmentPrefetcher: # pylint: disable=too-many-instance-attributes
+    """ Downloads attachments in the background as soon as they are found, to temporary files,
+        so that their downloads overlap with the export of the rest of the backup.
+        Since each attachment is kept in a temporary file until it is packed, no more downloads
+        are started once the downloaded files add up to the given size.
+        The rest are downloaded while packing """
+
+    def __init__(self, tracer: Tracer, urldownloader: URLDownloader, jobs: int, max_size: int):
+        self.__tracer = tracer
+        self.__urldownloader = urldownloader
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        self.__jobs = jobs
+        self.__max_size = max_size
+        # The downloads are started both by the caller and by the workers, once they finish
+        self.__lock = threading.Lock()
+        self.__queued: Dict[str, TodoistAttachmentInfo] = {} # In the order they were found
+        self.__running = 0
+        self.__size = 0
+        self.__stopped = False
+        self.__downloads: Dict[str, "concurrent.futures.Future[IO[bytes]]"] = {}
+
+    def __start_downloads(self) -> None:
+        """ Starts the queued downloads, as long as there are free workers and the limit
+            has not been reached. Must be called with the lock held """
+        while (self.__queued and not self.__stopped and self.__running < self.__jobs and
+               self.__size < self.__max_size):
+            url = next(iter(self.__queued))
+            attachment_info = self.__queued.pop(url)
+            self.__running += 1
+            self.__downloads[url] = self.__executor.submit(self.__download, attachment_info)
+
+    def __finish_download(self, size: int) -> None:
+        with self.__lock:
+            self.__running -= 1
+            if self.__size < self.__max_size <= self.__size + size:
+                self.__tracer.trace("Attachments downloaded in the background reached "
+                                    "the size limit, the rest are downloaded while packing.")
+            self.__size += size
+            self.__start_downloads()
+
+    def __download(self, attachment_info: TodoistAttachmentInfo) -> IO[bytes]:
+        self.__tracer.trace(f"Downloading attachment '{attachment_info.file_name}' "
+                            "in the background...")
+        # The file is deleted as soon as it is closed
+        temp_file = tempfile.TemporaryFile() # pylint: disable=consider-using-with
+        try:
+            self.__urldownloader.get_to_file(attachment_info.file_url, temp_file)
+        except:
+            temp_file.close()
+            self.__finish_download(0)
+            raise
+        self.__finish_download(temp_file.tell())
+        temp_file.seek(0)
+        return temp_file
+
+    def prefetch(self, attachment_info: TodoistAttachmentInfo) -> None:
+        """ Queues the given attachment to be downloaded, unless its URL is already queued
+            or being downloaded """
+        with self.__lock:
+            url = attachment_info.file_url
+            if not self.__stopped and url not in self.__downloads and url not in self.__queued:
+                self.__queued[url] = attachment_info
+                self.__start_downloads()
+
+    def stop(self) -> None:
+        """ Stops starting downloads, so the attachments still queued can be downloaded
+            elsewhere. The downloads already started are not affected """
+        with self.__lock:
+            self.__stopped = True
+            self.__queued.clear()
+
+    def is_prefetched(self, url: str) -> bool:
+        """ Checks if the attachment with the given URL is being downloaded in the background """
+        with self.__lock:
+            return url in self.__downloads
+
+    def open(self, url: str) -> IO[bytes]:
+        """ Waits for the attachment with the given URL to be downloaded, and hands over
+            its file, which the caller must close """
+        with self.__lock:
+            download = self.__downloads.pop(url)
+        return download.result()
+
+    def close(self) -> None:
+        """ Stops the pending downloads, and removes the downloaded files not handed over """
+        self.stop()
+        for download in self.__downloads.values():
+            download.cancel()
+        self.__executor.shutdown(wait=True)
+        for download in self.__downloads.values():
+            if not download.cancelled() and download.exception() is None:
+                download.result().close()
+        self.__downloads.clear()
+
+class _AttachmentCopies:
+    """ Keeps copies of downloaded attachments in temporary files, so that attachments
+        referenced more than once don't need to be downloaded again """
+
+    def __init__(self) -> None:
+        self.__temp_dir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.__copies: Dict[str, str] = {}
+
+    def __enter__(self) -> "_AttachmentCopies":
+        return self
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.__temp_dir.cleanup()
+
+    def add(self, url: str, data: IO[bytes]) -> None:
+        """ Keeps a copy of the contents of the given (seekable) file object """
+        self.__copies[url] = os.path.join(self.__temp_dir.name, str(len(self.__copies)))
+        with open(self.__copies[url], 'wb') as copy_file:
+            data.seek(0)
+            shutil.copyfileobj(data, copy_file)
+
+    def open(self, url: str) -> Optional[IO[bytes]]:
+        """ Opens the copy of the attachment with the given URL, if there is one """
+        if url not in self.__copies:
+            return None
+        return open(self.__copies[url], 'rb') # pylint: disable=consider-using-with
+
+class _AttachmentScanningVfs(VirtualFs):
+    """ Forwards everything to another VFS, while scanning the CSV files that are written
+        through it for attachments, so they don't need to be read back from the VFS """
+
+    def __init__(self, vfs: VirtualFs,
+                 scan_csv_file: Callable[[IO[bytes]], List[TodoistAttachmentInfo]],
+                 prefetcher: Optional[_AttachmentPrefetcher] = None):
+        self.vfs = vfs
+        self.attachment_infos_by_file: Dict[str, List[TodoistAttachmentInfo]] = {}
+        self.prefetcher = prefetcher
+        self.__scan_csv_file = scan_csv_file
+
+    def set_path_hint(self, dst_path: str) -> None:
+        self.vfs.set_path_hint(dst_path)
+
+    def get_path(self) -> Optional[str]:
+        return self.vfs.get_path()
+
+    def existed(self) -> bool:
+        return self.vfs.existed()
+
+    def file_list(self) -> List[str]:
+        return self.vfs.file_list()
+
+    def read_file(self, file_path: str) -> bytes:
+        return self.vfs.read_file(file_path)
+
+    def open_read(self, file_path: str) -> IO[bytes]:
+        return self.vfs.open_read(file_path)
+
+    def write_file(self, file_path: str, file_data: bytes, source: Optional[str] = None) -> None:
+        self.vfs.write_file(file_path, file_data, source)
+        if file_path.endswith(".csv"):
+            attachment_infos = self.__scan_csv_file(io.BytesIO(file_data))
+            self.attachment_infos_by_file[file_path] = attachment_infos
+            if self.prefetcher:
+                for attachment_info in attachment_infos:
+                    self.prefetcher.prefetch(attachment_info)
+
+    def open_write(self, file_path: str, source: Optional[str] = None) -> IO[bytes]:
+        return self.vfs.open_write(file_path, source)
+
+    def write_file_from(self, file_path: str, data: IO[bytes],
+                        source: Optional[str] = None) -> None:
+        self.vfs.write_file_from(file_path, data, source)
+
+class AttachmentsDownloaderOptions(NamedTuple):
+    """ Represents how the attachments of a backup are downloaded """
+    jobs: int = 1 # Number of downloads to run in parallel
+    use_asyncio: bool = False # Run the parallel downloads as asyncio tasks instead of threads
+    # If set, attachments start downloading while the projects are exported,
+    # until the downloaded files add up to this size in bytes
+    prefetch_max_size: Optional[int] = None
+
+class TodoistBackupAttachmentsDownloader:
+    """ Provides utilities for downloading the attachments of a Todoist backup """
+
+    __ATTACHMENT_FOLDER = "attachments/"
+    # When the attachments are kept in an attachment store, the backup only contains this
+    # manifest, which maps the path of each attachment to the SHA-256 hash of its contents.
+    # It is kept outside of the attachment folder, so it can't clash with an attachment
+    __ATTACHMENT_MANIFEST = ".manifest/attachments.json"
+    # Attachments up to this size are kept in memory while waiting to be packed,
+    # bigger ones are spooled to a temporary file
+    __SPOOL_MAX_MEMORY_SIZE = 1024 * 1024
+
+    __tracer: Tracer
+    __urldownloader: URLDownloader
+    __jobs: int
+    __use_asyncio: bool
+    __attachment_store: Optional[AttachmentStore]
+    __attachment_journal: Optional[AttachmentJournal]
+    __prefetch_max_size: Optional[int]
+
+    def __init__(self, tracer: Tracer, urldownloader: URLDownloader,
+                 options: Optional[AttachmentsDownloaderOptions] = None,
+                 attachment_store: Optional[AttachmentStore] = None,
+                 attachment_journal: Optional[AttachmentJournal] = None):
+        options = options or AttachmentsDownloaderOptions()
+        self.__tracer = tracer
+        self.__urldownloader = urldownloader
+        self.__jobs = options.jobs
+        self.__use_asyncio = options.use_asyncio
+        self.__attachment_store = attachment_store
+        self.__attachment_journal = attachment_journal
+        self.__prefetch_max_size = options.prefetch_max_size
 
     def __fetch_attachment_infos(self, vfs: VirtualFs) -> List[TodoistAttachmentInfo]:
         """ Fetches the information of all the attachment_infos
             of the current Todoist backup VFS """
-        self.__tracer.trace("Reading VFS...")
-
         attachment_infos = []
 
+        if isinstance(vfs, _AttachmentScanningVfs) and vfs.attachment_infos_by_file:
+            # Same order as if the CSV files were read back from the VFS
+            for name in sorted(vfs.attachment_infos_by_file):
+                attachment_infos.extend(vfs.attachment_infos_by_file[name])
+            return attachment_infos
+
+        self.__tracer.trace("Reading VFS...")
+
         # We iterate over the sorted file name list, so the resulting list
         # is always in a consistent order independently of quirks in the VFS
-        for name in sorted(vfs.file_list()):
+        csv_names = [name for name in sorted(vfs.file_list())
+                     if not name.startswith(self.__ATTACHMENT_FOLDER) and
+                     name != self.__ATTACHMENT_MANIFEST]
+
+        # Parsing is CPU-bound, so with many CSV files, spread it over a pool of processes.
+        # Each file is read by this thread, and the results are merged in the same order
+        parse_jobs = min(self.__jobs, os.cpu_count() or 1, len(csv_names))
+        if parse_jobs > 1:
+            def read_csv_file(name: str) -> bytes:
+                self.__tracer.trace(f"Parsing CSV file '{name}'...")
+                return vfs.read_file(name)
+
+            with self.__tracer.span("parse_csv_files", jobs=parse_jobs) as span:
+                for csv_attachment_infos in process_ordered_map(
+                        _fetch_attachment_infos_from_csv_data, map(read_csv_file, csv_names),
+                        parse_jobs):
+                    attachment_infos.extend(csv_attachment_infos)
+                span.count("attachments", len(attachment_infos))
+            return attachment_infos
+
+        for name in csv_names:
             self.__tracer.trace(f"Parsing CSV file '{name}'...")
-            csv_string = vfs.read_file(name).decode('utf-8-sig')
-            attachment_infos.extend(self.__fetch_attachment_infos_from_csv(csv_string))
+            with vfs.open_read(name) as csv_file:
+                attachment_infos.extend(self.__scan_csv_file(csv_file))
 
         return attachment_infos
 
+    def __scan_csv_file(self, csv_file: IO[bytes]) -> List[TodoistAttachmentInfo]:
+        """ Fetches the information of the attachments of the given CSV file """
+        with self.__tracer.span("parse_csv_file") as span:
+            attachment_infos = _fetch_attachment_infos_from_csv(csv_file)
+            span.count("attachments", len(attachment_infos))
+            return attachment_infos
+
     @staticmethod
-    def __deduplicate_file_name(original_file_name: str, file_names_to_avoid: Set[str]) -> str:
+    def __deduplicate_file_name(original_file_name: str, file_names_to_avoid: Set[str],
+                                next_suffixes: Dict[str, int]) -> str:
         """ Modifies the given file name in order to avoid all of the file names
            in the given list of file names to avoid """
+        # Since file names are never removed from the names to avoid, the suffixes
+        # tried before for the same name are still taken, so start after the last one.
+        # This gives the same result as trying from 2 upwards, without going quadratic
+        # when there are thousands of attachments with the same name
         name_without_ext, ext = os.path.splitext(original_file_name)
-        for i in itertools.count(2):
+        for i in itertools.count(next_suffixes.get(original_file_name, 2)):
             new_file_name = name_without_ext + "_" + str(i) + ext
             if new_file_name not in file_names_to_avoid:
+                next_suffixes[original_file_name] = i + 1
                 return new_file_name
 
         assert False, "Unreachable code" # pragma: no cover
@@ -96,43 +359,226 @@ class TodoistBackupAttachmentsDownloader:
         """ Modifies the attachment names, if necessary, in order to
             avoid duplicate file names """
         included_attachment_names: Set[str] = set()
+        next_suffixes: Dict[str, int] = {}
 
         for attachment_info in attachment_infos:
             if attachment_info.file_name in included_attachment_names:
                 new_file_name = self.__deduplicate_file_name(
-                    attachment_info.file_name, included_attachment_names)
+                    attachment_info.file_name, included_attachment_names, next_suffixes)
                 self.__tracer.trace("Duplicate attachment name found - "
                     f"Renaming {attachment_info.file_name} to {new_file_name}...")
                 attachment_info.file_name = new_file_name
 
             included_attachment_names.add(attachment_info.file_name)
 
+    def __download_attachments(self, indexed_infos: List[Tuple[int, TodoistAttachmentInfo]],
+                               total: int) -> Iterator[IO[bytes]]:
+        """ Downloads the given attachments, yielding the file with the contents of each one """
+        def start_download(idx: int, attachment_info: TodoistAttachmentInfo) -> IO[bytes]:
+            """ Traces the start of a download, and creates the file to download it to """
+            self.__tracer.trace(f"[{idx+1}/{total}] "
+                f"Downloading attachment '{attachment_info.file_name}'...")
+            return tempfile.SpooledTemporaryFile(self.__SPOOL_MAX_MEMORY_SIZE)
+
+        def download_attachment(indexed_info: Tuple[int, TodoistAttachmentInfo]) -> IO[bytes]:
+            attachment_file = start_download(*indexed_info)
+            try:
+                self.__urldownloader.get_to_file(indexed_info[1].file_url, attachment_file)
+            except:
+                attachment_file.close()
+                raise
+            return attachment_file
+
+        async def download_attachment_async(
+                indexed_info: Tuple[int, TodoistAttachmentInfo]) -> IO[bytes]:
+            attachment_file = start_download(*indexed_info)
+            try:
+                await self.__urldownloader.get_to_file_async(
+                    indexed_info[1].file_url, attachment_file)
+            except:
+                attachment_file.close()
+                raise
+            return attachment_file
+
+        # The attachments are downloaded by a pool of workers, while the caller consumes them
+        # in the same order as the attachment list.
+        # They are streamed in fixed-size chunks, so memory usage doesn't depend on their size
+        if self.__use_asyncio:
+            return async_ordered_map(download_attachment_async, indexed_infos, self.__jobs)
+        return parallel_ordered_map(download_attachment, indexed_infos, self.__jobs)
+
+    @staticmethod
+    def __plan_downloads(attachment_infos: List[TodoistAttachmentInfo],
+                         journaled_files: List[Optional[str]],
+                         prefetcher: Optional[_AttachmentPrefetcher]
+                         ) -> Tuple[List[Tuple[int, TodoistAttachmentInfo]], Set[str]]:
+        """ Decides which attachments need to be downloaded, skipping those recorded in the
+            journal or being downloaded in the background. Attachments referenced more than
+            once (e.g. in forwarded notes) are only downloaded for the first reference,
+            so the URLs whose contents must be reused for later references are also returned """
+        pending_downloads = []
+        downloaded_urls: Set[str] = set()
+        reused_urls: Set[str] = set()
+        for idx, (attachment_info, journaled_file) in enumerate(
+                zip(attachment_infos, journaled_files)):
+            url = attachment_info.file_url
+            if journaled_file is not None:
+                continue
+
+            if url in downloaded_urls:
+                reused_urls.add(url)
+                continue
+
+            downloaded_urls.add(url)
+            if not (prefetcher and prefetcher.is_prefetched(url)):
+                pending_downloads.append((idx, attachment_info))
+
+        return pending_downloads, reused_urls
+
     def __download_and_pack_attachments(self, attachment_infos: List[TodoistAttachmentInfo],
-                                              vfs: VirtualFs) -> None:
+                                              vfs: VirtualFs,
+                                              prefetcher: Optional[_AttachmentPrefetcher]) -> None:
         """ Downloads and packs the given attachments in a folder 'attachments'
-            of the current Todoist backup VFS """
-        for idx, attachment_info in enumerate(attachment_infos):
-            self.__tracer.trace(f"[{idx+1}/{len(attachment_infos)}] "
-                f"Downloading attachment '{attachment_info.file_name}'...")
+            of the current Todoist backup VFS, or to the attachment store if there is one """
+        # Attachments recorded in the journal by a previous, interrupted download
+        # are taken from there instead of being downloaded again
+        journaled_files = [self.__attachment_journal.get(
+                               self.__ATTACHMENT_FOLDER + attachment_info.file_name,
+                               attachment_info.file_url) if self.__attachment_journal else None
+                           for attachment_info in attachment_infos]
+        if any(journaled_file is not None for journaled_file in journaled_files):
+            self.__tracer.trace("Resuming download, "
+                                f"{journaled_files.count(None)} attachments left.")
+
+        # From now on, the attachments are downloaded in the order they are packed
+        if prefetcher:
+            prefetcher.stop()
+        pending_downloads, reused_urls = self.__plan_downloads(
+            attachment_infos, journaled_files, prefetcher)
+
+        def open_attachment_file(idx: int, copies: _AttachmentCopies) -> IO[bytes]:
+            """ Gets the file with the contents of the attachment, wherever it was downloaded,
+                and records it in the journal if it was not there already """
+            attachment_info, journaled_file = attachment_infos[idx], journaled_files[idx]
+            if journaled_file is not None:
+                return open(journaled_file, 'rb') # pylint: disable=consider-using-with
+
+            copy_file = copies.open(attachment_info.file_url)
+            if copy_file:
+                self.__tracer.trace(f"Attachment '{attachment_info.file_name}' has the same URL "
+                                    "as a previous one, reusing its contents...")
+                return copy_file
+
+            attachment_file = (
+                prefetcher.open(attachment_info.file_url)
+                if prefetcher and prefetcher.is_prefetched(attachment_info.file_url)
+                else next(downloaded_files))
+            if self.__attachment_journal:
+                self.__attachment_journal.add(self.__ATTACHMENT_FOLDER + attachment_info.file_name,
+                                              attachment_info.file_url, attachment_file)
+            if attachment_info.file_url in reused_urls:
+                copies.add(attachment_info.file_url, attachment_file)
+            return attachment_file
+
+        # This thread is the only one writing to the VFS, in the same order as the attachment list
+        downloaded_files = self.__download_attachments(pending_downloads, len(attachment_infos))
+        manifest: Dict[str, str] = {}
+        with _AttachmentCopies() as copies:
+            for idx, attachment_info in enumerate(attachment_infos):
+                attachment_path = self.__ATTACHMENT_FOLDER + attachment_info.file_name
+                with open_attachment_file(idx, copies) as attachment_file:
+                    if self.__attachment_store:
+                        manifest[attachment_path] = self.__attachment_store.add(attachment_file)
+                    else:
+                        vfs.write_file_from(attachment_path, attachment_file,
+                                            attachment_info.file_url)
+
+                self.__tracer.trace(f"[{idx+1}/{len(attachment_infos)}] "
+                    f"Downloaded attachment '{attachment_info.file_name}'...")
 
-            data = self.__urldownloader.get(attachment_info.file_url)
+        if self.__attachment_store:
+            vfs.write_file(self.__ATTACHMENT_MANIFEST, json.dumps(manifest, indent=2).encode())
 
-            vfs.write_file(self.__ATTACHMENT_FOLDER + attachment_info.file_name, data)
+        if self.__attachment_journal:
+            self.__attachment_journal.clear()
 
-            self.__tracer.trace(f"[{idx+1}/{len(attachment_infos)}] "
-                f"Downloaded attachment '{attachment_info.file_name}'...")
+    def scan_written_files(self, vfs: VirtualFs) -> VirtualFs:
+        """ Wraps the given VFS, so that the CSV files written through it are scanned for
+            attachments as they are written. The attachments can then be downloaded to the
+            wrapped VFS without reading those files back, which some VFS (e.g. tar) can't do.
+            If a prefetch size is given, attachments start downloading as soon as they are found,
+            up to that size, unless a previous download is being resumed.
+            finish_scanning must be called once done with the VFS """
+        resuming = (bool(self.__get_packed_attachment_paths(vfs)) or
+                    (self.__attachment_journal is not None and
+                     not self.__attachment_journal.is_empty()))
+        prefetcher = None
+        if self.__prefetch_max_size is not None and not resuming:
+            prefetcher = _AttachmentPrefetcher(self.__tracer, self.__urldownloader, self.__jobs,
+                                               self.__prefetch_max_size)
+        return _AttachmentScanningVfs(vfs, self.__scan_csv_file, prefetcher)
+
+    @staticmethod
+    def finish_scanning(vfs: VirtualFs) -> None:
+        """ Stops the background downloads of the attachments of a VFS returned by
+            scan_written_files, and discards the downloaded files """
+        if isinstance(vfs, _AttachmentScanningVfs) and vfs.prefetcher:
+            vfs.prefetcher.close()
+            vfs.prefetcher = None
+
+    def __get_packed_attachment_paths(self, vfs: VirtualFs) -> Set[str]:
+        """ Gets the paths of the attachments already packed to the given backup,
+            either as files or in the manifest of the attachment store """
+        file_list = vfs.file_list()
+        packed_attachment_paths = {name for name in file_list
+                                   if name.startswith(self.__ATTACHMENT_FOLDER)}
+        if self.__ATTACHMENT_MANIFEST in file_list:
+            packed_attachment_paths.add(self.__ATTACHMENT_MANIFEST)
+            packed_attachment_paths.update(json.loads(vfs.read_file(self.__ATTACHMENT_MANIFEST)))
+        return packed_attachment_paths
+
+    def __fetch_missing_attachment_infos(self, vfs: VirtualFs,
+                                         packed_attachment_paths: Set[str]
+                                         ) -> List[TodoistAttachmentInfo]:
+        """ Fetches the information of the attachments of the given backup,
+            which are not packed to it yet """
+        attachment_infos = self.__fetch_attachment_infos(vfs)
+        self.__deduplicate_attachments_names(attachment_infos)
+        return [attachment_info for attachment_info in attachment_infos
+                if self.__ATTACHMENT_FOLDER + attachment_info.file_name
+                not in packed_attachment_paths]
+
+    def find_missing_attachments(self, vfs: VirtualFs) -> List[str]:
+        """ Gets the paths of the attachments referenced by the CSV files of the given backup,
+            which are not in the backup (e.g. because the download was interrupted).
+            For backups without attachments, no attachment is considered missing """
+        packed_attachment_paths = self.__get_packed_attachment_paths(vfs)
+        if not packed_attachment_paths:
+            return []
+
+        return [self.__ATTACHMENT_FOLDER + attachment_info.file_name
+                for attachment_info in self.__fetch_missing_attachment_infos(
+                    vfs, packed_attachment_paths)]
 
     def download_attachments(self, vfs: VirtualFs) -> None:
         """ Downloads all the attachments of the current Todoist backup VFS
-            and packs them in a folder 'attachments' to the same VFS """
-
-        # Ensure that we haven't already processed this file...
-        if any(name.startswith(self.__ATTACHMENT_FOLDER) for name in vfs.file_list()):
-            self.__tracer.trace("File already has attachments folder, skipping.")
+            and packs them in a folder 'attachments' to the same VFS.
+            If some attachments were already packed, only the missing ones are downloaded """
+        packed_attachment_paths = self.__get_packed_attachment_paths(vfs)
+        if self.__ATTACHMENT_MANIFEST in packed_attachment_paths:
+            # The manifest is only written once all the attachments are in the store
+            self.__tracer.trace("File already has all attachments, skipping.")
             return
 
         # Fetch the information of all the attachments
-        attachment_infos = self.__fetch_attachment_infos(vfs)
-        self.__tracer.trace(f"Found {len(attachment_infos)} attachments.")
-        self.__deduplicate_attachments_names(attachment_infos)
-        self.__download_and_pack_attachments(attachment_infos, vfs)
+        attachment_infos = self.__fetch_missing_attachment_infos(vfs, packed_attachment_paths)
+        if packed_attachment_paths:
+            self.__tracer.trace(f"File already has {len(packed_attachment_paths)} attachments, "
+                                f"{len(attachment_infos)} attachments are missing.")
+        else:
+            self.__tracer.trace(f"Found {len(attachment_infos)} attachments.")
+        with self.__tracer.span("download_attachments") as span:
+            span.count("attachments", len(attachment_infos))
+            self.__download_and_pack_attachments(
+                attachment_infos, vfs,
+                vfs.prefetcher if isinstance(vfs, _AttachmentScanningVfs) else None)
@@ -1,19 +1,55 @@
 #!/usr/bin/python3
 """ Class to download Todoist backup ZIPs using the Todoist API """
+import contextlib
 import datetime
-from .utils import sanitize_file_name
+import os
+from typing import ContextManager, Iterable, List, NamedTuple, Optional, Set, Tuple
+from .utils import sanitize_file_name, parallel_ordered_map, async_ordered_map
 from .tracer import Tracer
-from .todoist_api import TodoistApi
-from .virtual_fs import VirtualFs
+from .todoist_api import TodoistApi, TodoistProjectInfo, TodoistProjectChanges
+from .backup_state import BackupStateStore, TodoistBackupState
+from .virtual_fs import VirtualFs, ZipVirtualFs, DirectoryVirtualFs
+from .snapshot_exporter import TodoistSnapshotExporter
+
+class BackupDownloaderOptions(NamedTuple):
+    """ Represents how the projects of a backup are exported """
+    jobs: int = 1 # Number of exports to run in parallel
+    use_asyncio: bool = False # Run the parallel exports as asyncio tasks instead of threads
+    # If set ('csv' or 'json'), export everything from a single snapshot of the account,
+    # instead of requesting the CSV file of each project separately
+    snapshot_format: Optional[str] = None
 
 class TodoistBackupDownloader:
     """ Class to download Todoist backup ZIPs using the Todoist API """
     __tracer: Tracer
     __todoist_api: TodoistApi
+    __jobs: int
+    __use_asyncio: bool
+    __state_store: Optional[BackupStateStore]
+    __snapshot_format: Optional[str]
 
-    def __init__(self, tracer: Tracer, todoist_api: TodoistApi):
+    def __init__(self, tracer: Tracer, todoist_api: TodoistApi,
+                 options: Optional[BackupDownloaderOptions] = None,
+                 state_store: Optional[BackupStateStore] = None):
+        options = options or BackupDownloaderOptions()
         self.__tracer = tracer
         self.__todoist_api = todoist_api
+        self.__jobs = options.jobs
+        self.__use_asyncio = options.use_asyncio
+        self.__state_store = state_store
+        self.__snapshot_format = options.snapshot_format
+
+    @staticmethod
+    def __csv_file_name(project: TodoistProjectInfo) -> str:
+        return f"{sanitize_file_name(project.name)} [{project.identifier}].csv"
+
+    def __export_projects(self, projects: List[TodoistProjectInfo]) -> Iterable[bytes]:
+        # The exports may be fetched concurrently, but the results come back in project order,
+        # and are written from this thread only, so the VFS always sees the same sequence of writes
+        if self.__use_asyncio:
+            return async_ordered_map(
+                self.__todoist_api.export_project_as_csv_async, projects, self.__jobs)
+        return parallel_ordered_map(self.__todoist_api.export_project_as_csv, projects, self.__jobs)
 
     def download(self, vfs: VirtualFs) -> None:
         """ Generates a Todoist backup and saves it to the given VFS """
@@ -29,10 +65,120 @@ class TodoistBackupDownloader:
             self.__tracer.trace("File already downloaded... skipping")
             return
 
+        with self.__tracer.span("download_projects"):
+            if self.__snapshot_format is not None:
+                self.__download_snapshot(vfs, self.__snapshot_format)
+            elif self.__state_store is not None:
+                self.__download_incremental(vfs, self.__state_store)
+            else:
+                self.__download_full(vfs)
+
+    def __download_full(self, vfs: VirtualFs) -> None:
+        """ Exports all the projects """
         self.__tracer.trace("Downloading project list from todoist API...")
         projects = self.__todoist_api.get_projects()
 
-        for project in projects:
-            export_csv_file_name = f"{sanitize_file_name(project.name)} [{project.identifier}].csv"
-            export_csv_file_content = self.__todoist_api.export_project_as_csv(project)
-            vfs.write_file(export_csv_file_name, export_csv_file_content)
+        for project, export_csv_file_content in zip(projects, self.__export_projects(projects)):
+            vfs.write_file(self.__csv_file_name(project), export_csv_file_content,
+                           project.identifier)
+
+    def __download_snapshot(self, vfs: VirtualFs, snapshot_format: str) -> None:
+        """ Exports all the projects from a single snapshot of the account """
+        self.__tracer.trace("Downloading snapshot from todoist API...")
+        snapshot = self.__todoist_api.get_snapshot()
+        exporter = TodoistSnapshotExporter(snapshot)
+
+        for project in snapshot.projects:
+            if snapshot_format == "json":
+                vfs.write_file(f"{sanitize_file_name(project.name)} [{project.identifier}].json",
+                               exporter.export_project_as_json(project), project.identifier)
+            else:
+                vfs.write_file(self.__csv_file_name(project),
+                               exporter.export_project_as_csv(project), project.identifier)
+
+        if snapshot_format == "json":
+            vfs.write_file("labels.json", exporter.export_labels_as_json())
+
+    def __download_incremental(self, vfs: VirtualFs, state_store: BackupStateStore) -> None:
+        """ Exports only the projects that changed since the previous backup,
+            copying the rest of the projects from the previous backup """
+        previous_state = state_store.load()
+        self.__tracer.trace("Downloading project changes from todoist API...")
+        changes = self.__todoist_api.get_project_changes(
+            previous_state.sync_token if previous_state else '*')
+        state, changed_project_ids = self.__apply_changes(previous_state, changes)
+
+        with self.__open_previous_backup(previous_state) as previous_vfs:
+            previous_files = set(previous_vfs.file_list()) if previous_vfs else set()
+            copied_project_ids = {project.identifier for project in state.projects
+                                  if project.identifier not in changed_project_ids and
+                                  self.__csv_file_name(project) in previous_files}
+            self.__tracer.trace(f"Exporting {len(state.projects) - len(copied_project_ids)} "
+                                f"changed projects, copying {len(copied_project_ids)} unchanged...")
+
+            exported_csv_file_contents = iter(self.__export_projects(
+                [project for project in state.projects
+                 if project.identifier not in copied_project_ids]))
+            for project in state.projects:
+                export_csv_file_name = self.__csv_file_name(project)
+                if project.identifier in copied_project_ids:
+                    assert previous_vfs
+                    export_csv_file_content = previous_vfs.read_file(export_csv_file_name)
+                else:
+                    export_csv_file_content = next(exported_csv_file_contents)
+                vfs.write_file(export_csv_file_name, export_csv_file_content, project.identifier)
+
+        # Use an absolute path, so the next backup finds this one even from another directory
+        backup_path = vfs.get_path()
+        state_store.save(state._replace(
+            backup_path=os.path.abspath(backup_path) if backup_path else None))
+
+    @staticmethod
+    def __apply_changes(previous_state: Optional[TodoistBackupState],
+                        changes: TodoistProjectChanges) -> Tuple[TodoistBackupState, Set[str]]:
+        """ Updates the state of the previous backup with the changes since then.
+            Returns the new state, and the IDs of the projects that need to be exported again """
+        if previous_state is None or changes.full_sync:
+            state = TodoistBackupState(
+                changes.sync_token, None, changes.projects,
+                {item_id: project_id for item_id, project_id in changes.item_projects.items()
+                 if project_id is not None})
+            return state, {project.identifier for project in state.projects}
+
+        # A moved or deleted item changes both the project it was in and the one it is in now
+        item_projects = dict(previous_state.item_projects)
+        changed_project_ids = set(changes.changed_project_ids)
+        for item_id, project_id in changes.item_projects.items():
+            old_project_id = item_projects.pop(item_id, None)
+            if old_project_id is not None:
+                changed_project_ids.add(old_project_id)
+            if project_id is not None:
+                item_projects[item_id] = project_id
+                changed_project_ids.add(project_id)
+
+        for item_id in changes.changed_note_item_ids:
+            if item_id not in item_projects:
+                # Can't tell which project the comment belongs to, so export everything again
+                changed_project_ids = {project.identifier for project in previous_state.projects}
+                break
+            changed_project_ids.add(item_projects[item_id])
+
+        # Keep the order of the previous backup, with new projects at the end
+        updated_projects = {project.identifier: project for project in changes.projects}
+        projects = [updated_projects.pop(project.identifier, project)
+                    for project in previous_state.projects
+                    if project.identifier not in changes.removed_project_ids]
+        projects.extend(updated_projects.values())
+        changed_project_ids.update(project.identifier for project in changes.projects)
+
+        state = TodoistBackupState(changes.sync_token, None, projects, item_projects)
+        return state, changed_project_ids
+
+    @staticmethod
+    def __open_previous_backup(
+            previous_state: Optional[TodoistBackupState]) -> ContextManager[Optional[VirtualFs]]:
+        if previous_state is None or previous_state.backup_path is None:
+            return contextlib.nullcontext()
+        if os.path.isdir(previous_state.backup_path):
+            return DirectoryVirtualFs(previous_state.backup_path, read_only=True)
+        return ZipVirtualFs(previous_state.backup_path, read_only=True)
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+""" Persistence of the synchronization state between incremental backups """
+from abc import ABCMeta, abstractmethod
+import json
+import os
+import tempfile
+from typing import Dict, List, NamedTuple, Optional
+from .todoist_api import TodoistProjectInfo
+
+class TodoistBackupState(NamedTuple):
+    """ Represents what is known about the Todoist account as of the previous backup """
+    sync_token: str
+    backup_path: Optional[str]
+    projects: List[TodoistProjectInfo]
+    item_projects: Dict[str, str] # Project ID of each item, to know which projects a change affects
+
+class BackupStateStore(metaclass=ABCMeta):
+    """ Stores the synchronization state between incremental backups """
+
+    @abstractmethod
+    def load(self) -> Optional[TodoistBackupState]:
+        """ Loads the state of the previous backup, if any """
+
+    @abstractmethod
+    def save(self, state: TodoistBackupState) -> None:
+        """ Saves the state of the current backup """
+
+class FileBackupStateStore(BackupStateStore):
+    """ Stores the synchronization state between incremental backups in a JSON file """
+    __path: str
+
+    def __init__(self, path: str):
+        self.__path = path
+
+    def load(self) -> Optional[TodoistBackupState]:
+        try:
+            with open(self.__path, encoding='utf-8') as state_file:
+                state_json = json.load(state_file)
+            return TodoistBackupState(
+                state_json["sync_token"], state_json["backup_path"],
+                [TodoistProjectInfo(project["name"], project["id"])
+                 for project in state_json["projects"]],
+                state_json["item_projects"])
+        except FileNotFoundError:
+            return None
+
+    def save(self, state: TodoistBackupState) -> None:
+        state_json = {
+            "sync_token": state.sync_token,
+            "backup_path": state.backup_path,
+            "projects": [{"id": project.identifier, "name": project.name}
+                         for project in state.projects],
+            "item_projects": state.item_projects,
+        }
+
+        # Replace the file atomically, so an interrupted write doesn't lose the previous state
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.__path)),
+                                              suffix=".tmp")
+        try:
+            with os.fdopen(temp_fd, 'w', encoding='utf-8') as temp_file:
+                json.dump(state_json, temp_file)
+            os.replace(temp_path, self.__path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+""" Utility to verify the integrity of Todoist backup ZIPs """
+import hashlib
+import json
+import zipfile
+import zlib
+from typing import Dict, List, NamedTuple, Optional
+from .utils import parallel_ordered_map
+from .tracer import Tracer
+from .virtual_fs import ZipVirtualFs
+from .backup_attachments_downloader import TodoistBackupAttachmentsDownloader
+
+class BackupVerificationResult(NamedTuple):
+    """ Represents the problems found when verifying a backup (none if it is correct) """
+    path: str
+    problems: List[str]
+
+class TodoistBackupVerifier:
+    """ Verifies the integrity of Todoist backup ZIPs:
+        - The CRC of every file in the ZIP must match its contents.
+        - The SHA-256 of every file listed in the manifests of the ZIP must match its contents.
+        - For backups with attachments, all the attachments referenced by the CSV files
+          must be in the backup. """
+    __CHUNK_SIZE = 64 * 1024
+
+    __tracer: Tracer
+    __attachments_downloader: TodoistBackupAttachmentsDownloader
+    __jobs: int
+
+    def __init__(self, tracer: Tracer, attachments_downloader: TodoistBackupAttachmentsDownloader,
+                 jobs: int = 1):
+        self.__tracer = tracer
+        self.__attachments_downloader = attachments_downloader
+        self.__jobs = jobs
+
+    @staticmethod
+    def __read_manifest_hashes(zip_file: zipfile.ZipFile) -> Dict[str, str]:
+        """ Reads the SHA-256 of each file listed in the manifests of the ZIP.
+            If a file was written more than once, the latest session wins """
+        hashes = {}
+        for name in sorted(zip_file.namelist()):
+            if ZipVirtualFs.is_session_manifest(name):
+                for line in zip_file.read(name).decode().splitlines():
+                    record = json.loads(line)
+                    hashes[record["path"]] = record["sha256"]
+        return hashes
+
+    def __verify_entry(self, zip_file: zipfile.ZipFile, zip_info: zipfile.ZipInfo,
+                       expected_sha256: Optional[str]) -> Optional[str]:
+        """ Reads a file of the ZIP, which checks its CRC, while computing its SHA-256.
+            Returns the problem found, if any """
+        sha256 = hashlib.sha256()
+        try:
+            # Reads of different files of the same ZipFile can happen concurrently
+            with zip_file.open(zip_info) as entry_file:
+                for chunk in iter(lambda: entry_file.read(self.__CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+        except (zipfile.BadZipFile, zlib.error, EOFError, OSError) as exception:
+            return f"'{zip_info.filename}' is corrupted: {exception}"
+
+        if expected_sha256 is not None and sha256.hexdigest() != expected_sha256:
+            return f"'{zip_info.filename}' doesn't match the SHA-256 in the manifest"
+        return None
+
+    def __verify_backup(self, path: str, entry_jobs: int) -> BackupVerificationResult:
+        self.__tracer.trace(f"Verifying backup '{path}'...")
+        try:
+            with zipfile.ZipFile(path) as zip_file:
+                manifest_hashes = self.__read_manifest_hashes(zip_file)
+                problems = [problem for problem in parallel_ordered_map(
+                    lambda zip_info: self.__verify_entry(
+                        zip_file, zip_info, manifest_hashes.get(zip_info.filename)),
+                    zip_file.infolist(), entry_jobs) if problem is not None]
+                problems.extend(f"'{name}' is in the manifest, but not in the backup"
+                                for name in manifest_hashes
+                                if name not in zip_file.NameToInfo)
+
+            if not problems:
+                with ZipVirtualFs(path, read_only=True) as vfs:
+                    problems.extend(f"Attachment '{attachment_path}' is missing"
+                                    for attachment_path in
+                                    self.__attachments_downloader.find_missing_attachments(vfs))
+        except (zipfile.BadZipFile, OSError, ValueError) as exception:
+            return BackupVerificationResult(path, [f"Can't be read: {exception}"])
+
+        return BackupVerificationResult(path, problems)
+
+    def verify(self, paths: List[str]) -> List[BackupVerificationResult]:
+        """ Verifies the given backups, returning the problems found in each one,
+            in the same order as the paths """
+        # The workers are split between the backups, and the files of each backup,
+        # so that both many small backups and a single big backup are verified in parallel
+        backup_jobs = max(1, min(self.__jobs, len(paths)))
+        entry_jobs = max(1, self.__jobs // backup_jobs)
+        return list(parallel_ordered_map(lambda path: self.__verify_backup(path, entry_jobs),
+                                         paths, backup_jobs))
@@ -2,7 +2,7 @@
 """ Provides frontend-independent access to the functions of the interface """
 
 from abc import ABCMeta, abstractmethod
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 from .tracer import Tracer
 from .virtual_fs import VirtualFs
 from .backup_downloader import TodoistBackupDownloader
@@ -12,6 +12,20 @@ class TodoistAuth(NamedTuple):
     """ Represents the properties of a Todoist attachment """
     token: str
 
+class DownloadOptions(NamedTuple):
+    """ Represents the options of a backup download, besides the authorization """
+    jobs: int = 1 # Number of downloads to run in parallel
+    use_asyncio: bool = False # Run the parallel downloads as asyncio tasks instead of threads
+    cache_dir: Optional[str] = None # Directory of the HTTP cache of the attachments
+    cache_max_size_mib: int = 1024
+    state_file: Optional[str] = None # Synchronization state, for incremental backups
+    attachment_store_dir: Optional[str] = None
+    attachment_journal_dir: Optional[str] = None
+    prefetch_attachments: bool = False # Download attachments while the projects are exported
+    prefetch_max_size_mib: int = 256 # Size of the attachments downloaded ahead of packing
+    snapshot_format: Optional[str] = None # 'csv' or 'json' to export from a single snapshot
+    trace_file: Optional[str] = None # File where the spans are traced as JSON lines
+
 class ControllerDependencyInjector(metaclass=ABCMeta):
     """ Rudimentary dependency injection container for the controller """
 
@@ -30,6 +44,9 @@ class ControllerDependencyInjector(metaclass=ABCMeta):
     def backup_attachments_downloader(self) -> TodoistBackupAttachmentsDownloader:
         """ Gets an instance of the Todoist backup attachment downloader """
 
+    def close(self) -> None:
+        """ Releases the resources kept by the dependencies, once they are no longer used """
+
 class Controller:
     """ Provides frontend-independent access to the functions of the interface """
 
@@ -39,6 +56,15 @@ class Controller:
 
     def download(self, vfs: VirtualFs, with_attachments: bool) -> None:
         """ Generates a Todoist backup ZIP from the current Todoist items """
-        self.__dependencies.backup_downloader.download(vfs)
-        if with_attachments:
-            self.__dependencies.backup_attachments_downloader.download_attachments(vfs)
+        if not with_attachments:
+            self.__dependencies.backup_downloader.download(vfs)
+            return
+
+        # The attachments are downloaded while the projects are still being exported
+        attachments_downloader = self.__dependencies.backup_attachments_downloader
+        scanning_vfs = attachments_downloader.scan_written_files(vfs)
+        try:
+            self.__dependencies.backup_downloader.download(scanning_vfs)
+            attachments_downloader.download_attachments(scanning_vfs)
+        finally:
+            attachments_downloader.finish_scanning(scanning_vfs)
@@ -2,20 +2,40 @@
 """ Implementation of the console frontend of the Todoist backup utility """
 
 import argparse
+import contextlib
 import os
+import sys
+import zipfile
 import getpass
 from pathlib import Path
-from typing import Callable, List, Mapping, Optional
-from .virtual_fs import ZipVirtualFs
-from .controller import TodoistAuth, Controller, ControllerDependencyInjector
+from typing import IO, Callable, ContextManager, List, Mapping, Optional
+from .virtual_fs import VirtualFs, ZipVirtualFs, ZipCompressionPolicy, DirectoryVirtualFs
+from .virtual_fs import TarVirtualFs
+from .controller import TodoistAuth, Controller, ControllerDependencyInjector, DownloadOptions
+from .backup_verifier import TodoistBackupVerifier
 
 class ConsoleFrontend:
     """ Implementation of the console frontend for the Todoist backup tool """
+    __COMPRESSION_METHODS = {
+        "stored": zipfile.ZIP_STORED,
+        "deflate": zipfile.ZIP_DEFLATED,
+        "bzip2": zipfile.ZIP_BZIP2,
+        "lzma": zipfile.ZIP_LZMA,
+    }
+    __TAR_COMPRESSIONS = {
+        "tar": "",
+        "tar.gz": "gz",
+        "tar.xz": "xz",
+    }
+
     def __init__(self, controller_factory: Callable[[ControllerDependencyInjector], Controller],
-                 controller_dependencies_factory: Callable[[TodoistAuth, bool, bool],
-                                                           ControllerDependencyInjector]):
+                 controller_dependencies_factory: Callable[
+                     [TodoistAuth, bool, bool, DownloadOptions], ControllerDependencyInjector],
+                 backup_verifier_factory: Optional[
+                     Callable[[bool, int], TodoistBackupVerifier]] = None):
         self.__controller_factory = controller_factory
         self.__controller_dependencies_factory = controller_dependencies_factory
+        self.__backup_verifier_factory = backup_verifier_factory
 
     @staticmethod
     def __add_authorization_group(parser: argparse.ArgumentParser) -> None:
@@ -28,6 +48,13 @@ class ConsoleFrontend:
         # Using either interactive console input, environment variables or files is recommended
         token_group.add_argument("--token", type=str, help=argparse.SUPPRESS)
 
+    @staticmethod
+    def __positive_int(value: str) -> int:
+        number = int(value)
+        if number < 1:
+            raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+        return number
+
     def __parse_command_line_args(self, prog: str, arguments: List[str]) -> argparse.Namespace:
         epilog_str = f"Example: {prog} download\n"
         epilog_str += "(The necessary credentials will be asked through the command line.\n"
@@ -45,12 +72,88 @@ class ConsoleFrontend:
         parser_download.add_argument("--with-attachments", action="store_true",
                                      help="download attachments and attach to the backup file")
         parser_download.add_argument("--output-file", type=str,
-                                     help="name of the file that will store the backup")
+                                     help="name of the file that will store the backup\n"
+                                          "(or '-' to write a tar backup to standard output)")
+        parser_download.add_argument("--output-format",
+                                     choices=("zip", "dir") + tuple(self.__TAR_COMPRESSIONS),
+                                     default="zip",
+                                     help="store the backup as a ZIP file, as a directory\n"
+                                          "of plain files, or as a tar file (default: zip)")
         parser_download.add_argument("--use-relative-dates", action="store_true",
                                      help="export dates as relative (e.g. 'in 12 days') in CSV")
+        parser_download.add_argument("--compression", choices=self.__COMPRESSION_METHODS,
+                                     default="stored",
+                                     help="compression method for the files in the backup,\n"
+                                          "except for already compressed attachments\n"
+                                          "(default: stored)")
+        parser_download.add_argument("--compression-level", type=int, choices=range(10),
+                                     metavar="{0-9}",
+                                     help="compression level, from 0 (fastest) to 9 (smallest)\n"
+                                          "for deflate, or from 1 to 9 for bzip2")
+        parser_download.add_argument("--jobs", type=self.__positive_int, default=1,
+                                     help="number of downloads to run in parallel (default: 1)")
+        parser_download.add_argument("--use-asyncio", action="store_true",
+                                     help="run the parallel downloads as asyncio tasks,\n"
+                                          "instead of using a thread for each one")
+        parser_download.add_argument("--cache-dir", type=str,
+                                     help="directory where downloaded attachments are cached,\n"
+                                          "so they are only downloaded again if they changed")
+        parser_download.add_argument("--cache-max-size", type=self.__positive_int, default=1024,
+                                     help="maximum size of the cache in MiB (default: 1024)")
+        parser_download.add_argument("--state-file", type=str,
+                                     help="file where the synchronization state is kept between\n"
+                                          "backups, to only export the projects that changed")
+        parser_download.add_argument("--attachment-store", type=str,
+                                     help="directory where attachments are stored once for all\n"
+                                          "backups, which then only list the attachments they use")
+        parser_download.add_argument("--attachment-journal", type=str,
+                                     help="directory where downloaded attachments are recorded\n"
+                                          "until the backup is complete, so an interrupted\n"
+                                          "backup can resume without downloading them again")
+        parser_download.add_argument("--prefetch-attachments", action="store_true",
+                                     help="start downloading the first attachments while\n"
+                                          "the projects are still being exported")
+        parser_download.add_argument("--prefetch-max-size", type=self.__positive_int, default=256,
+                                     help="maximum size in MiB of the attachments downloaded\n"
+                                          "while the projects are exported (default: 256)")
+        parser_download.add_argument("--snapshot", choices=("csv", "json"),
+                                     help="export everything with a single Sync API request,\n"
+                                          "instead of requesting the CSV file of each project,\n"
+                                          "either as CSV files or as JSON with all the details")
+        parser_download.add_argument("--trace-file", type=str,
+                                     help="file where the duration of each phase and request\n"
+                                          "is recorded, as JSON lines")
         self.__add_authorization_group(parser_download)
 
-        return parser.parse_args(arguments)
+        # create the parser for the "verify" command
+        if self.__backup_verifier_factory is not None:
+            parser_verify = subparsers.add_parser('verify', help='verify the integrity of backups')
+            parser_verify.set_defaults(func=self.handle_verify)
+            parser_verify.add_argument("backups", nargs="+", metavar="backup",
+                                       help="path to a backup ZIP file")
+            parser_verify.add_argument("--jobs", type=self.__positive_int, default=1,
+                                       help="number of files to verify in parallel (default: 1)")
+
+        args = parser.parse_args(arguments)
+        if (getattr(args, "output_file", None) == "-" and
+                args.output_format not in self.__TAR_COMPRESSIONS):
+            parser.error("only tar backups can be written to standard output")
+        if getattr(args, "compression_level", None) is not None:
+            levels = ZipCompressionPolicy.COMPRESS_LEVELS.get(
+                self.__COMPRESSION_METHODS[args.compression], range(0))
+            if args.compression_level not in levels:
+                parser.error(f"--compression {args.compression} only supports levels "
+                             f"{levels[0]}-{levels[-1]}" if levels else
+                             f"--compression {args.compression} has no compression levels")
+        if getattr(args, "state_file", None) is not None and args.use_relative_dates:
+            # Relative dates in the unchanged projects copied from the previous backup are stale
+            parser.error("--state-file can't be combined with --use-relative-dates")
+        if getattr(args, "snapshot", None) is not None:
+            if args.state_file is not None:
+                parser.error("--snapshot can't be combined with --state-file")
+            if args.snapshot == "json" and args.with_attachments:
+                parser.error("attachments can only be downloaded for --snapshot csv")
+        return args
 
     def run(self, prog: str, arguments: List[str], environment: Mapping[str, str]) -> None:
         """ Runs the Todoist backup tool frontend with the specified command line arguments """
@@ -99,14 +202,64 @@ class ConsoleFrontend:
 
     def handle_download(self, args: argparse.Namespace, environment: Mapping[str, str]) -> None:
         """ Handles the download subparser with the specified command line arguments """
+        # If the backup goes to the standard output, keep any other output out of it,
+        # including the warnings and prompts while getting the credentials
+        if args.output_file == "-":
+            stdout = sys.stdout.buffer
+            with contextlib.redirect_stdout(sys.stderr):
+                self.__download(args, environment, stdout)
+        else:
+            self.__download(args, environment, None)
 
+    def __download(self, args: argparse.Namespace, environment: Mapping[str, str],
+                   stdout: Optional[IO[bytes]]) -> None:
         # Configure controller
         auth = self.__get_auth(args, environment)
         dependencies = self.__controller_dependencies_factory(
-            auth, args.verbose, args.use_relative_dates)
+            auth, args.verbose, args.use_relative_dates, DownloadOptions(
+                jobs=args.jobs, use_asyncio=args.use_asyncio, cache_dir=args.cache_dir,
+                cache_max_size_mib=args.cache_max_size, state_file=args.state_file,
+                attachment_store_dir=args.attachment_store,
+                attachment_journal_dir=args.attachment_journal,
+                prefetch_attachments=args.prefetch_attachments,
+                prefetch_max_size_mib=args.prefetch_max_size,
+                snapshot_format=args.snapshot, trace_file=args.trace_file))
         controller = self.__controller_factory(dependencies)
 
-        # Setup zip virtual fs
-        with ZipVirtualFs(args.output_file) as zipvfs:
-            # Execute requested action
-            controller.download(zipvfs, with_attachments=args.with_attachments)
+        # Setup virtual fs
+        vfs: ContextManager[VirtualFs]
+        if args.output_format == "dir":
+            vfs = DirectoryVirtualFs(args.output_file)
+        elif args.output_format in self.__TAR_COMPRESSIONS:
+            vfs = TarVirtualFs(None if stdout else args.output_file,
+                               self.__TAR_COMPRESSIONS[args.output_format], stdout)
+        else:
+            compression_policy = ZipCompressionPolicy(
+                self.__COMPRESSION_METHODS[args.compression], args.compression_level)
+            vfs = ZipVirtualFs(args.output_file, compression_policy=compression_policy,
+                               tracer=dependencies.tracer)
+
+        try:
+            with vfs as opened_vfs:
+                # Execute requested action
+                controller.download(opened_vfs, with_attachments=args.with_attachments)
+        finally:
+            dependencies.close()
+
+    def handle_verify(self, args: argparse.Namespace, _environment: Mapping[str, str]) -> None:
+        """ Handles the verify subparser with the specified command line arguments """
+        assert self.__backup_verifier_factory is not None
+        backup_verifier = self.__backup_verifier_factory(args.verbose, args.jobs)
+
+        any_problems = False
+        for result in backup_verifier.verify(args.backups):
+            if not result.problems:
+                print(f"OK {result.path}")
+                continue
+
+            any_problems = True
+            for problem in result.problems:
+                print(f"FAILED {result.path}: {problem}")
+
+        if any_problems:
+            sys.exit(1)
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+""" Persistent on-disk cache of HTTP responses, revalidated through ETag / Last-Modified """
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import IO, Dict, NamedTuple, Optional
+
+class HTTPCacheEntry(NamedTuple):
+    """ Represents a response stored in the HTTP cache """
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    size: int
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        """ Gets the HTTP headers to revalidate the cached response with the server """
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+class HTTPCache:
+    """ Persistent on-disk cache of HTTP responses, indexed by URL.
+        Only responses that can be revalidated (with an ETag or Last-Modified) are stored.
+        The total size of the stored responses is bounded, evicting the least recently
+        used ones when it is exceeded. """
+    __CHUNK_SIZE = 64 * 1024
+    # The files of each response are named after the SHA-256 of its URL, so other files
+    # in the directory (e.g. if it is shared with something else) are never touched
+    __KEY_REGEXP = re.compile(r"[0-9a-f]{64}")
+
+    def __init__(self, directory: str, max_size: int):
+        self.__directory = directory
+        self.__max_size = max_size
+        self.__lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Rebuild the index from the metadata files, in least to most recently used order
+        entries_by_key = {}
+        last_used_by_key = {}
+        for file_name in os.listdir(directory):
+            key, ext = os.path.splitext(file_name)
+            if ext != ".json" or not self.__KEY_REGEXP.fullmatch(key):
+                continue
+            try:
+                metadata_path = os.path.join(directory, file_name)
+                with open(metadata_path, encoding='utf-8') as metadata_file:
+                    entries_by_key[key] = HTTPCacheEntry(**json.load(metadata_file))
+                last_used_by_key[key] = os.stat(metadata_path).st_mtime
+            except (OSError, ValueError, TypeError):
+                self.__remove_files(key)
+
+        self.__entries: Dict[str, HTTPCacheEntry] = {
+            key: entries_by_key[key]
+            for key in sorted(entries_by_key, key=lambda key: last_used_by_key[key])}
+        self.__size = sum(entry.size for entry in self.__entries.values())
+
+    @staticmethod
+    def __key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def __data_path(self, key: str) -> str:
+        return os.path.join(self.__directory, key + ".data")
+
+    def __metadata_path(self, key: str) -> str:
+        return os.path.join(self.__directory, key + ".json")
+
+    def __remove_files(self, key: str) -> None:
+        for path in (self.__metadata_path(key), self.__data_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, url: str) -> Optional[HTTPCacheEntry]:
+        """ Gets the cached response for the given URL, if any """
+        with self.__lock:
+            return self.__entries.get(self.__key(url))
+
+    def read_to(self, entry: HTTPCacheEntry, output: IO[bytes]) -> bool:
+        """ Writes the body of the given cached response to the file object,
+            and marks it as recently used. Returns False if it is no longer cached. """
+        key = self.__key(entry.url)
+        try:
+            with open(self.__data_path(key), 'rb') as data_file:
+                shutil.copyfileobj(data_file, output, self.__CHUNK_SIZE)
+        except FileNotFoundError:
+            return False
+
+        with self.__lock:
+            if self.__entries.get(key) == entry:
+                self.__entries[key] = self.__entries.pop(key)
+                try:
+                    os.utime(self.__metadata_path(key))
+                except FileNotFoundError:
+                    pass
+        return True
+
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str],
+            data: IO[bytes]) -> None:
+        """ Stores the response for the given URL, whose body is read from the current position
+            of the given file object. Does nothing if the response can't be revalidated """
+        if etag is None and last_modified is None:
+            return
+
+        key = self.__key(url)
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.__directory, suffix=".tmp")
+        try:
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                shutil.copyfileobj(data, temp_file, self.__CHUNK_SIZE)
+            entry = HTTPCacheEntry(url, etag, last_modified, os.path.getsize(temp_path))
+            if entry.size > self.__max_size:
+                return
+
+            with self.__lock:
+                old_entry = self.__entries.pop(key, None)
+                if old_entry:
+                    self.__size -= old_entry.size
+
+                os.replace(temp_path, self.__data_path(key))
+                with open(self.__metadata_path(key), 'w', encoding='utf-8') as metadata_file:
+                    json.dump(entry._asdict(), metadata_file)
+                self.__entries[key] = entry
+                self.__size += entry.size
+
+                self.__evict()
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def __evict(self) -> None:
+        """ Evicts the least recently used responses, which are the first ones in the index,
+            until the cache is within its maximum size """
+        while self.__size > self.__max_size:
+            evicted_key = next(iter(self.__entries))
+            self.__size -= self.__entries.pop(evicted_key).size
+            self.__remove_files(evicted_key)
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+""" Incremental decoding of large JSON documents """
+import codecs
+import json
+from typing import IO, Any, Collection, Iterator, Tuple
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = " \t\n\r"
+# Characters that can continue a number, e.g. "1" may be the start of "1.5" or "1e3"
+_NUMBER_CHARS = "0123456789.eE+-"
+
+class _JsonStreamReader:
+    """ Decodes JSON values from a binary stream, only keeping in memory
+        the part of the stream which has not been decoded yet """
+
+    def __init__(self, stream: IO[bytes]):
+        self.__stream = stream
+        self.__text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.__json_decoder = json.JSONDecoder()
+        self.__buffer = ""
+        self.__position = 0
+        self.__eof = False
+
+    def __fill(self) -> None:
+        """ Reads more data into the buffer, discarding the data already decoded """
+        # Read at least as much as is pending, so decoding a huge value takes linear time
+        pending = self.__buffer[self.__position:]
+        data = self.__stream.read(max(CHUNK_SIZE, len(pending)))
+        self.__eof = not data
+        self.__buffer = pending + self.__text_decoder.decode(data, final=self.__eof)
+        self.__position = 0
+
+    def error(self, message: str) -> json.JSONDecodeError:
+        """ Creates an exception for a syntax error at the current position """
+        return json.JSONDecodeError(message, self.__buffer, self.__position)
+
+    def peek(self) -> str:
+        """ Skips any whitespace, and returns the next character (or "" at the end) """
+        while True:
+            while (self.__position < len(self.__buffer) and
+                   self.__buffer[self.__position] in _WHITESPACE):
+                self.__position += 1
+            if self.__position < len(self.__buffer) or self.__eof:
+                return self.__buffer[self.__position:self.__position + 1]
+            self.__fill()
+
+    def expect(self, char: str) -> None:
+        """ Skips the given character, which must be the next one """
+        if self.peek() != char:
+            raise self.error(f"Expecting '{char}'")
+        self.__position += 1
+
+    def value(self) -> Any:
+        """ Decodes the next value """
+        self.peek()
+        while True:
+            try:
+                value, end = self.__json_decoder.raw_decode(self.__buffer, self.__position)
+                # A number at the end of the buffer may continue in the next chunk,
+                # even if only part of it was decoded (e.g. "1" out of "1.")
+                if self.__eof or (end < len(self.__buffer) and
+                                  self.__buffer[end] not in _NUMBER_CHARS):
+                    self.__position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.__eof:
+                    raise
+            self.__fill()
+
+def _iterate_json_member(reader: _JsonStreamReader,
+                         array_keys: Collection[str]) -> Iterator[Tuple[str, Any]]:
+    key = reader.value()
+    if not isinstance(key, str):
+        raise reader.error("Expecting property name enclosed in double quotes")
+    reader.expect(":")
+
+    if key not in array_keys or reader.peek() != "[":
+        yield key, reader.value()
+        return
+
+    reader.expect("[")
+    if reader.peek() != "]":
+        yield key, reader.value()
+        while reader.peek() == ",":
+            reader.expect(",")
+            yield key, reader.value()
+    reader.expect("]")
+
+def iterate_json_object(stream: IO[bytes],
+                        array_keys: Collection[str]) -> Iterator[Tuple[str, Any]]:
+    """ Yields the members of the JSON object in the given stream as (key, value) pairs,
+        as they are decoded. The arrays of the given keys are not decoded as a whole, instead
+        each of their elements is yielded as a (key, element) pair, so only one of them
+        needs to be kept in memory at a time """
+    reader = _JsonStreamReader(stream)
+    reader.expect("{")
+    if reader.peek() != "}":
+        yield from _iterate_json_member(reader, array_keys)
+        while reader.peek() == ",":
+            reader.expect(",")
+            yield from _iterate_json_member(reader, array_keys)
+    reader.expect("}")
+
+    if reader.peek() != "":
+        raise reader.error("Extra data")
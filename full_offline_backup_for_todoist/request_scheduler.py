@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+""" Scheduler that decides when HTTP requests are sent and retried,
+    adapting to the rate limits of the servers """
+import email.utils
+import random
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional
+
+# HTTP status codes after which a request may succeed if it is retried
+RETRYABLE_STATUS_CODES = frozenset((408, 425, 429, 500, 502, 503, 504))
+RATE_LIMITED_STATUS_CODES = frozenset((429, 503))
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """ Parses the value of a 'Retry-After' HTTP header (either a number of seconds or a date)
+        into a number of seconds to wait, or None if it is missing or invalid """
+    if value is None:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_date.timestamp() - (time.time() if now is None else now))
+
+class _HostState:
+    """ Token bucket limiting the rate of the requests sent to a single host """
+    rate: float
+    tokens: float
+    last_refill: float
+    blocked_until: float
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.tokens = burst
+        self.last_refill = now
+        self.blocked_until = now
+
+class RequestSchedulerConfig(NamedTuple):
+    """ Represents the tuning parameters of the request scheduler """
+    max_retries: int = 3
+    initial_rate: float = 50.0 # Requests per second to each host, also the maximum rate
+    min_rate: float = 0.1
+    burst: float = 10.0 # Requests that can be sent at once, after a while without requests
+    backoff_base: float = 3.0 # The backoff before retry N is backoff_base ** N seconds
+    max_backoff: float = 60.0
+    max_retry_after: float = 15 * 60.0 # Longer 'Retry-After' delays are capped to this
+    min_retry_budget: float = 10.0 # Retries allowed before any request is sent
+    retry_budget_ratio: float = 0.2 # Retries allowed for each request sent
+
+class RequestScheduler:
+    """ Decides when HTTP requests are sent and retried:
+        - The requests to each host are limited by a token bucket, whose rate is halved when
+          the host signals that it is rate limiting us, and slowly raised back on success.
+        - Failed requests are only retried if the failure is transient, after the delay
+          requested by the server through 'Retry-After' or a jittered exponential backoff.
+        - Retries spend from a global budget that is refilled by every request,
+          so that a failing server doesn't multiply the load by the number of retries. """
+
+    def __init__(self, config: Optional[RequestSchedulerConfig] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.__config = config or RequestSchedulerConfig()
+        self.__clock = clock
+
+        self.__lock = threading.Lock()
+        self.__hosts: Dict[str, _HostState] = {}
+        self.__retry_budget = self.__config.min_retry_budget
+
+    def __get_host_state(self, host: str, now: float) -> _HostState:
+        host_state = self.__hosts.get(host)
+        if host_state is None:
+            host_state = _HostState(self.__config.initial_rate, self.__config.burst, now)
+            self.__hosts[host] = host_state
+        return host_state
+
+    def reserve(self, host: str) -> float:
+        """ Reserves the sending of a request to the given host.
+            Returns the number of seconds to wait before sending it """
+        with self.__lock:
+            now = self.__clock()
+            host_state = self.__get_host_state(host, now)
+            host_state.tokens = min(self.__config.burst, host_state.tokens +
+                                    (now - host_state.last_refill) * host_state.rate)
+            host_state.last_refill = now
+
+            # The tokens can become negative, meaning that they are reserved for future requests
+            host_state.tokens -= 1
+            self.__retry_budget = min(self.__retry_budget + self.__config.retry_budget_ratio,
+                                      self.__config.min_retry_budget * 10)
+            return max(0.0, -host_state.tokens / host_state.rate,
+                       host_state.blocked_until - now)
+
+    def on_success(self, host: str) -> None:
+        """ Notifies that a request to the given host has succeeded """
+        with self.__lock:
+            host_state = self.__get_host_state(host, self.__clock())
+            host_state.rate = min(self.__config.initial_rate,
+                                  host_state.rate + self.__config.initial_rate / 100)
+
+    def on_failure(self, host: str, attempt: int, status: Optional[int],
+                   retry_after: Optional[float]) -> Optional[float]:
+        """ Notifies that a request to the given host has failed, either with an HTTP status
+            code or with no status at all (e.g. a network error), on the given attempt number
+            (starting from zero). Returns the number of seconds to wait before retrying it,
+            or None if it should not be retried """
+        with self.__lock:
+            now = self.__clock()
+            host_state = self.__get_host_state(host, now)
+            if status in RATE_LIMITED_STATUS_CODES:
+                host_state.rate = max(self.__config.min_rate, host_state.rate / 2)
+                if retry_after is not None:
+                    # Hold back all the requests to this host, not only this one
+                    host_state.blocked_until = max(
+                        host_state.blocked_until,
+                        now + min(retry_after, self.__config.max_retry_after))
+
+            if status is not None and status not in RETRYABLE_STATUS_CODES:
+                return None
+            if attempt >= self.__config.max_retries or self.__retry_budget < 1:
+                return None
+            self.__retry_budget -= 1
+
+            backoff = min(self.__config.max_backoff, self.__config.backoff_base ** attempt)
+            delay = backoff / 2 + random.uniform(0, backoff / 2)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.__config.max_retry_after))
+            return delay
@@ -1,23 +1,56 @@
 #!/usr/bin/python3
 """ Implementation of the dependency injection container for the actual runtime objects """
 
-from .controller import ControllerDependencyInjector, TodoistAuth
+from typing import Optional
+from .controller import ControllerDependencyInjector, TodoistAuth, DownloadOptions
 from .todoist_api import TodoistApi
-from .backup_downloader import TodoistBackupDownloader
+from .backup_downloader import TodoistBackupDownloader, BackupDownloaderOptions
 from .backup_attachments_downloader import TodoistBackupAttachmentsDownloader
-from .tracer import Tracer, ConsoleTracer, NullTracer
-from .url_downloader import URLLibURLDownloader
+from .backup_attachments_downloader import AttachmentsDownloaderOptions
+from .backup_verifier import TodoistBackupVerifier
+from .tracer import Tracer, ConsoleTracer, NullTracer, JsonLinesTracer
+from .url_downloader import URLDownloader, URLLibURLDownloader, AsyncURLDownloader
+from .http_cache import HTTPCache
+from .backup_state import FileBackupStateStore
+from .attachment_store import AttachmentStore
+from .attachment_journal import AttachmentJournal
+
+def _create_tracer(verbose: bool, trace_file: Optional[str] = None) -> Tracer:
+    tracer: Tracer = ConsoleTracer() if verbose else NullTracer()
+    return JsonLinesTracer(trace_file, tracer) if trace_file else tracer
+
+def _create_url_downloader(tracer: Tracer, use_asyncio: bool, cache_dir: Optional[str],
+                           cache_max_size_mib: int) -> URLDownloader:
+    cache = HTTPCache(cache_dir, cache_max_size_mib * 1024 * 1024) if cache_dir else None
+    if use_asyncio:
+        return AsyncURLDownloader(tracer, cache=cache)
+    return URLLibURLDownloader(tracer, cache=cache)
 
 class RuntimeControllerDependencyInjector(ControllerDependencyInjector):
     """ Implementation of the dependency injection container for the actual runtime objects """
 
-    def __init__(self, auth: TodoistAuth, verbose: bool, use_relative_dates: bool):
-        self.__tracer = ConsoleTracer() if verbose else NullTracer()
-        urldownloader = URLLibURLDownloader(self.__tracer)
-        todoist_api = TodoistApi(auth.token, self.__tracer, urldownloader, use_relative_dates)
-        self.__backup_downloader = TodoistBackupDownloader(self.__tracer, todoist_api)
+    def __init__(self, auth: TodoistAuth, verbose: bool, use_relative_dates: bool,
+                 options: Optional[DownloadOptions] = None):
+        options = options or DownloadOptions()
+        self.__tracer = _create_tracer(verbose, options.trace_file)
+        self.__urldownloader = _create_url_downloader(
+            self.__tracer, options.use_asyncio, options.cache_dir, options.cache_max_size_mib)
+        todoist_api = TodoistApi(auth.token, self.__tracer, self.__urldownloader,
+                                 use_relative_dates)
+        self.__backup_downloader = TodoistBackupDownloader(
+            self.__tracer, todoist_api,
+            BackupDownloaderOptions(options.jobs, options.use_asyncio, options.snapshot_format),
+            FileBackupStateStore(options.state_file) if options.state_file else None)
         self.__backup_attachments_downloader = TodoistBackupAttachmentsDownloader(
-            self.__tracer, urldownloader)
+            self.__tracer, self.__urldownloader,
+            AttachmentsDownloaderOptions(
+                options.jobs, options.use_asyncio,
+                options.prefetch_max_size_mib * 1024 * 1024
+                if options.prefetch_attachments else None),
+            AttachmentStore(options.attachment_store_dir)
+            if options.attachment_store_dir else None,
+            AttachmentJournal(options.attachment_journal_dir)
+            if options.attachment_journal_dir else None)
 
     @property
     def tracer(self) -> Tracer:
@@ -30,3 +63,15 @@ class RuntimeControllerDependencyInjector(ControllerDependencyInjector):
     @property
     def backup_attachments_downloader(self) -> TodoistBackupAttachmentsDownloader:
         return self.__backup_attachments_downloader
+
+    def close(self) -> None:
+        self.__urldownloader.close()
+
+def create_backup_verifier(verbose: bool, jobs: int = 1) -> TodoistBackupVerifier:
+    """ Creates a backup verifier using the actual runtime objects """
+    tracer = _create_tracer(verbose)
+    # The attachments downloader is only used to find the attachments referenced by the backup,
+    # so nothing is ever downloaded through it
+    attachments_downloader = TodoistBackupAttachmentsDownloader(
+        tracer, URLLibURLDownloader(tracer))
+    return TodoistBackupVerifier(tracer, attachments_downloader, jobs)
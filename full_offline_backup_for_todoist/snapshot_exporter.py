@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+""" Exports the projects of a Todoist snapshot to files """
+import collections
+import csv
+import io
+import json
+from typing import Any, DefaultDict, Dict, Iterable, List, Optional
+from .todoist_api import TodoistProjectInfo, TodoistSnapshot
+
+_Row = Dict[str, Any]
+
+class TodoistSnapshotExporter:
+    """ Exports the projects of a Todoist snapshot to files, either as JSON with all the
+        resources of each project, or as CSV files with the same layout as the CSV files
+        exported by Todoist, without any further requests to the Todoist API """
+    __CSV_HEADER = ["TYPE", "CONTENT", "DESCRIPTION", "PRIORITY", "INDENT", "AUTHOR",
+                    "RESPONSIBLE", "DATE", "DATE_LANG", "TIMEZONE"]
+
+    __projects: Dict[str, _Row]
+    __sections_by_project: DefaultDict[str, List[_Row]]
+    __items_by_project: DefaultDict[str, List[_Row]]
+    __notes_by_item: DefaultDict[str, List[_Row]]
+    __labels: List[_Row]
+    __user_names: Dict[str, str]
+    __account_user: _Row
+
+    def __init__(self, snapshot: TodoistSnapshot):
+        def active_rows(resource_type: str) -> Iterable[_Row]:
+            return (row for row in snapshot.resources.get(resource_type, [])
+                    if not row.get("is_deleted") and not row.get("is_archived"))
+
+        self.__projects = {row["id"]: row for row in active_rows("projects")}
+        self.__sections_by_project = collections.defaultdict(list)
+        for row in active_rows("sections"):
+            self.__sections_by_project[row["project_id"]].append(row)
+        self.__items_by_project = collections.defaultdict(list)
+        for row in active_rows("items"):
+            self.__items_by_project[row["project_id"]].append(row)
+        self.__notes_by_item = collections.defaultdict(list)
+        for row in active_rows("notes"):
+            self.__notes_by_item[row["item_id"]].append(row)
+        self.__labels = list(active_rows("labels"))
+
+        self.__account_user = snapshot.resources.get("user") or {}
+        self.__user_names = {row["id"]: row["full_name"]
+                             for row in snapshot.resources.get("collaborators", [])}
+        if self.__account_user.get("id") is not None:
+            self.__user_names[self.__account_user["id"]] = self.__account_user.get("full_name", "")
+
+    def export_project_as_json(self, project: TodoistProjectInfo) -> bytes:
+        """ Exports the specified project, with its sections, items and comments, as JSON """
+        items = self.__items_by_project[project.identifier]
+        return json.dumps({
+            "project": self.__projects[project.identifier],
+            "sections": self.__sections_by_project[project.identifier],
+            "items": items,
+            "notes": [note for item in items for note in self.__notes_by_item[item["id"]]],
+        }, ensure_ascii=False, indent=2).encode()
+
+    def export_labels_as_json(self) -> bytes:
+        """ Exports the labels of the account as JSON """
+        return json.dumps(self.__labels, ensure_ascii=False, indent=2).encode()
+
+    def __user(self, user_id: Optional[str]) -> str:
+        if user_id is None:
+            return ""
+        return f"{self.__user_names.get(user_id, '')} ({user_id})"
+
+    def __write_items(self, writer: Any, items: List[_Row]) -> None:
+        """ Writes the given items as CSV rows, with the subtasks after their parent task """
+        item_ids = {item["id"] for item in items}
+        owner_id = self.__account_user.get("id")
+        timezone = (self.__account_user.get("tz_info") or {}).get("timezone", "")
+        children: DefaultDict[Optional[str], List[_Row]] = collections.defaultdict(list)
+        for item in items:
+            # Subtasks of an item that is not exported are exported at the top level
+            parent_id = item.get("parent_id")
+            children[parent_id if parent_id in item_ids else None].append(item)
+
+        def write_item_tree(parent_id: Optional[str], indent: int) -> None:
+            for item in sorted(children[parent_id], key=lambda item: item.get("child_order", 0)):
+                if item.get("checked"):
+                    continue # Completed tasks are not exported, like in Todoist's CSV files
+
+                due = item.get("due") or {}
+                writer.writerow([
+                    "task", "".join([item["content"]] +
+                                    [f" @{label}" for label in item.get("labels", [])]),
+                    item.get("description", ""), 5 - item.get("priority", 1), indent,
+                    self.__user(item.get("added_by_uid") or owner_id),
+                    self.__user(item.get("responsible_uid")), due.get("string", ""),
+                    due.get("lang", ""), due.get("timezone") or timezone])
+                for note in self.__notes_by_item[item["id"]]:
+                    file_attachment = note.get("file_attachment")
+                    writer.writerow([
+                        "note", note.get("content", "") + (
+                            f" [[file {json.dumps(file_attachment)}]]" if file_attachment
+                            else ""),
+                        "", "", "", self.__user(note.get("posted_uid")), "", "", "", ""])
+                writer.writerow([""] * len(self.__CSV_HEADER))
+                write_item_tree(item["id"], indent + 1)
+
+        write_item_tree(None, 1)
+
+    def export_project_as_csv(self, project: TodoistProjectInfo) -> bytes:
+        """ Exports the specified project as a CSV file, with the same layout as the CSV files
+            exported by Todoist, so tasks come first, followed by each section and its tasks """
+        items_by_section: DefaultDict[Optional[str], List[_Row]] = collections.defaultdict(list)
+        for item in self.__items_by_project[project.identifier]:
+            items_by_section[item.get("section_id")].append(item)
+
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(self.__CSV_HEADER)
+        self.__write_items(writer, items_by_section.pop(None, []))
+        for section in sorted(self.__sections_by_project[project.identifier],
+                              key=lambda section: section.get("section_order", 0)):
+            writer.writerow(["section", section["name"]] + [""] * (len(self.__CSV_HEADER) - 2))
+            self.__write_items(writer, items_by_section.pop(section["id"], []))
+        return output.getvalue().encode('utf-8-sig')
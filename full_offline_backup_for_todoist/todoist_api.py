@@ -1,10 +1,13 @@
 #!/usr/bin/python3
 """ Provides access to a subset of the features of the Todoist API"""
 
+import contextlib
 import json
-from typing import List
+import tempfile
+from typing import Any, Collection, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 from .tracer import Tracer
 from .url_downloader import URLDownloader
+from .json_stream import iterate_json_object
 
 class TodoistProjectInfo:
     """ Represents the properties of a Todoist project """
@@ -16,12 +19,32 @@ class TodoistProjectInfo:
         self.name = name
         self.identifier = identifier
 
+class TodoistProjectChanges(NamedTuple):
+    """ Represents the changes to the projects since a previous synchronization """
+    sync_token: str
+    full_sync: bool # If True, all the projects and items are listed, not only the changed ones
+    projects: List[TodoistProjectInfo] # Added or updated projects
+    removed_project_ids: Set[str]
+    item_projects: Dict[str, Optional[str]] # Project ID of each changed item (None if deleted)
+    changed_project_ids: Set[str] # Projects affected by other changes, such as their sections
+    changed_note_item_ids: Set[str] # Items whose comments changed
+
+class TodoistSnapshot(NamedTuple):
+    """ Represents the whole contents of a Todoist account at some point in time """
+    sync_token: str
+    projects: List[TodoistProjectInfo] # Active projects (not archived nor deleted)
+    resources: Dict[str, Any] # Resources returned by the Sync API, by type (e.g. 'items')
+
 class TodoistApi:
     """ Provides access to a subset of the features of the Todoist API"""
 
     __BASE_URL = "https://api.todoist.com/api/v1"
     __SYNC_ENDPOINT = __BASE_URL + "/sync"
     __TEMPLATES_CSV_FILE_ENDPOINT = __BASE_URL + "/templates/file"
+    # Resource types of the snapshot with a record for each object, decoded one by one
+    __SNAPSHOT_RECORD_TYPES = frozenset([
+        "projects", "sections", "items", "notes", "project_notes", "labels", "filters",
+        "reminders", "collaborators", "collaborator_states", "live_notifications"])
 
     __tracer: Tracer
     __urldownloader: URLDownloader
@@ -34,28 +57,105 @@ class TodoistApi:
         self.__urldownloader.set_bearer_token(api_token)
         self.__use_relative_dates = use_relative_dates
 
+    @contextlib.contextmanager
+    def __sync(self, sync_token: str, resource_types: List[str],
+               array_keys: Collection[str]) -> Iterator[Iterator[Tuple[str, Any]]]:
+        """ Sends a request to the Sync API, and decodes the response incrementally,
+            yielding the records of the given resource types one by one """
+        # Keep the response on disk, so it is never held in memory as a whole
+        with self.__tracer.span("sync", resource_types=resource_types) as span, \
+             tempfile.TemporaryFile() as response_file:
+            self.__urldownloader.post_to_file(
+                self.__SYNC_ENDPOINT, response_file, {
+                    "sync_token": sync_token,
+                    "resource_types": json.dumps(resource_types),
+                })
+            span.count("bytes", response_file.tell())
+            response_file.seek(0)
+            yield iterate_json_object(response_file, array_keys)
+
     def get_projects(self) -> List[TodoistProjectInfo]:
         """ Obtains the list of all projects from the Todoist API """
         self.__tracer.trace("Fetching projects using the Todoist API...")
-        project_list_json = self.__urldownloader.post(
-            self.__SYNC_ENDPOINT, {
-                "sync_token": '*',
-                "resource_types": '["projects"]',
-            })
+        with self.__sync('*', ["projects"], ["projects"]) as members:
+            self.__tracer.trace("Parsing Todoist API projects JSON...")
+            return [TodoistProjectInfo(row["name"], row["id"])
+                    for key, row in members if key == "projects"]
 
-        self.__tracer.trace("Loading Todoist API projects JSON...")
-        project_list = json.loads(project_list_json.decode())
+    def get_project_changes(self, sync_token: str) -> TodoistProjectChanges:
+        """ Obtains the changes to the projects since the given sync token was returned,
+            or all the projects if the sync token is '*' """
+        self.__tracer.trace("Fetching project changes using the Todoist API...")
+        resource_types = (["projects", "items"] if sync_token == '*' else
+                          ["projects", "items", "sections", "notes"])
 
-        self.__tracer.trace("Parsing Todoist API projects JSON...")
-        return [TodoistProjectInfo(row["name"], row["id"]) for row in project_list["projects"]]
+        # Archived projects are not exported, so for a backup they are as good as deleted
+        def is_removed(row: Dict[str, Any]) -> bool:
+            return bool(row.get("is_deleted") or row.get("is_archived"))
 
-    def export_project_as_csv(self, project: TodoistProjectInfo) -> bytes:
-        """ Obtains the latest version of the specified project as a CSV file """
+        changes = TodoistProjectChanges("", True, [], set(), {}, set(), set())
+        with self.__sync(sync_token, resource_types, resource_types) as members:
+            self.__tracer.trace("Parsing Todoist API changes JSON...")
+            for key, value in members:
+                if key == "sync_token":
+                    changes = changes._replace(sync_token=value)
+                elif key == "full_sync":
+                    changes = changes._replace(full_sync=value)
+                elif key == "projects" and is_removed(value):
+                    changes.removed_project_ids.add(value["id"])
+                elif key == "projects":
+                    changes.projects.append(TodoistProjectInfo(value["name"], value["id"]))
+                elif key == "items":
+                    changes.item_projects[value["id"]] = (
+                        None if value.get("is_deleted") else value["project_id"])
+                elif key == "sections":
+                    changes.changed_project_ids.add(value["project_id"])
+                elif key == "notes":
+                    changes.changed_note_item_ids.add(value["item_id"])
+        if not changes.sync_token:
+            raise KeyError("sync_token")
+        return changes
+
+    def get_snapshot(self) -> TodoistSnapshot:
+        """ Obtains all the resources of the Todoist account (projects, sections, items,
+            comments, labels, etc.) through a single request to the Todoist API """
+        self.__tracer.trace("Fetching snapshot using the Todoist API...")
+        resources: Dict[str, Any] = {}
+        with self.__sync('*', ["all"], self.__SNAPSHOT_RECORD_TYPES) as members:
+            self.__tracer.trace("Parsing Todoist API snapshot JSON...")
+            for key, value in members:
+                if key in self.__SNAPSHOT_RECORD_TYPES:
+                    resources.setdefault(key, []).append(value)
+                else:
+                    resources[key] = value
+
+        return TodoistSnapshot(
+            resources["sync_token"],
+            [TodoistProjectInfo(row["name"], row["id"]) for row in resources.get("projects", [])
+             if not row.get("is_deleted") and not row.get("is_archived")],
+            resources)
+
+    def __export_project_params(self, project: TodoistProjectInfo) -> Dict[str, str]:
         self.__tracer.trace(f"Fetching project '{project.name}' (ID {project.identifier})"
             " as CSV using the Todoist API...")
 
-        return self.__urldownloader.get(
-            self.__TEMPLATES_CSV_FILE_ENDPOINT, {
-                "project_id": project.identifier,
-                "use_relative_dates": str(self.__use_relative_dates).lower(),
-            })
+        return {
+            "project_id": project.identifier,
+            "use_relative_dates": str(self.__use_relative_dates).lower(),
+        }
+
+    def export_project_as_csv(self, project: TodoistProjectInfo) -> bytes:
+        """ Obtains the latest version of the specified project as a CSV file """
+        with self.__tracer.span("export_project", project_id=project.identifier) as span:
+            csv_data = self.__urldownloader.get(
+                self.__TEMPLATES_CSV_FILE_ENDPOINT, self.__export_project_params(project))
+            span.count("bytes", len(csv_data))
+            return csv_data
+
+    async def export_project_as_csv_async(self, project: TodoistProjectInfo) -> bytes:
+        """ Like export_project_as_csv, but as a coroutine """
+        with self.__tracer.span("export_project", project_id=project.identifier) as span:
+            csv_data = await self.__urldownloader.get_async(
+                self.__TEMPLATES_CSV_FILE_ENDPOINT, self.__export_project_params(project))
+            span.count("bytes", len(csv_data))
+            return csv_data
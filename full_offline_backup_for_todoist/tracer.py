@@ -1,6 +1,33 @@
 #!/usr/bin/python3
 """ Definitions and implementations of a simple logging / tracing method """
 from abc import ABCMeta, abstractmethod
+import contextlib
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+class TraceSpan:
+    """ Represents a timed phase of the work (e.g. a request), with some attributes
+        (e.g. its URL) and counters (e.g. the number of bytes downloaded or retries) """
+    name: str
+    attributes: Dict[str, Any]
+    counters: Dict[str, int]
+    duration: Optional[float] # In seconds, once finished
+    error: Optional[str] # Exception which finished the span, if any
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.counters = {}
+        self.duration = None
+        self.error = None
+        self.__lock = threading.Lock()
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        """ Adds the given amount to a counter (may be called from any thread) """
+        with self.__lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
 
 class Tracer(metaclass=ABCMeta):
     """ Base class for implementations of a simple logging / tracing method """
@@ -9,6 +36,24 @@ class Tracer(metaclass=ABCMeta):
     def trace(self, tracestr: str) -> None:
         """ Trace a simple string """
 
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[TraceSpan]:
+        """ Times the work done inside the with block as a span with the given name
+            and attributes, which is passed to finish_span once the block is done """
+        span = TraceSpan(name, attributes)
+        start_time = time.perf_counter()
+        try:
+            yield span
+        except BaseException as exception:
+            span.error = repr(exception)
+            raise
+        finally:
+            span.duration = time.perf_counter() - start_time
+            self.finish_span(span)
+
+    def finish_span(self, span: TraceSpan) -> None:
+        """ Trace a finished span. By default, spans are not traced """
+
 class ConsoleTracer(Tracer):
     """ Implementation of the tracer that traces the strings to the console """
 
@@ -20,3 +65,29 @@ class NullTracer(Tracer):
 
     def trace(self, tracestr: str) -> None:
         pass
+
+class JsonLinesTracer(Tracer):
+    """ Implementation of the tracer that appends the strings and the finished spans to a file,
+        as a JSON object per line, so the time taken by each phase and request can be analyzed.
+        Everything is also forwarded to another tracer (e.g. to trace it to the console too) """
+
+    def __init__(self, path: str, tracer: Optional[Tracer] = None):
+        self.__path = path
+        self.__tracer = tracer or NullTracer()
+        self.__lock = threading.Lock()
+
+    def __write(self, record: Dict[str, Any]) -> None:
+        # Reopen the file for each record, so the records survive a crash
+        line = json.dumps({"time": time.time(), **record}, default=str) + "\n"
+        with self.__lock, open(self.__path, 'a', encoding='utf-8') as output:
+            output.write(line)
+
+    def trace(self, tracestr: str) -> None:
+        self.__tracer.trace(tracestr)
+        self.__write({"type": "trace", "message": tracestr})
+
+    def finish_span(self, span: TraceSpan) -> None:
+        self.__tracer.finish_span(span)
+        self.__write({"type": "span", "name": span.name, "duration": span.duration,
+                      "attributes": span.attributes, "counters": span.counters,
+                      "error": span.error})
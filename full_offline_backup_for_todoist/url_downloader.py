@@ -1,87 +1,650 @@
 #!/usr/bin/python3
 """ Implementation of a class to download the contents of an URL """
 from abc import ABCMeta, abstractmethod
+import asyncio
 import urllib.request
 import urllib.parse
+import http.client
+import io
+import ssl
+import threading
 import time
-from typing import cast, Dict, Optional, NamedTuple
+import zlib
+from typing import Callable, Dict, IO, List, Optional, NamedTuple, Tuple
 from .tracer import Tracer
+from .request_scheduler import RequestScheduler, parse_retry_after
+from .http_cache import HTTPCache, HTTPCacheEntry
 
-NUM_RETRIES = 3
+CHUNK_SIZE = 64 * 1024
+MAX_IDLE_CONNECTIONS_PER_HOST = 16
+MAX_REDIRECTIONS = 10
+USER_AGENT = 'full-offline-backup-for-todoist'
+ACCEPT_ENCODING = 'gzip, deflate'
 
 class _Request(NamedTuple):
     url: str
     method: str
     params: Optional[Dict[str, str]] = None
     data: Optional[Dict[str, str]] = None
+    headers: Optional[Dict[str, str]] = None
+
+    @property
+    def encoded_url(self) -> str:
+        """ Gets the URL of the request, including the URL query parameters """
+        encoded_params = urllib.parse.urlencode(self.params) if self.params else None
+        return f"{self.url}?{encoded_params}" if encoded_params else self.url
+
+    @property
+    def encoded_data(self) -> Optional[bytes]:
+        """ Gets the form-encoded body of the request """
+        return urllib.parse.urlencode(self.data).encode() if self.data else None
+
+    @property
+    def host(self) -> str:
+        """ Gets the host (and port) the request is sent to """
+        return urllib.parse.urlsplit(self.url).netloc
+
+class _Response(NamedTuple):
+    status: int
+    headers: Dict[str, str] # With lowercase names
 
 class URLDownloaderException(Exception):
     """ Thrown when the download of an URL fails """
+    status: Optional[int]
+    retry_after: Optional[float]
+
+    def __init__(self, message: object, status: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        """ Creates the exception, optionally with the HTTP status code of the failure
+            and the delay requested by the server through the 'Retry-After' header """
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class _ContentDecoder:
+    """ Decodes a response body sent with a 'Content-Encoding' (gzip or deflate)
+        while it is being written to a file object, chunk by chunk """
+
+    def __init__(self, output: IO[bytes], content_encoding: Optional[str]):
+        self.__output = output
+        self.__content_encoding = (content_encoding or 'identity').strip().lower()
+        self.__first_chunk = True
+        if self.__content_encoding == 'gzip':
+            self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.__content_encoding == 'deflate':
+            self.__decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        elif self.__content_encoding != 'identity':
+            raise URLDownloaderException(
+                f"Unsupported content encoding: {self.__content_encoding}")
+
+    def write(self, data: bytes) -> None:
+        """ Decodes the given chunk of the body and writes it to the file object """
+        if self.__content_encoding == 'identity':
+            self.__output.write(data)
+            return
+
+        try:
+            decoded_data = self.__decompressor.decompress(data)
+        except zlib.error as exception:
+            # Some servers send raw deflate data, without the zlib header
+            if self.__content_encoding != 'deflate' or not self.__first_chunk:
+                raise URLDownloaderException(exception) from exception
+            self.__decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            decoded_data = self.__decompressor.decompress(data)
+        self.__first_chunk = False
+        self.__output.write(decoded_data)
+
+    def finish(self) -> None:
+        """ Writes the remainder of the decoded body to the file object """
+        if self.__content_encoding != 'identity':
+            self.__output.write(self.__decompressor.flush())
+            # The body may look complete, but a compressed stream that doesn't end
+            # was cut off, e.g. by a server that doesn't send a 'Content-Length'
+            if not self.__decompressor.eof:
+                raise URLDownloaderException(
+                    f"The {self.__content_encoding} stream of the response ended early")
 
 class URLDownloader(metaclass=ABCMeta):
     """ Implementation of a class to download the contents of an URL """
 
     _tracer: Tracer
     _bearer_token: Optional[str]
+    _scheduler: RequestScheduler
+    _cache: Optional[HTTPCache]
 
-    def __init__(self, tracer: Tracer, timeout: int = 300):
+    def __init__(self, tracer: Tracer, timeout: int = 300,
+                 scheduler: Optional[RequestScheduler] = None, cache: Optional[HTTPCache] = None):
         self._tracer = tracer
         self._timeout = timeout
         self._bearer_token = None
+        self._scheduler = scheduler or RequestScheduler()
+        self._cache = cache
 
     def set_bearer_token(self, bearer_token: Optional[str]) -> None:
         """ Sets the value of the 'Authorization: Bearer XXX' HTTP header """
         self._bearer_token = bearer_token
 
+    def close(self) -> None:
+        """ Releases the resources kept between downloads, such as open connections """
+
+    def _get_retry_delay(self, request: _Request, attempt: int,
+                         exception: URLDownloaderException) -> Optional[float]:
+        """ Gets the number of seconds to wait before retrying a failed request,
+            or None if it should not be retried """
+        delay = self._scheduler.on_failure(request.host, attempt,
+                                           exception.status, exception.retry_after)
+        if delay is not None:
+            self._tracer.trace(f"Got exception: {exception}, retrying in {delay:.1f}s...")
+        return delay
+
     @abstractmethod
-    def _download(self, request: _Request) -> bytes:
-        """ Download the contents of the specified URL with the specified request. """
+    def _download(self, request: _Request, output: IO[bytes]) -> _Response:
+        """ Download the contents of the specified URL with the specified request,
+            writing them to the specified (seekable) file object in fixed-size chunks.
+            A '304 Not Modified' response is returned as is, without any contents. """
+
+    def __get_cache_entry(self, request: _Request) -> Optional[HTTPCacheEntry]:
+        """ Gets the cached response for a GET request, if any.
+            Only requests without parameters are cached, which is the case of attachments """
+        return self._cache.get(request.url) if self._cache and not request.params else None
+
+    def __finish_cached_download(self, request: _Request, cache_entry: Optional[HTTPCacheEntry],
+                                 response: _Response, output: IO[bytes],
+                                 start_position: int) -> bool:
+        """ Serves a 'Not Modified' response from the cache, or stores a new response in it.
+            Returns False if the response could not be served from the cache """
+        if not self._cache or request.params:
+            return True
+
+        if response.status == 304:
+            self._tracer.trace(f"Not modified, using cached copy of {request.url}...")
+            return cache_entry is not None and self._cache.read_to(cache_entry, output)
+
+        output.seek(start_position)
+        self._cache.put(request.url, response.headers.get('etag'),
+                        response.headers.get('last-modified'), output)
+        return True
 
     def get(self, url: str, params: Optional[Dict[str, str]] = None) -> bytes:
         """ Download the contents of the specified URL with a GET request.
             You can specify additional data to pass as URL query parameters. """
-        return self._download(_Request(url=url, method='GET', params=params))
+        with io.BytesIO() as output:
+            self._download(_Request(url=url, method='GET', params=params), output)
+            return output.getvalue()
+
+    def get_to_file(self, url: str, output: IO[bytes],
+                    params: Optional[Dict[str, str]] = None) -> None:
+        """ Download the contents of the specified URL with a GET request to a file object,
+            without holding the whole contents in memory.
+            The file object must be seekable, so that failed attempts can be discarded. """
+        request = _Request(url=url, method='GET', params=params)
+        cache_entry = self.__get_cache_entry(request)
+        start_position = output.tell()
+        response = self._download(
+            request._replace(headers=cache_entry.validators) if cache_entry else request, output)
+        if not self.__finish_cached_download(request, cache_entry, response, output,
+                                             start_position):
+            self._download(request, output) # The cached copy was evicted in the meantime
 
     def post(self, url: str, data: Optional[Dict[str, str]] = None) -> bytes:
         """ Download the contents of the specified URL with a POST request.
             You can specify additional data to pass as a form-encoded body. """
-        return self._download(_Request(url=url, method='POST', data=data))
+        with io.BytesIO() as output:
+            self._download(_Request(url=url, method='POST', data=data), output)
+            return output.getvalue()
+
+    def post_to_file(self, url: str, output: IO[bytes],
+                     data: Optional[Dict[str, str]] = None) -> None:
+        """ Download the contents of the specified URL with a POST request to a file object,
+            without holding the whole contents in memory.
+            The file object must be seekable, so that failed attempts can be discarded. """
+        self._download(_Request(url=url, method='POST', data=data), output)
+
+    async def _download_async(self, request: _Request, output: IO[bytes]) -> _Response:
+        """ Like _download, but as a coroutine.
+            By default, the blocking download is run in a worker thread of the event loop. """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._download, request, output)
+
+    async def get_async(self, url: str, params: Optional[Dict[str, str]] = None) -> bytes:
+        """ Like get, but as a coroutine """
+        with io.BytesIO() as output:
+            await self._download_async(_Request(url=url, method='GET', params=params), output)
+            return output.getvalue()
+
+    async def get_to_file_async(self, url: str, output: IO[bytes],
+                                params: Optional[Dict[str, str]] = None) -> None:
+        """ Like get_to_file, but as a coroutine """
+        request = _Request(url=url, method='GET', params=params)
+        cache_entry = self.__get_cache_entry(request)
+        start_position = output.tell()
+        response = await self._download_async(
+            request._replace(headers=cache_entry.validators) if cache_entry else request, output)
+        if not self.__finish_cached_download(request, cache_entry, response, output,
+                                             start_position):
+            await self._download_async(request, output)
+
+    async def post_async(self, url: str, data: Optional[Dict[str, str]] = None) -> bytes:
+        """ Like post, but as a coroutine """
+        with io.BytesIO() as output:
+            await self._download_async(_Request(url=url, method='POST', data=data), output)
+            return output.getvalue()
+
+class _PooledHTTPResponse(http.client.HTTPResponse):
+    """ HTTP response which hands its connection back to the pool when it is closed """
+    __release: Optional[Callable[[bool], None]] = None
+
+    def set_release_callback(self, release: Callable[[bool], None]) -> None:
+        """ Sets the function that returns the connection to the pool.
+            It is called once the response is closed, with whether the connection is reusable """
+        self.__release = release
+
+    def close(self) -> None:
+        # The connection can only be reused if the whole body has been consumed
+        fully_read = self.isclosed()
+        super().close()
+        release, self.__release = self.__release, None
+        if release is not None:
+            release(fully_read and not self.will_close)
+
+class _PooledHTTPConnection(http.client.HTTPConnection):
+    """ HTTP connection which can be kept alive in a connection pool """
+    response_class = _PooledHTTPResponse
+
+class _PooledHTTPSConnection(http.client.HTTPSConnection):
+    """ HTTPS connection which can be kept alive in a connection pool,
+        and resumes the TLS session of a previous connection to the same host if possible """
+    response_class = _PooledHTTPResponse
+
+    def __init__(self, host: str, timeout: Optional[float], context: ssl.SSLContext,
+                 tls_session: Optional[ssl.SSLSession]):
+        super().__init__(host, timeout=timeout, context=context)
+        self.__context = context
+        self.__tls_session = tls_session
+
+    def connect(self) -> None:
+        http.client.HTTPConnection.connect(self)
+        self.sock = self.__context.wrap_socket(self.sock, server_hostname=self.host,
+                                               session=self.__tls_session)
+
+_ConnectionKey = Tuple[str, str]
+
+class _ConnectionPool:
+    """ Thread-safe pool of persistent HTTP(S) connections, indexed by scheme and host """
+
+    def __init__(self, ssl_context: ssl.SSLContext):
+        self.__ssl_context = ssl_context
+        self.__lock = threading.Lock()
+        self.__idle_connections: Dict[_ConnectionKey, List[http.client.HTTPConnection]] = {}
+        self.__tls_sessions: Dict[_ConnectionKey, ssl.SSLSession] = {}
+
+    def acquire(self, key: _ConnectionKey) -> Optional[http.client.HTTPConnection]:
+        """ Takes an idle connection to the given host out of the pool, if there is any """
+        with self.__lock:
+            idle_connections = self.__idle_connections.get(key)
+            return idle_connections.pop() if idle_connections else None
+
+    def connect(self, key: _ConnectionKey, timeout: Optional[float]) -> http.client.HTTPConnection:
+        """ Creates a new connection to the given host """
+        scheme, host = key
+        if scheme == "https":
+            with self.__lock:
+                tls_session = self.__tls_sessions.get(key)
+            return _PooledHTTPSConnection(host, timeout, self.__ssl_context, tls_session)
+        return _PooledHTTPConnection(host, timeout=timeout)
+
+    def release(self, key: _ConnectionKey, connection: http.client.HTTPConnection,
+                reusable: bool) -> None:
+        """ Returns a connection to the pool after its response has been closed """
+        if reusable and connection.sock:
+            with self.__lock:
+                if isinstance(connection.sock, ssl.SSLSocket) and connection.sock.session:
+                    self.__tls_sessions[key] = connection.sock.session
+
+                idle_connections = self.__idle_connections.setdefault(key, [])
+                if len(idle_connections) < MAX_IDLE_CONNECTIONS_PER_HOST:
+                    idle_connections.append(connection)
+                    return
+
+        connection.close()
+
+    def close(self) -> None:
+        """ Closes all the idle connections of the pool """
+        with self.__lock:
+            idle_connections = [connection for connections in self.__idle_connections.values()
+                                for connection in connections]
+            self.__idle_connections.clear()
+
+        for connection in idle_connections:
+            connection.close()
+
+class _KeepAliveHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    """ URLLib handler which sends the HTTP(S) requests through a pool of persistent connections,
+        instead of opening a new connection for every request """
+
+    def __init__(self, connection_pool: _ConnectionPool):
+        super().__init__()
+        self.__connection_pool = connection_pool
+
+    def http_open(self, req: urllib.request.Request) -> http.client.HTTPResponse:
+        return self.__open("http", req)
+
+    def https_open(self, req: urllib.request.Request) -> http.client.HTTPResponse:
+        if getattr(req, "_tunnel_host", None): # Connections through a proxy are not pooled
+            return super().https_open(req)
+        return self.__open("https", req)
+
+    @staticmethod
+    def __send(connection: http.client.HTTPConnection, req: urllib.request.Request,
+               headers: Dict[str, str]) -> http.client.HTTPResponse:
+        connection.timeout = req.timeout
+        if connection.sock:
+            connection.sock.settimeout(req.timeout)
+
+        try:
+            try:
+                connection.request(req.get_method(), req.selector, req.data, headers)
+            except OSError as err: # timeout error
+                raise urllib.error.URLError(err)
+            return connection.getresponse()
+        except:
+            connection.close()
+            raise
+
+    def __open(self, scheme: str, req: urllib.request.Request) -> http.client.HTTPResponse:
+        if not req.host:
+            raise urllib.error.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {name.title(): val for name, val in headers.items()}
+
+        key = (scheme, req.host)
+        response = None
+        idle_connection = self.__connection_pool.acquire(key)
+        if idle_connection:
+            try:
+                connection = idle_connection
+                response = self.__send(connection, req, headers)
+            except (urllib.error.URLError, ConnectionError):
+                # The server has likely closed the idle connection, retry with a new one
+                response = None
+
+        if not response:
+            connection = self.__connection_pool.connect(key, req.timeout)
+            response = self.__send(connection, req, headers)
+
+        response.url = req.get_full_url()
+        response.msg = response.reason # type: ignore[assignment] # Like URLLib's do_open
+        if isinstance(response, _PooledHTTPResponse):
+            response.set_release_callback(
+                lambda reusable: self.__connection_pool.release(key, connection, reusable))
+        return response
 
 class URLLibURLDownloader(URLDownloader):
-    """ Implementation of a class to download the contents of an URL through URLLib """
+    """ Implementation of a class to download the contents of an URL through URLLib.
+        Connections are kept alive and reused between requests to the same host. """
+
+    def __init__(self, tracer: Tracer, timeout: int = 300,
+                 scheduler: Optional[RequestScheduler] = None, cache: Optional[HTTPCache] = None):
+        super().__init__(tracer, timeout, scheduler, cache)
+        self.__connection_pool = _ConnectionPool(ssl.create_default_context())
+
+    def close(self) -> None:
+        """ Closes all the connections that are being kept alive """
+        self.__connection_pool.close()
 
-    def _download_once(self, opener: urllib.request.OpenerDirector, request: _Request) -> bytes:
+    def _download_once(self, opener: urllib.request.OpenerDirector, request: _Request,
+                       output: IO[bytes]) -> _Response:
         try:
-            encoded_params = urllib.parse.urlencode(request.params) if request.params else None
-            encoded_url = f"{request.url}?{encoded_params}" if encoded_params else request.url
-            encoded_data = urllib.parse.urlencode(request.data).encode() if request.data else None
-            with opener.open(encoded_url, encoded_data, self._timeout) as url_handle:
-                return cast(bytes, url_handle.read())
+            with opener.open(request.encoded_url, request.encoded_data,
+                             self._timeout) as url_handle:
+                response = _Response(url_handle.status, {
+                    name.lower(): value for name, value in url_handle.headers.items()})
+                decoder = _ContentDecoder(output, url_handle.headers.get('Content-Encoding'))
+                received_size = 0
+                while True:
+                    data = url_handle.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    received_size += len(data)
+                    decoder.write(data)
+
+                # Reading in chunks doesn't detect a connection closed before the end of the body
+                content_length = url_handle.headers.get('Content-Length', '').strip()
+                if content_length.isdigit() and received_size < int(content_length):
+                    raise URLDownloaderException(
+                        f"Connection closed after {received_size} of {content_length} bytes")
+                decoder.finish()
+                return response
+        except http.client.IncompleteRead as exception:
+            raise URLDownloaderException(
+                "Connection closed before the end of the response") from exception
         except urllib.error.HTTPError as exception:
             # urllib.error.HTTPError contains a file-like object and needs to be closed, see:
             # - https://github.com/pytest-dev/pytest/issues/13308
             # - https://docs.python.org/3.14/library/urllib.error.html
             # Closing it avoids a ResourceWarning on e.g. Python 3.14.2.
             with exception:
-                raise URLDownloaderException(exception.reason) from exception
+                if exception.code == 304:
+                    return _Response(304, {
+                        name.lower(): value for name, value in exception.headers.items()})
+
+                # Consume the (usually small) error body, so the connection can be reused
+                try:
+                    exception.read()
+                except (OSError, http.client.HTTPException):
+                    pass
+                raise URLDownloaderException(
+                    exception.reason, exception.code,
+                    parse_retry_after(exception.headers.get('Retry-After'))) from exception
         except urllib.error.URLError as exception:
             raise URLDownloaderException(exception.reason) from exception
+        # Timeouts and broken connections once the request is sent (e.g. while reading the
+        # response) are not wrapped in an URLError, but can be retried just the same
+        except (OSError, http.client.HTTPException) as exception:
+            raise URLDownloaderException(exception) from exception
 
-
-    def _download(self, request: _Request) -> bytes:
-        opener = self._build_opener_with_app_useragent()
-        for i in range(NUM_RETRIES):
-            try:
-                return self._download_once(opener, request)
-            except URLDownloaderException as exception:
-                self._tracer.trace(f"Got exception: {exception}, retrying...")
-                time.sleep(3**i)
-
-        return self._download_once(opener, request)
+    def _download(self, request: _Request, output: IO[bytes]) -> _Response:
+        opener = self._build_opener_with_app_useragent(_KeepAliveHandler(self.__connection_pool))
+        opener.addheaders += list((request.headers or {}).items())
+        start_position = output.tell()
+        attempt = 0
+        with self._tracer.span("http_request", method=request.method, url=request.url) as span:
+            while True:
+                time.sleep(self._scheduler.reserve(request.host))
+                try:
+                    response = self._download_once(opener, request, output)
+                    self._scheduler.on_success(request.host)
+                    span.attributes["status"] = response.status
+                    span.count("bytes", output.tell() - start_position)
+                    return response
+                except URLDownloaderException as exception:
+                    delay = self._get_retry_delay(request, attempt, exception)
+                    if delay is None:
+                        raise
+                    output.seek(start_position)
+                    output.truncate()
+                    time.sleep(delay)
+                    attempt += 1
+                    span.count("retries")
 
     def _build_opener_with_app_useragent(
         self, *handlers: urllib.request.BaseHandler) -> urllib.request.OpenerDirector:
         opener = urllib.request.build_opener(*handlers)
-        opener.addheaders = ([('User-agent', 'full-offline-backup-for-todoist')] +
+        opener.addheaders = ([('User-agent', USER_AGENT),
+                              ('Accept-Encoding', ACCEPT_ENCODING)] +
             ([('Authorization', 'Bearer ' + self._bearer_token)] if self._bearer_token else []))
         return opener
+
+class AsyncURLDownloader(URLDownloader):
+    """ Implementation of a class to download the contents of an URL through asyncio streams,
+        so that many downloads can run concurrently as tasks of a single thread """
+
+    def __init__(self, tracer: Tracer, timeout: int = 300,
+                 scheduler: Optional[RequestScheduler] = None, cache: Optional[HTTPCache] = None):
+        super().__init__(tracer, timeout, scheduler, cache)
+        self.__ssl_context = ssl.create_default_context()
+
+    def _download(self, request: _Request, output: IO[bytes]) -> _Response:
+        return asyncio.run(self._download_async(request, output))
+
+    async def _download_async(self, request: _Request, output: IO[bytes]) -> _Response:
+        start_position = output.tell()
+        attempt = 0
+        with self._tracer.span("http_request", method=request.method, url=request.url) as span:
+            while True:
+                await asyncio.sleep(self._scheduler.reserve(request.host))
+                try:
+                    response = await self.__download_once(request, output)
+                    self._scheduler.on_success(request.host)
+                    span.attributes["status"] = response.status
+                    span.count("bytes", output.tell() - start_position)
+                    return response
+                except URLDownloaderException as exception:
+                    delay = self._get_retry_delay(request, attempt, exception)
+                    if delay is None:
+                        raise
+                    output.seek(start_position)
+                    output.truncate()
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    span.count("retries")
+
+    async def __download_once(self, request: _Request, output: IO[bytes]) -> _Response:
+        url, method, data = request.encoded_url, request.method, request.encoded_data
+        headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': ACCEPT_ENCODING}
+        unredirected_headers = dict(request.headers or {})
+        if self._bearer_token:
+            unredirected_headers['Authorization'] = 'Bearer ' + self._bearer_token
+
+        for _ in range(MAX_REDIRECTIONS + 1):
+            response, location = await self.__send(
+                url, method, data, {**headers, **unredirected_headers}, output)
+            if location is None:
+                return response
+
+            # Like URLLib, the authorization is not passed on to the redirected location,
+            # and the redirected request is always a GET request without a body
+            self._tracer.trace(f"Got redirection {response.status} to {location}...")
+            url = urllib.parse.urljoin(url, location)
+            method, data = 'GET', None
+            unredirected_headers = {}
+
+        raise URLDownloaderException("Too many redirections")
+
+    async def __send(self, url: str, method: str, data: Optional[bytes],
+                     headers: Dict[str, str],
+                     output: IO[bytes]) -> Tuple[_Response, Optional[str]]:
+        """ Sends a single HTTP request, and writes the response body to the file object.
+            Returns the response, and the location to follow if it is a redirection """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise URLDownloaderException(f"Unsupported URL: {url}")
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        selector = (parts.path or '/') + (f"?{parts.query}" if parts.query else "")
+
+        request_headers = {'Host': parts.netloc, 'Connection': 'close', **headers}
+        if data is not None:
+            request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            request_headers['Content-Length'] = str(len(data))
+        request_head = f"{method} {selector} HTTP/1.1\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in request_headers.items()) + "\r\n"
+
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(
+                parts.hostname, port,
+                ssl=self.__ssl_context if parts.scheme == 'https' else None), self._timeout)
+            try:
+                writer.write(request_head.encode('latin-1') + (data or b""))
+                await asyncio.wait_for(writer.drain(), self._timeout)
+                return await self.__read_response(reader, output)
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+        # Like URLLib, timeouts, broken connections and malformed responses can be retried.
+        # Before Python 3.11, asyncio.TimeoutError is not an OSError, so it is caught first
+        except asyncio.TimeoutError as exception:
+            raise URLDownloaderException("Timed out waiting for the server") from exception
+        except (OSError, ValueError) as exception:
+            raise URLDownloaderException(exception) from exception
+
+    async def __read_response(self, reader: asyncio.StreamReader,
+                              output: IO[bytes]) -> Tuple[_Response, Optional[str]]:
+        """ Reads a HTTP response, and writes its body to the file object.
+            Returns the response, and the location to follow if it is a redirection """
+        status, reason, response_headers = await self.__read_head(reader)
+        response = _Response(status, response_headers)
+        if status == 304:
+            return response, None
+        if 300 <= status < 400 and 'location' in response_headers:
+            return response, response_headers['location']
+        if not 200 <= status < 300:
+            raise URLDownloaderException(
+                reason, status, parse_retry_after(response_headers.get('retry-after')))
+
+        decoder = _ContentDecoder(output, response_headers.get('content-encoding'))
+        await self.__read_body(reader, response_headers, decoder)
+        decoder.finish()
+        return response, None
+
+    async def __read_line(self, reader: asyncio.StreamReader) -> bytes:
+        return await asyncio.wait_for(reader.readline(), self._timeout)
+
+    async def __read_exactly(self, reader: asyncio.StreamReader, size: int) -> bytes:
+        try:
+            return await asyncio.wait_for(reader.readexactly(size), self._timeout)
+        except asyncio.IncompleteReadError as exception:
+            raise URLDownloaderException("Connection closed before the end of the response") \
+                from exception
+
+    async def __read_head(self, reader: asyncio.StreamReader) -> Tuple[int, str, Dict[str, str]]:
+        """ Reads the status line and the headers of a HTTP response """
+        while True:
+            status_line = (await self.__read_line(reader)).decode('latin-1').rstrip('\r\n')
+            status_parts = status_line.split(' ', 2)
+            if len(status_parts) < 2 or not status_parts[1].isdigit():
+                raise URLDownloaderException(f"Invalid HTTP status line: {status_line!r}")
+
+            headers = {}
+            while True:
+                header_line = (await self.__read_line(reader)).decode('latin-1').rstrip('\r\n')
+                if not header_line:
+                    break
+                name, _, value = header_line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            status = int(status_parts[1])
+            if status >= 200: # Skip informational responses, e.g. 100 Continue
+                return status, status_parts[2] if len(status_parts) > 2 else "", headers
+
+    async def __read_body(self, reader: asyncio.StreamReader, headers: Dict[str, str],
+                          output: _ContentDecoder) -> None:
+        """ Reads the body of a HTTP response in fixed-size chunks into the decoder """
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                chunk_size = int((await self.__read_line(reader)).split(b';', 1)[0], 16)
+                if chunk_size == 0:
+                    break
+                while chunk_size > 0:
+                    data = await self.__read_exactly(reader, min(chunk_size, CHUNK_SIZE))
+                    output.write(data)
+                    chunk_size -= len(data)
+                await self.__read_exactly(reader, 2) # CRLF after each chunk
+            while (await self.__read_line(reader)).strip(): # Trailer headers
+                pass
+        elif 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            while remaining > 0:
+                data = await self.__read_exactly(reader, min(remaining, CHUNK_SIZE))
+                output.write(data)
+                remaining -= len(data)
+        else:
+            while True:
+                data = await asyncio.wait_for(reader.read(CHUNK_SIZE), self._timeout)
+                if not data:
+                    break
+                output.write(data)
@@ -1,7 +1,92 @@
 #!/usr/bin/python3
 """ Simple standalone utility methods """
 import re
+import asyncio
+import collections
+import concurrent.futures
+import threading
+from typing import Any, Callable, Coroutine, Deque, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
 
 def sanitize_file_name(filename: str) -> str:
     """ Sanitizes a file name, removing characters that may cause problems on some platforms """
     return re.sub(r'[\\/:*?\"<>|]', "", filename)
+
+def _ordered_results(submit: Callable[[T], "concurrent.futures.Future[R]"], items: Iterable[T],
+                     max_pending: int) -> Iterator[R]:
+    """ Submits a task for each item and yields the results in the same order as the items,
+        with at most the given number of tasks pending at any time """
+    pending: "Deque[concurrent.futures.Future[R]]" = collections.deque()
+    try:
+        for item in items:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(submit(item))
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def parallel_ordered_map(function: Callable[[T], R], items: Iterable[T],
+                         jobs: int) -> Iterator[R]:
+    """ Applies a function to each item using up to the given number of worker threads,
+        and yields the results in the same order as the items.
+        At most 2*jobs items are in flight at any time, so memory usage stays bounded """
+    if jobs <= 1:
+        yield from map(function, items)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from _ordered_results(lambda item: executor.submit(function, item), items, 2 * jobs)
+
+def process_ordered_map(function: Callable[[T], R], items: Iterable[T],
+                        jobs: int) -> Iterator[R]:
+    """ Applies a function to each item using up to the given number of worker processes,
+        and yields the results in the same order as the items, like parallel_ordered_map.
+        Meant for CPU-bound work, so the function, items and results must be picklable """
+    if jobs <= 1:
+        yield from map(function, items)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from _ordered_results(lambda item: executor.submit(function, item), items, 2 * jobs)
+
+def async_ordered_map(function: Callable[[T], Coroutine[Any, Any, R]], items: Iterable[T],
+                      jobs: int) -> Iterator[R]:
+    """ Applies a coroutine function to each item as tasks of an event loop, running up to
+        the given number of them concurrently, and yields the results in the same order as
+        the items. At most 2*jobs items are in flight at any time, like parallel_ordered_map """
+    async def create_semaphore() -> asyncio.Semaphore:
+        # Must be created from the event loop, as it is bound to it on old Python versions
+        return asyncio.Semaphore(max(jobs, 1))
+
+    async def cancel_remaining_tasks() -> None:
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # The event loop runs in its own thread, so that the tasks keep making progress
+    # while the caller is consuming the results
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    try:
+        semaphore = asyncio.run_coroutine_threadsafe(create_semaphore(), loop).result()
+
+        async def run_limited(item: T) -> R:
+            async with semaphore:
+                return await function(item)
+
+        yield from _ordered_results(
+            lambda item: asyncio.run_coroutine_threadsafe(run_limited(item), loop),
+            items, 2 * max(jobs, 1))
+    finally:
+        asyncio.run_coroutine_threadsafe(cancel_remaining_tasks(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
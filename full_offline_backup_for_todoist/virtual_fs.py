@@ -1,12 +1,28 @@
 #!/usr/bin/python3
 """ Definitions and implementations of a simple logging / tracing method """
 from abc import ABCMeta, abstractmethod
+import datetime
+import hashlib
+import json
 import os.path
 import io
+import shutil
+import tarfile
+import tempfile
+import time
 import zipfile
-from pathlib import Path
 from types import TracebackType
-from typing import IO, List, Optional, Type
+from typing import IO, TYPE_CHECKING, Any, Callable, Dict, List, Optional, Type
+from .tracer import Tracer, NullTracer
+if TYPE_CHECKING:
+    from _typeshed import ReadableBuffer
+
+def _set_default_permissions(path: str, mode: int) -> None:
+    """ Temporary files and directories are only accessible by their owner,
+        so give them the permissions that they would have if created normally """
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(path, mode & ~umask)
 
 class VirtualFs(metaclass=ABCMeta):
     """ An abstract layer over the filesystem
@@ -16,6 +32,10 @@ class VirtualFs(metaclass=ABCMeta):
     def set_path_hint(self, dst_path: str) -> None:
         """ Sets the associated physical path of this filesystem (if possible) """
 
+    @abstractmethod
+    def get_path(self) -> Optional[str]:
+        """ Gets the associated physical path of this filesystem (if any) """
+
     @abstractmethod
     def existed(self) -> bool:
         """ Checks if the filesystem previously existed, or is newly created """
@@ -28,61 +48,517 @@ class VirtualFs(metaclass=ABCMeta):
     def read_file(self, file_path: str) -> bytes:
         """ Reads a file from this virtual file system """
 
+    def open_read(self, file_path: str) -> IO[bytes]:
+        """ Opens a file from this virtual file system, whose contents are read through the
+            returned file object, so they don't need to be held in memory at once """
+        return io.BytesIO(self.read_file(file_path))
+
+    # The source of a file is where it was downloaded from (a project ID or an attachment URL)
+
     @abstractmethod
-    def write_file(self, file_path: str, file_data: bytes) -> None:
+    def write_file(self, file_path: str, file_data: bytes, source: Optional[str] = None) -> None:
         """ Adds a file to the filesystem """
 
-class ZipVirtualFs(VirtualFs):
-    """ Represents a virtual filesystem over a ZIP file """
+    @abstractmethod
+    def open_write(self, file_path: str, source: Optional[str] = None) -> IO[bytes]:
+        """ Adds a file to the filesystem, whose contents are written through the returned
+            file object, so they don't need to be held in memory at once """
+
+    def write_file_from(self, file_path: str, data: IO[bytes],
+                        source: Optional[str] = None) -> None:
+        """ Adds a file to the filesystem, copying all the contents of the given
+            (seekable) file object """
+        with self.open_write(file_path, source) as file:
+            data.seek(0)
+            shutil.copyfileobj(data, file, 64 * 1024)
+
+class ZipCompressionPolicy:
+    """ Decides how each file in a ZIP file is compressed, depending on its type """
+    # Files that are already compressed, and would only waste time if compressed again
+    __COMPRESSED_EXTENSIONS = frozenset((
+        ".jpg", ".jpeg", ".jfif", ".png", ".gif", ".webp", ".heic", ".heif", ".avif",
+        ".mp3", ".m4a", ".aac", ".ogg", ".oga", ".opus", ".flac", ".wma",
+        ".mp4", ".m4v", ".mov", ".avi", ".mkv", ".webm", ".wmv", ".3gp",
+        ".zip", ".gz", ".tgz", ".bz2", ".xz", ".lzma", ".zst", ".7z", ".rar",
+        ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".jar", ".apk",
+        ".pdf", ".pages", ".numbers", ".key",
+    ))
+
+    # Compression levels supported by each method, the other methods have no levels
+    COMPRESS_LEVELS = {
+        zipfile.ZIP_DEFLATED: range(0, 10),
+        zipfile.ZIP_BZIP2: range(1, 10),
+    }
+
+    compression: int
+    compress_level: Optional[int]
+
+    def __init__(self, compression: int = zipfile.ZIP_STORED,
+                 compress_level: Optional[int] = None):
+        if (compress_level is not None and
+                compress_level not in self.COMPRESS_LEVELS.get(compression, range(0))):
+            raise ValueError(f"Compression level {compress_level} is not supported "
+                             "by the compression method")
+        self.compression = compression
+        self.compress_level = compress_level
+
+    def get_compression(self, file_path: str) -> int:
+        """ Gets the compression method (e.g. zipfile.ZIP_DEFLATED) for the given file """
+        if os.path.splitext(file_path)[1].lower() in self.__COMPRESSED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        return self.compression
+
+class _HashingWriter(io.RawIOBase):
+    """ Writes to another file object, while computing the size and SHA-256 of the data,
+        which are handed over to the given function once it is closed """
+
+    def __init__(self, target: IO[bytes], on_close: Callable[[int, str], None]):
+        super().__init__()
+        self.__target = target
+        self.__on_close = on_close
+        self.__sha256 = hashlib.sha256()
+        self.__size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: "ReadableBuffer") -> int:
+        written = self.__target.write(data)
+        self.__sha256.update(data)
+        self.__size += written
+        return written
+
+    def close(self) -> None:
+        if not self.closed:
+            self.__target.close()
+            self.__on_close(self.__size, self.__sha256.hexdigest())
+        super().close()
+
+class ZipVirtualFs(VirtualFs): # pylint: disable=too-many-instance-attributes
+    """ Represents a virtual filesystem over a ZIP file.
+        Each session that writes to the ZIP also adds a manifest in MANIFEST_FOLDER, with
+        a JSON line for each file written (path, size, SHA-256, source and timestamp),
+        so the backup can be checked without decompressing it all. The manifests are not
+        listed as files of the VFS, unlike other files written to MANIFEST_FOLDER. """
+    MANIFEST_FOLDER = ".manifest/"
+
     src_path: Optional[str]
     dst_path: Optional[str]
+    read_only: bool
+    compression_policy: ZipCompressionPolicy
     _zip_file: Optional[zipfile.ZipFile]
     _backing_storage: Optional[IO[bytes]]
+    _existed: bool
+    _temp_path: Optional[str]
+    _manifest: List[Dict[str, Any]]
+    _tracer: Tracer
+
+    @classmethod
+    def is_session_manifest(cls, file_path: str) -> bool:
+        """ Checks if the given path of the ZIP is the manifest of a session """
+        return file_path.startswith(cls.MANIFEST_FOLDER) and file_path.endswith(".jsonl")
 
-    def __init__(self, src_path: str):
+    def __init__(self, src_path: Optional[str], read_only: bool = False,
+                 compression_policy: Optional[ZipCompressionPolicy] = None,
+                 tracer: Optional[Tracer] = None):
         self.src_path = src_path
         self.dst_path = src_path
+        self.read_only = read_only
+        self.compression_policy = compression_policy or ZipCompressionPolicy()
+        self._tracer = tracer or NullTracer()
         self._zip_file = None
         self._backing_storage = None
+        self._existed = False
+        self._temp_path = None
+        self._manifest = []
 
     def __enter__(self) -> VirtualFs: # Type should be Self, but isn't well supported on old Python
-        if self.src_path and os.path.isfile(self.src_path) and zipfile.is_zipfile(self.src_path):
-            self._backing_storage = open(self.src_path, "ab+")
-        else:
+        self._existed = bool(self.src_path and os.path.isfile(self.src_path) and
+                             zipfile.is_zipfile(self.src_path))
+        if self._existed and self.read_only:
+            assert self.src_path
+            self._backing_storage = open(self.src_path, "rb") # pylint: disable=consider-using-with
+        elif self.read_only:
             self._backing_storage = io.BytesIO()
+        else:
+            # Build the new ZIP in a temporary file next to the destination (which, if not known
+            # yet, will be in the current directory), so its size isn't limited by the memory,
+            # and it can be moved in place atomically once complete.
+            # An existing ZIP is copied first, since appending to it in place overwrites its
+            # central directory, and an interrupted append would leave it unreadable
+            dst_dir = os.path.dirname(os.path.abspath(self.dst_path)) if self.dst_path else "."
+            temp_file = tempfile.NamedTemporaryFile( # pylint: disable=consider-using-with
+                dir=dst_dir, prefix=".", suffix=".zip.tmp", delete=False)
+            self._backing_storage = temp_file
+            self._temp_path = temp_file.name
+            if self._existed:
+                assert self.src_path
+                with open(self.src_path, "rb") as src_file:
+                    shutil.copyfileobj(src_file, temp_file, 1024 * 1024)
+                shutil.copymode(self.src_path, self._temp_path)
 
-        self._zip_file = zipfile.ZipFile(self._backing_storage, 'a')
+        self._zip_file = zipfile.ZipFile(self._backing_storage, 'r' if self._existed and
+                                         self.read_only else 'a',
+                                         compresslevel=self.compression_policy.compress_level)
 
         return self
 
     def __exit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException],
                  traceback: Optional[TracebackType]) -> None:
         if self._zip_file:
-            self._zip_file.close()
-            self._zip_file = None
+            # Writes the manifest and the central directory
+            with self._tracer.span("zip_finalize") as span:
+                if self._manifest:
+                    self.__write_manifest(self._zip_file)
+                self._zip_file.close()
+                self._zip_file = None
+                if self._backing_storage:
+                    span.count("bytes", self._backing_storage.seek(0, os.SEEK_END))
 
         if self._backing_storage:
-            if not exc_value and isinstance(self._backing_storage, io.BytesIO) and self.dst_path:
-                Path(self.dst_path).write_bytes(self._backing_storage.getvalue())
             self._backing_storage.close()
             self._backing_storage = None
 
+        if self._temp_path:
+            if not exc_value and self.dst_path:
+                if not self._existed:
+                    _set_default_permissions(self._temp_path, 0o666)
+                os.replace(self._temp_path, self.dst_path)
+            else:
+                os.remove(self._temp_path)
+            self._temp_path = None
+
     def set_path_hint(self, dst_path: str) -> None:
         if not self.dst_path:
             self.dst_path = os.path.join(".", dst_path + ".zip")
 
+    def __add_to_manifest(self, file_path: str, size: int, sha256: str,
+                          source: Optional[str]) -> None:
+        self._manifest.append({
+            "path": file_path,
+            "size": size,
+            "sha256": sha256,
+            "source": source,
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(
+                timespec="seconds"),
+        })
+
+    def __write_manifest(self, zip_file: zipfile.ZipFile) -> None:
+        # ZIP entries can't be replaced, so each session adds a new manifest
+        session_number = 1 + sum(self.is_session_manifest(name)
+                                 for name in zip_file.namelist())
+        manifest_path = f"{self.MANIFEST_FOLDER}{session_number:04}.jsonl"
+        zip_file.writestr(manifest_path,
+                          "".join(json.dumps(record) + "\n" for record in self._manifest),
+                          compress_type=self.compression_policy.get_compression(manifest_path))
+        self._manifest = []
+
+    def get_path(self) -> Optional[str]:
+        return self.dst_path
+
     def existed(self) -> bool:
         assert self._backing_storage
-        return not isinstance(self._backing_storage, io.BytesIO)
+        return self._existed
 
     def file_list(self) -> List[str]:
         assert self._zip_file
-        return self._zip_file.namelist()
+        return [name for name in self._zip_file.namelist()
+                if not self.is_session_manifest(name)]
 
     def read_file(self, file_path: str) -> bytes:
         assert self._zip_file
         return self._zip_file.read(file_path)
 
-    def write_file(self, file_path: str, file_data: bytes) -> None:
+    def open_read(self, file_path: str) -> IO[bytes]:
         assert self._zip_file
-        self._zip_file.writestr(file_path, file_data)
+        return self._zip_file.open(file_path)
+
+    def write_file(self, file_path: str, file_data: bytes, source: Optional[str] = None) -> None:
+        assert self._zip_file
+        with self._tracer.span("zip_write", path=file_path) as span:
+            self._zip_file.writestr(
+                file_path, file_data,
+                compress_type=self.compression_policy.get_compression(file_path))
+            span.count("bytes", len(file_data))
+        self.__add_to_manifest(file_path, len(file_data), hashlib.sha256(file_data).hexdigest(),
+                               source)
+
+    def open_write(self, file_path: str, source: Optional[str] = None) -> IO[bytes]:
+        assert self._zip_file
+        # ZipFile.open takes no compression method, unlike writestr, so it is taken from here
+        self._zip_file.compression = self.compression_policy.get_compression(file_path)
+        # The size is unknown beforehand, so allow the entry to grow over the ZIP64 limit
+        zip_entry_file = self._zip_file.open( # pylint: disable=consider-using-with
+            file_path, 'w', force_zip64=True)
+        return io.BufferedWriter(_HashingWriter(
+            zip_entry_file, lambda size, sha256: self.__add_to_manifest(
+                file_path, size, sha256, source)))
+
+class _AtomicFile(io.FileIO):
+    """ File that is written under a temporary name, and only replaces the destination file
+        once it is closed, so the destination never contains a partially written file """
+
+    def __init__(self, file_path: str):
+        temp_fd, self.__temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path),
+                                                     prefix=".", suffix=".tmp")
+        super().__init__(temp_fd, 'wb')
+        self.__file_path = file_path
+        self.__discard = False
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.__discard = exc_value is not None
+        super().__exit__(exc_type, exc_value, traceback)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        super().close()
+        if self.__discard:
+            os.remove(self.__temp_path)
+        else:
+            _set_default_permissions(self.__temp_path, 0o666)
+            os.replace(self.__temp_path, self.__file_path)
+
+class DirectoryVirtualFs(VirtualFs):
+    """ Represents a virtual filesystem over a plain directory """
+    src_path: Optional[str]
+    dst_path: Optional[str]
+    read_only: bool
+    _existed: bool
+    _staging_path: Optional[str]
+
+    def __init__(self, src_path: Optional[str], read_only: bool = False):
+        self.src_path = src_path
+        self.dst_path = src_path
+        self.read_only = read_only
+        self._existed = False
+        self._staging_path = None
+
+    def __enter__(self) -> VirtualFs: # Type should be Self, but isn't well supported on old Python
+        self._existed = bool(self.src_path and os.path.isdir(self.src_path))
+        if not self._existed and not self.read_only:
+            # Like for ZIP files, a new backup is built in a temporary directory next to the
+            # destination, and only moved in place once complete
+            dst_dir = os.path.dirname(os.path.abspath(self.dst_path)) if self.dst_path else "."
+            self._staging_path = tempfile.mkdtemp(dir=dst_dir, prefix=".", suffix=".tmp")
+        return self
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        if self._staging_path:
+            if not exc_value and self.dst_path:
+                _set_default_permissions(self._staging_path, 0o777)
+                os.replace(self._staging_path, self.dst_path)
+            else:
+                shutil.rmtree(self._staging_path)
+            self._staging_path = None
+
+    def __root_path(self) -> Optional[str]:
+        return self._staging_path or (self.src_path if self._existed else None)
+
+    def __real_path(self, file_path: str) -> str:
+        root_path = self.__root_path()
+        if root_path is None:
+            raise KeyError(file_path)
+        return os.path.join(root_path, *file_path.split('/'))
+
+    def set_path_hint(self, dst_path: str) -> None:
+        if not self.dst_path:
+            self.dst_path = os.path.join(".", dst_path)
+
+    def get_path(self) -> Optional[str]:
+        return self.dst_path
+
+    def existed(self) -> bool:
+        return self._existed
+
+    def file_list(self) -> List[str]:
+        root_path = self.__root_path()
+        if root_path is None:
+            return []
+
+        file_list = []
+        for dir_path, dir_names, file_names in os.walk(root_path):
+            dir_names.sort()
+            relative_dir = os.path.relpath(dir_path, root_path)
+            for file_name in sorted(file_names):
+                if file_name.startswith(".") and file_name.endswith(".tmp"):
+                    continue # Partially written file
+                file_list.append(file_name if relative_dir == "." else
+                                 "/".join(relative_dir.split(os.sep) + [file_name]))
+        return file_list
+
+    def read_file(self, file_path: str) -> bytes:
+        try:
+            with open(self.__real_path(file_path), 'rb') as file:
+                return file.read()
+        except (FileNotFoundError, IsADirectoryError) as exception:
+            raise KeyError(file_path) from exception
+
+    def open_read(self, file_path: str) -> IO[bytes]:
+        try:
+            return open(self.__real_path(file_path), 'rb') # pylint: disable=consider-using-with
+        except (FileNotFoundError, IsADirectoryError) as exception:
+            raise KeyError(file_path) from exception
+
+    def write_file(self, file_path: str, file_data: bytes, source: Optional[str] = None) -> None:
+        with self.open_write(file_path) as file:
+            file.write(file_data)
+
+    def open_write(self, file_path: str, source: Optional[str] = None) -> IO[bytes]:
+        assert not self.read_only
+        real_path = self.__real_path(file_path)
+        os.makedirs(os.path.dirname(real_path), exist_ok=True)
+        return _AtomicFile(real_path)
+
+class _BufferedFile(io.BytesIO):
+    """ File object whose contents are handed over to the given function once it is closed,
+        unless it is closed due to an exception """
+
+    def __init__(self, on_close: Callable[[bytes], None]):
+        super().__init__()
+        self.__on_close = on_close
+        self.__discard = False
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.__discard = exc_value is not None
+        super().__exit__(exc_type, exc_value, traceback)
+
+    def close(self) -> None:
+        if not self.closed and not self.__discard:
+            self.__on_close(self.getvalue())
+        super().close()
+
+class _CutOffWriter(io.RawIOBase):
+    """ Writes to another file object, until it is cut off.
+        The data written after that is discarded, so none of it reaches the target """
+
+    def __init__(self, target: IO[bytes]):
+        super().__init__()
+        self.__target = target
+        self.__cut_off = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: "ReadableBuffer") -> int:
+        if self.__cut_off:
+            return memoryview(data).nbytes
+        return self.__target.write(data)
+
+    def cut_off(self) -> None:
+        """ Discards any data written from now on """
+        self.__cut_off = True
+
+class TarVirtualFs(VirtualFs):
+    """ Represents a virtual filesystem over a tar stream (optionally compressed),
+        written either to a file or to an output stream such as the standard output.
+        Files are written in a single pass, and can't be read back """
+    dst_path: Optional[str]
+    compression: str
+    _output: Optional[IO[bytes]]
+    _writer: Optional[_CutOffWriter]
+    _tar_file: Optional[tarfile.TarFile]
+    _temp_file: Optional[IO[bytes]]
+    _file_list: List[str]
+
+    def __init__(self, dst_path: Optional[str], compression: str = "",
+                 output: Optional[IO[bytes]] = None):
+        """ The compression can be empty (no compression), 'gz', 'bz2' or 'xz'.
+            If an output stream is given, the tar stream is written to it instead of a file """
+        self.dst_path = dst_path
+        self.compression = compression
+        self._output = output
+        self._writer = None
+        self._tar_file = None
+        self._temp_file = None
+        self._file_list = []
+
+    def __enter__(self) -> VirtualFs: # Type should be Self, but isn't well supported on old Python
+        return self
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        if not exc_value and not self._tar_file and not self.existed():
+            self.__open() # Write an empty archive, like for a backup without any projects
+
+        if self._tar_file:
+            # On failure, the end of the archive (and the data still buffered by the
+            # compressor) is not written, so that the truncated stream can't be mistaken
+            # for a complete backup
+            if exc_value and self._writer:
+                self._writer.cut_off()
+            self._tar_file.close()
+            self._tar_file = None
+            self._writer = None
+
+        if self._temp_file:
+            self._temp_file.close()
+            if not exc_value and self.dst_path:
+                _set_default_permissions(self._temp_file.name, 0o666)
+                os.replace(self._temp_file.name, self.dst_path)
+            else:
+                os.remove(self._temp_file.name)
+            self._temp_file = None
+
+    def __open(self) -> tarfile.TarFile:
+        """ Starts writing the tar stream. This is delayed until the first file is written,
+            since the destination path may not be known before """
+        if self._tar_file is None:
+            output = self._output
+            if output is None:
+                # Like for ZIP files, write to a temporary file next to the destination,
+                # and only move it in place once complete
+                assert self.dst_path
+                # pylint: disable-next=consider-using-with
+                output = self._temp_file = tempfile.NamedTemporaryFile(
+                    dir=os.path.dirname(os.path.abspath(self.dst_path)),
+                    prefix=".", suffix=".tmp", delete=False)
+            self._writer = _CutOffWriter(output)
+            # pylint: disable-next=consider-using-with
+            self._tar_file = tarfile.open( # type: ignore[call-overload]
+                fileobj=self._writer, mode="w|" + self.compression)
+        return self._tar_file
+
+    def __add_file(self, file_path: str, size: int, data: IO[bytes]) -> None:
+        tar_info = tarfile.TarInfo(file_path)
+        tar_info.size = size
+        tar_info.mtime = int(time.time())
+        tar_info.mode = 0o644
+        self.__open().addfile(tar_info, data)
+        self._file_list.append(file_path)
+
+    def set_path_hint(self, dst_path: str) -> None:
+        if not self.dst_path:
+            extension = ".tar." + self.compression if self.compression else ".tar"
+            self.dst_path = os.path.join(".", dst_path + extension)
+
+    def get_path(self) -> Optional[str]:
+        return None if self._output else self.dst_path
+
+    def existed(self) -> bool:
+        # A tar stream can't be appended to, so an existing file is left alone
+        return (self._output is None and self._tar_file is None and
+                self.dst_path is not None and os.path.exists(self.dst_path))
+
+    def file_list(self) -> List[str]:
+        return list(self._file_list)
+
+    def read_file(self, file_path: str) -> bytes:
+        raise io.UnsupportedOperation("Files can't be read back from a tar stream")
+
+    def write_file(self, file_path: str, file_data: bytes, source: Optional[str] = None) -> None:
+        self.__add_file(file_path, len(file_data), io.BytesIO(file_data))
+
+    def write_file_from(self, file_path: str, data: IO[bytes],
+                        source: Optional[str] = None) -> None:
+        size = data.seek(0, io.SEEK_END)
+        data.seek(0)
+        self.__add_file(file_path, size, data)
+
+    def open_write(self, file_path: str, source: Optional[str] = None) -> IO[bytes]:
+        # The size of a file must be known before its contents are written to the tar stream,
+        # so they are buffered until the file is closed
+        return _BufferedFile(lambda file_data: self.write_file(file_path, file_data))
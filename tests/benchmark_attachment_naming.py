@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+""" Benchmark for the deduplication of attachment names.
+    Run with: python3 -m tests.benchmark_attachment_naming [--names N] """
+# pylint: disable=invalid-name
+import argparse
+import time
+from unittest.mock import MagicMock
+from full_offline_backup_for_todoist.backup_attachments_downloader import (
+    TodoistBackupAttachmentsDownloader, TodoistAttachmentInfo)
+from full_offline_backup_for_todoist.tracer import NullTracer
+
+def main() -> None:
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names", type=int, default=100000)
+    args = parser.parse_args()
+
+    # Most attachments pasted from a phone have one of a few names,
+    # and a few of them already have a suffix which the renamed ones have to skip
+    file_names = ("image.png", "Screenshot.png", "image_7.png", "document.pdf")
+    attachment_infos = [TodoistAttachmentInfo(file_names[i % len(file_names)],
+                                              f"https://www.example.com/{i}")
+                        for i in range(args.names)]
+
+    downloader = TodoistBackupAttachmentsDownloader(NullTracer(), MagicMock())
+    start_time = time.perf_counter()
+    # pylint: disable-next=protected-access
+    downloader._TodoistBackupAttachmentsDownloader__deduplicate_attachments_names( # type: ignore
+        attachment_infos)
+    elapsed_time = time.perf_counter() - start_time
+
+    unique_names = len({attachment_info.file_name for attachment_info in attachment_infos})
+    print(f"Deduplicated {args.names} names into {unique_names} unique names "
+          f"in {elapsed_time:.2f}s")
+
+if __name__ == "__main__":
+    main()
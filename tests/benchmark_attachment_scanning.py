@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+""" Benchmark for the scanning of backup CSV files for attachments.
+    Run with: python3 -m tests.benchmark_attachment_scanning [--rows N] """
+# pylint: disable=invalid-name
+import argparse
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from unittest.mock import MagicMock
+from full_offline_backup_for_todoist.backup_attachments_downloader import (
+    TodoistBackupAttachmentsDownloader)
+from full_offline_backup_for_todoist.tracer import NullTracer
+from full_offline_backup_for_todoist.virtual_fs import ZipVirtualFs
+
+def _generate_csv(rows: int) -> bytes:
+    """ Generates a CSV file similar to a Todoist export,
+        where one in every hundred rows is a note with an attachment """
+    output = io.StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+    writer.writerow(["TYPE", "CONTENT", "DESCRIPTION", "PRIORITY", "INDENT", "AUTHOR",
+                     "RESPONSIBLE", "DATE", "DATE_LANG", "TIMEZONE"])
+    for i in range(rows):
+        if i % 100 == 0:
+            content = " [[file " + json.dumps({
+                "file_type": "image/jpg", "file_name": f"image{i}.jpg",
+                "file_url": f"https://www.example.com/image{i}.jpg"}) + "]]"
+            writer.writerow(["note", content, "", "", "", "Someone (1234)", "", "", "", ""])
+        else:
+            writer.writerow(["task", f"Task number {i}, with some words in it", "A description",
+                             4, 1, "Someone (1234)", "", "every day", "en", "Europe/Madrid"])
+    return output.getvalue().encode('utf-8-sig')
+
+def main() -> None:
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        backup_path = os.path.join(temp_dir, "backup.zip")
+        with ZipVirtualFs(backup_path) as vfs:
+            vfs.write_file("Project [1].csv", _generate_csv(args.rows))
+            # Makes the backup count as one with attachments, so all of them are scanned
+            vfs.write_file("attachments/placeholder", b"")
+
+        downloader = TodoistBackupAttachmentsDownloader(NullTracer(), MagicMock())
+        with ZipVirtualFs(backup_path, read_only=True) as vfs:
+            tracemalloc.start()
+            start_time = time.perf_counter()
+            missing_attachments = downloader.find_missing_attachments(vfs)
+            elapsed_time = time.perf_counter() - start_time
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    print(f"Scanned {args.rows} rows in {elapsed_time:.2f}s, "
+          f"found {len(missing_attachments)} attachments, "
+          f"peak memory {peak_memory / 1024 / 1024:.1f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,22 @@
 """ Tests for the Todoist backup + attachments downloader class """
 # pylint: disable=invalid-name
 import unittest
-from unittest.mock import MagicMock
+import asyncio
+from unittest.mock import MagicMock, ANY, patch
+import time
 import io
 import csv
 import json
+import os
+import tarfile
+import tempfile
+import threading
 from full_offline_backup_for_todoist.backup_attachments_downloader import (
-    TodoistBackupAttachmentsDownloader)
+    TodoistBackupAttachmentsDownloader, AttachmentsDownloaderOptions)
+from full_offline_backup_for_todoist.attachment_store import AttachmentStore
+from full_offline_backup_for_todoist.attachment_journal import AttachmentJournal
 from full_offline_backup_for_todoist.tracer import NullTracer
+from full_offline_backup_for_todoist.virtual_fs import TarVirtualFs
 from .test_util_memory_vfs import InMemoryVfs
 
 class TestTodoistBackupAttachmentsDownloader(unittest.TestCase):
@@ -27,7 +36,8 @@ class TestTodoistBackupAttachmentsDownloader(unittest.TestCase):
             self._TEST_FILE_JPG_URL: self._TEST_FILE_JPG_BYTES.encode(),
             self._TEST_ATTACHMENT_INI_URL: self._TEST_ATTACHMENT_INI_BYTES.encode(),
         }
-        self.__fake_urldownloader = MagicMock(get=lambda url: self.__urlmap[url])
+        self.__fake_urldownloader = MagicMock(
+            get_to_file=lambda url, output: output.write(self.__urlmap[url]))
 
     @staticmethod
     def __make_note_row(content):
@@ -86,6 +96,34 @@ class TestTodoistBackupAttachmentsDownloader(unittest.TestCase):
         # Assert
         self.assertEqual(vfs.file_list(), [self._TEST_CSV_FILE_NAME])
 
+    def test_on_multiline_content_with_bom_finds_attachments(self):
+        """ Tests that attachments are found in notes whose content spans multiple lines,
+            in CSV files starting with a byte order mark, and that empty CSV files are ignored """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        writer.writerow(["task", "This is a random task\nwith [[brackets]] and\r\nmore lines", "4"])
+        writer.writerow(["note", "A note with\nan image [[file " + json.dumps({
+            "file_type": "image/jpg",
+            "file_name": "image.jpg",
+            "file_url": self._TEST_FILE_JPG_URL
+        }) + "]]", "test"])
+
+        vfs = InMemoryVfs()
+        vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode('utf-8-sig'))
+        vfs.write_file("Empty [987654321].csv", b"")
+
+        backup_downloader = TodoistBackupAttachmentsDownloader(
+            NullTracer(), self.__fake_urldownloader)
+
+        # Act
+        backup_downloader.download_attachments(vfs)
+
+        # Assert
+        self.assertEqual(vfs.read_file("attachments/image.jpg").decode(),
+                         self._TEST_FILE_JPG_BYTES)
+
     def test_filename_with_slash_is_sanitized(self):
         """ Tests that a filename containing a slash in sanitized before ZIPing it
             (instead of failing or creating a subdirectory inside the ZIP file) """
@@ -151,6 +189,117 @@ class TestTodoistBackupAttachmentsDownloader(unittest.TestCase):
 
         # Assert
         self.assertEqual(vfs_mock.write_file.called, False)
+        self.assertEqual(vfs_mock.open_write.called, False)
+        self.assertEqual(vfs_mock.write_file_from.called, False)
+
+    def test_on_download_with_some_already_downloaded_downloads_only_missing(self):
+        """ Does a test where some of the attachments have already been downloaded,
+            to ensure only the missing ones are downloaded and added to the backup """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        for file_name, file_url in (("image.jpg", self._TEST_FILE_JPG_URL),
+                                    ("file.ini", self._TEST_ATTACHMENT_INI_URL)):
+            writer.writerow(self.__make_note_row({
+                "file_type": "application/octet-stream",
+                "file_name": file_name,
+                "file_url": file_url
+            }))
+
+        vfs = InMemoryVfs()
+        vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+        vfs.write_file("attachments/image.jpg", self._TEST_FILE_JPG_BYTES.encode())
+        urldownloader = MagicMock(wraps=self.__fake_urldownloader)
+
+        backup_downloader = TodoistBackupAttachmentsDownloader(NullTracer(), urldownloader)
+
+        # Act
+        backup_downloader.download_attachments(vfs)
+
+        # Assert
+        urldownloader.get_to_file.assert_called_once_with(self._TEST_ATTACHMENT_INI_URL, ANY)
+        self.assertEqual(vfs.read_file("attachments/file.ini").decode(),
+                         self._TEST_ATTACHMENT_INI_BYTES)
+
+    def test_on_download_interrupted_with_journal_resumes_download(self):
+        """ Tests that with an attachment journal, a download interrupted by an error
+            can be restarted without downloading the completed attachments again,
+            and that only the files of the journal are removed once done """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        for file_name, file_url in (("image.jpg", self._TEST_FILE_JPG_URL),
+                                    ("file.ini", self._TEST_ATTACHMENT_INI_URL)):
+            writer.writerow(self.__make_note_row({
+                "file_type": "application/octet-stream",
+                "file_name": file_name,
+                "file_url": file_url
+            }))
+
+        downloaded_urls = []
+        def flaky_get_to_file(url, output):
+            downloaded_urls.append(url)
+            if url == self._TEST_ATTACHMENT_INI_URL and downloaded_urls.count(url) == 1:
+                raise ConnectionResetError("Connection reset by CDN")
+            output.write(self.__urlmap[url])
+
+        with tempfile.TemporaryDirectory() as journal_dir:
+            with open(os.path.join(journal_dir, "notes.txt"), "w", encoding="utf-8") as notes:
+                notes.write("not created by the journal")
+            failed_vfs, vfs = InMemoryVfs(), InMemoryVfs()
+            for each_vfs in (failed_vfs, vfs):
+                each_vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+            urldownloader = MagicMock(get_to_file=flaky_get_to_file)
+
+            # Act
+            with self.assertRaises(ConnectionResetError):
+                TodoistBackupAttachmentsDownloader(
+                    NullTracer(), urldownloader, attachment_journal=AttachmentJournal(journal_dir)
+                ).download_attachments(failed_vfs)
+            TodoistBackupAttachmentsDownloader(
+                NullTracer(), urldownloader, attachment_journal=AttachmentJournal(journal_dir)
+            ).download_attachments(vfs)
+
+            # Assert
+            self.assertEqual(downloaded_urls, [self._TEST_FILE_JPG_URL,
+                                               self._TEST_ATTACHMENT_INI_URL,
+                                               self._TEST_ATTACHMENT_INI_URL])
+            self.assertEqual(vfs.read_file("attachments/image.jpg").decode(),
+                             self._TEST_FILE_JPG_BYTES)
+            self.assertEqual(vfs.read_file("attachments/file.ini").decode(),
+                             self._TEST_ATTACHMENT_INI_BYTES)
+            self.assertEqual(os.listdir(journal_dir), ["notes.txt"])
+
+    def test_on_parallel_parsing_renames_attachments_as_sequential_parsing(self):
+        """ Tests that when the CSV files are parsed by a pool of processes, the attachments
+            are found and renamed exactly as when they are parsed one by one """
+        # Arrange
+        vfss = [InMemoryVfs(), InMemoryVfs()]
+        for i in range(6):
+            output = io.StringIO()
+            writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+            for file_url in (self._TEST_FILE_JPG_URL, self._TEST_ATTACHMENT_INI_URL)[i % 2:]:
+                writer.writerow(self.__make_note_row({
+                    "file_type": "application/octet-stream",
+                    "file_name": "file.bin",
+                    "file_url": file_url
+                }))
+            for vfs in vfss:
+                vfs.write_file(f"Project {i} [{i}].csv", output.getvalue().encode())
+
+        # Act
+        with patch('os.cpu_count', return_value=4):
+            for jobs, vfs in zip((1, 4), vfss):
+                TodoistBackupAttachmentsDownloader(
+                    NullTracer(), self.__fake_urldownloader,
+                    AttachmentsDownloaderOptions(jobs=jobs)).download_attachments(vfs)
+
+        # Assert
+        self.assertEqual(len(vfss[1].file_list()), 6 + 9)
+        self.assertEqual(vfss[0].files, vfss[1].files)
 
     def test_on_download_with_colliding_names_renames_attachments(self):
         """ Does a test where there are multiple files with the same name,
@@ -190,3 +339,342 @@ class TestTodoistBackupAttachmentsDownloader(unittest.TestCase):
         self.assertEqual(vfs.read_file("attachments/image.jpg").decode(), self._TEST_FILE_JPG_BYTES)
         self.assertEqual(vfs.read_file("attachments/image_2.jpg").decode(),
                          self._TEST_ATTACHMENT_INI_BYTES)
+
+    def test_on_download_with_many_colliding_names_renames_to_lowest_free_suffix(self):
+        """ Tests that colliding attachment names get the lowest suffix which is still free,
+            even when some attachments already have names with suffixes """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        for file_name in ("image.png", "image_3.png", "image.png", "image.png", "image_2.png",
+                          "image.png", "image_2.png"):
+            writer.writerow(self.__make_note_row({
+                "file_type": "image/png",
+                "file_name": file_name,
+                "file_url": self._TEST_FILE_JPG_URL
+            }))
+
+        vfs = InMemoryVfs()
+        vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+
+        backup_downloader = TodoistBackupAttachmentsDownloader(
+            NullTracer(), self.__fake_urldownloader)
+
+        # Act
+        backup_downloader.download_attachments(vfs)
+
+        # Assert
+        self.assertEqual(vfs.file_list(), [self._TEST_CSV_FILE_NAME,
+                                           "attachments/image.png", "attachments/image_3.png",
+                                           "attachments/image_2.png", "attachments/image_4.png",
+                                           "attachments/image_2_2.png", "attachments/image_5.png",
+                                           "attachments/image_2_3.png"])
+
+    def test_on_download_with_repeated_urls_downloads_each_url_once(self):
+        """ Tests that an attachment referenced more than once (e.g. in forwarded notes)
+            is only downloaded once, and packed for each of its references """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        for file_name, file_url in (("image.jpg", self._TEST_FILE_JPG_URL),
+                                    ("file.ini", self._TEST_ATTACHMENT_INI_URL),
+                                    ("image.jpg", self._TEST_FILE_JPG_URL),
+                                    ("forwarded.jpg", self._TEST_FILE_JPG_URL)):
+            writer.writerow(self.__make_note_row({
+                "file_type": "application/octet-stream",
+                "file_name": file_name,
+                "file_url": file_url
+            }))
+
+        vfs = InMemoryVfs()
+        vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+        urldownloader = MagicMock(wraps=self.__fake_urldownloader)
+
+        backup_downloader = TodoistBackupAttachmentsDownloader(
+            NullTracer(), urldownloader, AttachmentsDownloaderOptions(jobs=2))
+
+        # Act
+        backup_downloader.download_attachments(vfs)
+
+        # Assert
+        self.assertEqual(sorted(call.args[0] for call in urldownloader.get_to_file.call_args_list),
+                         sorted([self._TEST_FILE_JPG_URL, self._TEST_ATTACHMENT_INI_URL]))
+        for file_name in ("image.jpg", "image_2.jpg", "forwarded.jpg"):
+            self.assertEqual(vfs.read_file("attachments/" + file_name).decode(),
+                             self._TEST_FILE_JPG_BYTES)
+
+    def test_on_parallel_download_packs_attachments_in_order(self):
+        """ Tests that when the attachments are downloaded in parallel, they are still
+            packed in the order in which they are found, with consistent progress numbering """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        for i in range(10):
+            writer.writerow(self.__make_note_row({
+                "file_type": "text/plain",
+                "file_name": f"file_{i}.txt",
+                "file_url": f"http://www.example.com/file_{i}.txt"
+            }))
+
+        def fake_get_to_file(url, output):
+            # Make the first attachments the slowest ones to finish
+            index = int(url[-len("X.txt"):-len(".txt")])
+            time.sleep(0.01 * (10 - index))
+            output.write(url.encode())
+
+        vfs = InMemoryVfs()
+        vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+        tracer = MagicMock()
+
+        backup_downloader = TodoistBackupAttachmentsDownloader(
+            tracer, MagicMock(get_to_file=fake_get_to_file), AttachmentsDownloaderOptions(jobs=4))
+
+        # Act
+        backup_downloader.download_attachments(vfs)
+
+        # Assert
+        self.assertEqual(vfs.file_list(), [self._TEST_CSV_FILE_NAME] +
+                         [f"attachments/file_{i}.txt" for i in range(10)])
+        self.assertEqual(vfs.read_file("attachments/file_7.txt"),
+                         b"http://www.example.com/file_7.txt")
+        tracer.trace.assert_any_call("[8/10] Downloaded attachment 'file_7.txt'...")
+
+    def test_on_asyncio_download_downloads_attachments(self):
+        """ Tests that the attachments are downloaded when running the downloads
+            as asyncio tasks """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        writer.writerow(self.__make_note_row({
+            "file_type": "image/jpg",
+            "file_name": "image.jpg",
+            "file_url": self._TEST_FILE_JPG_URL
+        }))
+        writer.writerow(self.__make_note_row({
+            "file_type": "text/plain",
+            "file_name": "file.ini",
+            "file_url": self._TEST_ATTACHMENT_INI_URL
+        }))
+
+        async def fake_get_to_file_async(url, output):
+            await asyncio.sleep(0)
+            output.write(self.__urlmap[url])
+
+        vfs = InMemoryVfs()
+        vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+
+        backup_downloader = TodoistBackupAttachmentsDownloader(
+            NullTracer(), MagicMock(get_to_file_async=fake_get_to_file_async),
+            AttachmentsDownloaderOptions(jobs=4, use_asyncio=True))
+
+        # Act
+        backup_downloader.download_attachments(vfs)
+
+        # Assert
+        self.assertEqual(vfs.file_list(), [self._TEST_CSV_FILE_NAME,
+                                           "attachments/image.jpg", "attachments/file.ini"])
+        self.assertEqual(vfs.read_file("attachments/image.jpg").decode(),
+                         self._TEST_FILE_JPG_BYTES)
+
+    def test_on_download_with_attachment_store_stores_each_content_once(self):
+        """ Tests that with an attachment store, the attachments are stored once
+            across backups, and each backup only contains the manifest of its attachments """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        for file_name, file_url in (("image.jpg", self._TEST_FILE_JPG_URL),
+                                    ("image_copy.jpg", self._TEST_FILE_JPG_URL),
+                                    ("file.ini", self._TEST_ATTACHMENT_INI_URL)):
+            writer.writerow(self.__make_note_row({
+                "file_type": "application/octet-stream",
+                "file_name": file_name,
+                "file_url": file_url
+            }))
+
+        vfss = [InMemoryVfs(), InMemoryVfs()]
+        for vfs in vfss:
+            vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            store = AttachmentStore(store_dir)
+            backup_downloader = TodoistBackupAttachmentsDownloader(
+                NullTracer(), self.__fake_urldownloader, attachment_store=store)
+
+            # Act
+            for vfs in vfss:
+                backup_downloader.download_attachments(vfs)
+
+            # Assert
+            manifest = json.loads(vfss[1].read_file(".manifest/attachments.json"))
+            self.assertEqual(vfss[1].file_list(),
+                             [self._TEST_CSV_FILE_NAME, ".manifest/attachments.json"])
+            self.assertEqual(list(manifest), ["attachments/image.jpg",
+                                              "attachments/image_copy.jpg",
+                                              "attachments/file.ini"])
+            self.assertEqual(manifest["attachments/image.jpg"],
+                             manifest["attachments/image_copy.jpg"])
+            with open(store.get_path(manifest["attachments/file.ini"]), 'rb') as stored_file:
+                self.assertEqual(stored_file.read(), self._TEST_ATTACHMENT_INI_BYTES.encode())
+            self.assertEqual(sum(len(files) for _, _, files in os.walk(store_dir)), 2)
+
+    def test_on_attachment_named_like_manifest_downloads_missing_attachments(self):
+        """ Tests that an attachment named manifest.json is packed like any other attachment,
+            and isn't mistaken for the manifest of the attachment store """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        for file_name, file_url in (("manifest.json", self._TEST_ATTACHMENT_INI_URL),
+                                    ("image.jpg", self._TEST_FILE_JPG_URL)):
+            writer.writerow(self.__make_note_row({
+                "file_type": "application/octet-stream",
+                "file_name": file_name,
+                "file_url": file_url
+            }))
+
+        vfs = InMemoryVfs()
+        vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+        vfs.write_file("attachments/manifest.json", self._TEST_ATTACHMENT_INI_BYTES.encode())
+        backup_downloader = TodoistBackupAttachmentsDownloader(
+            NullTracer(), self.__fake_urldownloader)
+
+        # Act
+        missing_attachments = backup_downloader.find_missing_attachments(vfs)
+        backup_downloader.download_attachments(vfs)
+
+        # Assert
+        self.assertEqual(missing_attachments, ["attachments/image.jpg"])
+        self.assertEqual(vfs.read_file("attachments/image.jpg").decode(),
+                         self._TEST_FILE_JPG_BYTES)
+        self.assertEqual(backup_downloader.find_missing_attachments(vfs), [])
+
+    def test_on_download_to_write_only_vfs_scans_files_while_written(self):
+        """ Tests that the attachments can be downloaded to a VFS whose files can't be read
+            back (such as a tar stream), by scanning the CSV files while they are written """
+        # Arrange
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        writer.writerow(self.__make_note_row({
+            "file_type": "image/jpg",
+            "file_name": "image.jpg",
+            "file_url": self._TEST_FILE_JPG_URL
+        }))
+
+        tar_output = io.BytesIO()
+        backup_downloader = TodoistBackupAttachmentsDownloader(
+            NullTracer(), self.__fake_urldownloader)
+
+        # Act
+        with TarVirtualFs(None, output=tar_output) as tar_vfs:
+            vfs = backup_downloader.scan_written_files(tar_vfs)
+            vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+            backup_downloader.download_attachments(vfs)
+            backup_downloader.finish_scanning(vfs)
+
+        # Assert
+        tar_output.seek(0)
+        with tarfile.open(fileobj=tar_output) as tar_file:
+            self.assertEqual(tar_file.getnames(),
+                             [self._TEST_CSV_FILE_NAME, "attachments/image.jpg"])
+            self.assertEqual(tar_file.extractfile("attachments/image.jpg").read(),
+                             self._TEST_FILE_JPG_BYTES.encode())
+
+    def test_on_scanned_vfs_downloads_attachments_while_files_are_written(self):
+        """ Tests that the attachments of the CSV files written through a scanning VFS
+            start downloading right away, and are then packed with the same names
+            as if they were downloaded after all the files are written """
+        # Arrange
+        csv_datas = []
+        for file_url in (self._TEST_FILE_JPG_URL, self._TEST_ATTACHMENT_INI_URL):
+            output = io.StringIO()
+            writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+            writer.writerow(self.__make_note_row({
+                "file_type": "application/octet-stream",
+                "file_name": "file.bin",
+                "file_url": file_url
+            }))
+            csv_datas.append(output.getvalue().encode())
+
+        downloaded = threading.Event()
+        def get_to_file(url, output):
+            output.write(self.__urlmap[url])
+            downloaded.set()
+        urldownloader = MagicMock(get_to_file=MagicMock(side_effect=get_to_file))
+        backup_downloader = TodoistBackupAttachmentsDownloader(
+            NullTracer(), urldownloader,
+            AttachmentsDownloaderOptions(prefetch_max_size=1024 * 1024))
+        vfs = InMemoryVfs()
+
+        # Act
+        scanning_vfs = backup_downloader.scan_written_files(vfs)
+        try:
+            scanning_vfs.write_file("B [2].csv", csv_datas[0])
+            download_started_before_export_ended = downloaded.wait(timeout=10)
+            scanning_vfs.write_file("A [1].csv", csv_datas[1])
+            backup_downloader.download_attachments(scanning_vfs)
+        finally:
+            backup_downloader.finish_scanning(scanning_vfs)
+
+        # Assert
+        self.assertTrue(download_started_before_export_ended)
+        self.assertEqual(urldownloader.get_to_file.call_count, 2)
+        self.assertEqual(vfs.read_file("attachments/file.bin").decode(),
+                         self._TEST_ATTACHMENT_INI_BYTES)
+        self.assertEqual(vfs.read_file("attachments/file_2.bin").decode(),
+                         self._TEST_FILE_JPG_BYTES)
+
+    def test_on_scanned_vfs_prefetches_attachments_up_to_the_size_limit(self):
+        """ Tests that attachments are only downloaded while the files are written until
+            they add up to the size limit, and the rest are downloaded while packing,
+            with each URL downloaded once """
+        # Arrange
+        file_urls = [f"http://www.example.com/{name}.bin" for name in ("a", "b", "a", "c", "d")]
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(["TYPE", "CONTENT", "PRIORITY"])
+        for file_url in file_urls:
+            writer.writerow(self.__make_note_row({
+                "file_type": "application/octet-stream",
+                "file_name": "file.bin",
+                "file_url": file_url
+            }))
+
+        download_threads = {}
+        def get_to_file(url, output):
+            download_threads[url] = threading.current_thread()
+            output.write(url.encode())
+        urldownloader = MagicMock(get_to_file=MagicMock(side_effect=get_to_file))
+        limit_reached = threading.Event()
+        tracer = NullTracer()
+        # The first two attachments add up to 56 bytes
+        backup_downloader = TodoistBackupAttachmentsDownloader(
+            tracer, urldownloader, AttachmentsDownloaderOptions(jobs=1, prefetch_max_size=50))
+        vfs = InMemoryVfs()
+
+        # Act
+        with patch.object(tracer, "trace", side_effect=lambda tracestr:
+                          limit_reached.set() if "size limit" in tracestr else None):
+            scanning_vfs = backup_downloader.scan_written_files(vfs)
+            try:
+                scanning_vfs.write_file(self._TEST_CSV_FILE_NAME, output.getvalue().encode())
+                limit_reached_before_packing = limit_reached.wait(timeout=10)
+                backup_downloader.download_attachments(scanning_vfs)
+            finally:
+                backup_downloader.finish_scanning(scanning_vfs)
+
+        # Assert
+        self.assertTrue(limit_reached_before_packing)
+        self.assertEqual(urldownloader.get_to_file.call_count, 4)
+        prefetch_thread = download_threads[file_urls[0]]
+        self.assertEqual([download_threads[file_url] is prefetch_thread
+                          for file_url in file_urls], [True, True, True, False, False])
+        self.assertEqual([vfs.read_file(name).decode() for name in (
+            "attachments/file.bin", "attachments/file_2.bin", "attachments/file_3.bin",
+            "attachments/file_4.bin", "attachments/file_5.bin")], file_urls)
@@ -2,11 +2,31 @@
 """ Tests for the Todoist backup downloader class """
 # pylint: disable=invalid-name
 import unittest
+import asyncio
 from unittest.mock import MagicMock
+import os
+import tempfile
+import time
 from full_offline_backup_for_todoist.backup_downloader import TodoistBackupDownloader
+from full_offline_backup_for_todoist.backup_downloader import BackupDownloaderOptions
+from full_offline_backup_for_todoist.backup_state import BackupStateStore
+from full_offline_backup_for_todoist.todoist_api import (
+    TodoistProjectInfo, TodoistProjectChanges, TodoistSnapshot)
+from full_offline_backup_for_todoist.virtual_fs import ZipVirtualFs
 from full_offline_backup_for_todoist.tracer import NullTracer
 from .test_util_memory_vfs import InMemoryVfs
 
+class _InMemoryBackupStateStore(BackupStateStore):
+    """ Stores the synchronization state in memory, for the tests """
+    def __init__(self):
+        self.state = None
+
+    def load(self):
+        return self.state
+
+    def save(self, state):
+        self.state = state
+
 class TestBackupDownloader(unittest.TestCase):
     """ Tests for the Todoist backup downloader class """
     def setUp(self):
@@ -29,3 +49,144 @@ class TestBackupDownloader(unittest.TestCase):
         # Assert
         self.assertEqual(vfs.file_list(), ["test"])
         self.assertEqual(vfs.read_file("test"), b'testdata')
+
+    def test_on_parallel_download_writes_projects_in_order(self):
+        """ Tests that when the projects are exported in parallel, the CSV files are
+            still written in the order of the project list, regardless of which export
+            finishes first """
+
+        # Arrange
+        projects = [TodoistProjectInfo(f"Project {i}", str(i)) for i in range(8)]
+
+        def export_project_as_csv(project):
+            # Make the first projects the slowest ones to finish
+            time.sleep(0.01 * (len(projects) - int(project.identifier)))
+            return project.name.encode()
+
+        fake_todoist_api = MagicMock(get_projects=lambda: projects,
+                                     export_project_as_csv=export_project_as_csv)
+        backup_downloader = TodoistBackupDownloader(NullTracer(), fake_todoist_api,
+                                                    BackupDownloaderOptions(jobs=4))
+        vfs = InMemoryVfs()
+
+        # Act
+        backup_downloader.download(vfs)
+
+        # Assert
+        self.assertEqual(vfs.file_list(), [f"Project {i} [{i}].csv" for i in range(8)])
+        self.assertEqual(vfs.read_file("Project 3 [3].csv"), b"Project 3")
+
+    def test_on_asyncio_download_writes_projects_in_order(self):
+        """ Tests that when the projects are exported as asyncio tasks, the CSV files are
+            still written in the order of the project list """
+
+        # Arrange
+        projects = [TodoistProjectInfo(f"Project {i}", str(i)) for i in range(8)]
+
+        async def export_project_as_csv_async(project):
+            # Make the first projects the slowest ones to finish
+            await asyncio.sleep(0.01 * (len(projects) - int(project.identifier)))
+            return project.name.encode()
+
+        fake_todoist_api = MagicMock(get_projects=lambda: projects,
+                                     export_project_as_csv_async=export_project_as_csv_async)
+        backup_downloader = TodoistBackupDownloader(
+            NullTracer(), fake_todoist_api, BackupDownloaderOptions(jobs=4, use_asyncio=True))
+        vfs = InMemoryVfs()
+
+        # Act
+        backup_downloader.download(vfs)
+
+        # Assert
+        self.assertEqual(vfs.file_list(), [f"Project {i} [{i}].csv" for i in range(8)])
+        self.assertEqual(vfs.read_file("Project 3 [3].csv"), b"Project 3")
+
+    def test_on_snapshot_download_exports_projects_without_per_project_requests(self):
+        """ Tests that in snapshot mode, all the projects are exported from a single snapshot,
+            without requesting the CSV file of each project """
+        # Arrange
+        snapshot = TodoistSnapshot("token", [TodoistProjectInfo("Project: 1", "1")], {
+            "projects": [{"id": "1", "name": "Project: 1"}],
+            "items": [{"id": "10", "project_id": "1", "content": "Task"}],
+            "labels": [],
+        })
+        fake_todoist_api = MagicMock(get_snapshot=MagicMock(return_value=snapshot))
+        csv_vfs = InMemoryVfs()
+        json_vfs = InMemoryVfs()
+
+        # Act
+        TodoistBackupDownloader(NullTracer(), fake_todoist_api,
+                                BackupDownloaderOptions(snapshot_format="csv")).download(csv_vfs)
+        TodoistBackupDownloader(NullTracer(), fake_todoist_api,
+                                BackupDownloaderOptions(snapshot_format="json")).download(json_vfs)
+
+        # Assert
+        fake_todoist_api.get_projects.assert_not_called()
+        fake_todoist_api.export_project_as_csv.assert_not_called()
+        self.assertEqual(csv_vfs.file_list(), ["Project 1 [1].csv"])
+        self.assertIn(b"task,Task,", csv_vfs.read_file("Project 1 [1].csv"))
+        self.assertEqual(json_vfs.file_list(), ["Project 1 [1].json", "labels.json"])
+
+    def __download_incremental_backups(self, changes_per_backup):
+        """ Downloads a sequence of incremental backups, one for each of the given changes.
+            Returns the CSV files of the last backup, and the exported projects of each backup """
+        state_store = _InMemoryBackupStateStore()
+        exported_project_ids = []
+        with tempfile.TemporaryDirectory() as backup_dir:
+            for i, changes in enumerate(changes_per_backup):
+                exported_project_ids.append([])
+                def export_project_as_csv(project, exported=exported_project_ids[-1], i=i):
+                    exported.append(project.identifier)
+                    return f"{project.name} v{i}".encode()
+
+                fake_todoist_api = MagicMock(get_project_changes=MagicMock(return_value=changes),
+                                             export_project_as_csv=export_project_as_csv)
+                backup_downloader = TodoistBackupDownloader(
+                    NullTracer(), fake_todoist_api, state_store=state_store)
+                with ZipVirtualFs(os.path.join(backup_dir, f"backup{i}.zip")) as vfs:
+                    backup_downloader.download(vfs)
+                    files = {name: vfs.read_file(name) for name in vfs.file_list()}
+        return files, exported_project_ids
+
+    def test_on_incremental_download_exports_only_changed_projects(self):
+        """ Tests that on an incremental backup, only the projects affected by changes since
+            the previous backup are exported, and the rest are copied from the previous backup """
+        # Arrange
+        full_changes = TodoistProjectChanges(
+            "token1", True, [TodoistProjectInfo(f"Project {i}", str(i)) for i in range(4)],
+            set(), {"item1": "1", "item2": "2"}, set(), set())
+        incremental_changes = TodoistProjectChanges(
+            "token2", False, [TodoistProjectInfo("New Project", "4")], {"3"},
+            {"item1": "0"}, set(), {"item2"})
+
+        # Act
+        files, exported_project_ids = self.__download_incremental_backups(
+            [full_changes, incremental_changes])
+
+        # Assert
+        self.assertEqual(exported_project_ids, [["0", "1", "2", "3"], ["0", "1", "2", "4"]])
+        self.assertEqual(files, {
+            "Project 0 [0].csv": b"Project 0 v1",
+            "Project 1 [1].csv": b"Project 1 v1",
+            "Project 2 [2].csv": b"Project 2 v1",
+            "New Project [4].csv": b"New Project v1",
+        })
+
+    def test_on_incremental_download_without_changes_copies_previous_backup(self):
+        """ Tests that on an incremental backup without changes, no project is exported """
+        # Arrange
+        full_changes = TodoistProjectChanges(
+            "token1", True, [TodoistProjectInfo(f"Project {i}", str(i)) for i in range(2)],
+            set(), {}, set(), set())
+        incremental_changes = TodoistProjectChanges("token2", False, [], set(), {}, set(), set())
+
+        # Act
+        files, exported_project_ids = self.__download_incremental_backups(
+            [full_changes, incremental_changes])
+
+        # Assert
+        self.assertEqual(exported_project_ids, [["0", "1"], []])
+        self.assertEqual(files, {
+            "Project 0 [0].csv": b"Project 0 v0",
+            "Project 1 [1].csv": b"Project 1 v0",
+        })
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+""" Tests for the persistence of the synchronization state between backups """
+# pylint: disable=invalid-name
+import os
+import tempfile
+import unittest
+from full_offline_backup_for_todoist.backup_state import FileBackupStateStore, TodoistBackupState
+from full_offline_backup_for_todoist.todoist_api import TodoistProjectInfo
+
+class TestFileBackupStateStore(unittest.TestCase):
+    """ Tests for the persistence of the synchronization state in a file """
+
+    def test_on_missing_file_loads_no_state(self):
+        """ Tests that when there is no state file (e.g. the first backup), no state is loaded """
+        with tempfile.TemporaryDirectory() as state_dir:
+            # Arrange
+            store = FileBackupStateStore(os.path.join(state_dir, "state.json"))
+
+            # Act/Assert
+            self.assertIsNone(store.load())
+
+    def test_saved_state_can_be_loaded(self):
+        """ Tests that a saved state can be loaded back """
+        with tempfile.TemporaryDirectory() as state_dir:
+            # Arrange
+            state_path = os.path.join(state_dir, "state.json")
+            state = TodoistBackupState("token", "/backups/backup.zip",
+                                       [TodoistProjectInfo("Work", "1")], {"10": "1"})
+
+            # Act
+            FileBackupStateStore(state_path).save(state)
+            loaded_state = FileBackupStateStore(state_path).load()
+
+            # Assert
+            self.assertEqual(loaded_state.sync_token, "token")
+            self.assertEqual(loaded_state.backup_path, "/backups/backup.zip")
+            self.assertEqual([(project.name, project.identifier)
+                              for project in loaded_state.projects], [("Work", "1")])
+            self.assertEqual(loaded_state.item_projects, {"10": "1"})
+            self.assertEqual(os.listdir(state_dir), ["state.json"])
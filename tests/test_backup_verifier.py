@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+""" Tests for the Todoist backup verifier class """
+# pylint: disable=invalid-name
+import unittest
+import json
+import os
+import tempfile
+import zipfile
+from unittest.mock import MagicMock
+from full_offline_backup_for_todoist.backup_verifier import TodoistBackupVerifier
+from full_offline_backup_for_todoist.backup_attachments_downloader import (
+    TodoistBackupAttachmentsDownloader)
+from full_offline_backup_for_todoist.tracer import NullTracer
+from full_offline_backup_for_todoist.virtual_fs import ZipVirtualFs
+
+class TestTodoistBackupVerifier(unittest.TestCase):
+    """ Tests for the Todoist backup verifier class """
+    _TEST_CSV_FILE_NAME = "My Test [123456789].csv"
+    _TEST_CSV_FILE_DATA = ('"TYPE","CONTENT"\n"task","Task"\n'
+                           '"note"," [[file {""file_name"": ""image.jpg"", '
+                           '""file_url"": ""http://www.example.com/image.jpg""}]]"\n').encode()
+
+    def setUp(self):
+        """ Creates the sample instrastructure for the test """
+        self.__temp_dir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.__verifier = TodoistBackupVerifier(
+            NullTracer(), TodoistBackupAttachmentsDownloader(NullTracer(), MagicMock()), jobs=4)
+
+    def tearDown(self):
+        """ Destroys the sample infrastructure for the test """
+        self.__temp_dir.cleanup()
+
+    def __make_backup(self, files):
+        path = os.path.join(self.__temp_dir.name,
+                            f"backup{len(os.listdir(self.__temp_dir.name))}.zip")
+        with ZipVirtualFs(path) as vfs:
+            for name, data in files.items():
+                vfs.write_file(name, data)
+        return path
+
+    def test_on_valid_backups_reports_no_problems(self):
+        """ Tests that valid backups, with and without attachments, pass the verification """
+        # Arrange
+        path1 = self.__make_backup({self._TEST_CSV_FILE_NAME: self._TEST_CSV_FILE_DATA})
+        path2 = self.__make_backup({self._TEST_CSV_FILE_NAME: self._TEST_CSV_FILE_DATA,
+                                    "attachments/image.jpg": b"it's a JPG"})
+
+        # Act
+        results = self.__verifier.verify([path1, path2])
+
+        # Assert
+        self.assertEqual([(result.path, result.problems) for result in results],
+                         [(path1, []), (path2, [])])
+
+    def test_on_corrupted_file_reports_crc_error(self):
+        """ Tests that a file whose contents don't match the CRC in the ZIP is reported """
+        # Arrange
+        path = os.path.join(self.__temp_dir.name, "corrupted.zip")
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zip_file:
+            zip_file.writestr(self._TEST_CSV_FILE_NAME, self._TEST_CSV_FILE_DATA)
+        with open(path, "rb+") as raw_file:
+            data = raw_file.read()
+            raw_file.seek(data.index(self._TEST_CSV_FILE_DATA))
+            raw_file.write(b"X")
+
+        # Act
+        results = self.__verifier.verify([path])
+
+        # Assert
+        self.assertEqual(len(results[0].problems), 1)
+        self.assertIn(self._TEST_CSV_FILE_NAME, results[0].problems[0])
+
+    def test_on_manifest_mismatch_reports_file(self):
+        """ Tests that a file whose contents don't match the hash in the manifest is reported """
+        # Arrange
+        path = os.path.join(self.__temp_dir.name, "mismatch.zip")
+        with zipfile.ZipFile(path, "w") as zip_file:
+            zip_file.writestr(self._TEST_CSV_FILE_NAME, self._TEST_CSV_FILE_DATA)
+            zip_file.writestr(ZipVirtualFs.MANIFEST_FOLDER + "0001.jsonl", json.dumps(
+                {"path": self._TEST_CSV_FILE_NAME, "size": 0, "sha256": "0" * 64,
+                 "source": None, "timestamp": "2020-01-01T00:00:00Z"}) + "\n")
+
+        # Act
+        results = self.__verifier.verify([path])
+
+        # Assert
+        self.assertEqual(results[0].problems,
+                         [f"'{self._TEST_CSV_FILE_NAME}' doesn't match "
+                          "the SHA-256 in the manifest"])
+
+    def test_on_missing_attachment_reports_attachment(self):
+        """ Tests that an attachment referenced by a CSV file, but not in the backup,
+            is reported """
+        # Arrange
+        path = self.__make_backup({self._TEST_CSV_FILE_NAME: self._TEST_CSV_FILE_DATA,
+                                   "attachments/other.jpg": b"it's another JPG"})
+
+        # Act
+        results = self.__verifier.verify([path])
+
+        # Assert
+        self.assertEqual(results[0].problems, ["Attachment 'attachments/image.jpg' is missing"])
+
+    def test_on_backup_with_attachment_store_checks_its_manifest(self):
+        """ Tests that the attachments listed in the manifest of the attachment store are
+            considered packed, and an invalid manifest is reported instead of crashing """
+        # Arrange
+        path1 = self.__make_backup({
+            self._TEST_CSV_FILE_NAME: self._TEST_CSV_FILE_DATA,
+            ".manifest/attachments.json": b'{"attachments/image.jpg": "' + b"0" * 64 + b'"}'})
+        path2 = self.__make_backup({self._TEST_CSV_FILE_NAME: self._TEST_CSV_FILE_DATA,
+                                    ".manifest/attachments.json": b"not JSON"})
+
+        # Act
+        results = self.__verifier.verify([path1, path2])
+
+        # Assert
+        self.assertEqual(results[0].problems, [])
+        self.assertEqual(len(results[1].problems), 1)
+        self.assertIn("Can't be read", results[1].problems[0])
+
+    def test_on_unreadable_backup_reports_error(self):
+        """ Tests that a file which is not a ZIP is reported, without verifying the others """
+        # Arrange
+        path = os.path.join(self.__temp_dir.name, "notazip.zip")
+        with open(path, "wb") as raw_file:
+            raw_file.write(b"not a zip")
+
+        # Act
+        results = self.__verifier.verify([path])
+
+        # Assert
+        self.assertEqual(len(results[0].problems), 1)
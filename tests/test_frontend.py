@@ -2,8 +2,17 @@
 """ Tests for the console frontend """
 # pylint: disable=invalid-name
 import unittest
-from unittest.mock import Mock, MagicMock, ANY
+import io
+import tarfile
+from unittest.mock import Mock, MagicMock, ANY, patch
 from full_offline_backup_for_todoist.frontend import ConsoleFrontend
+from full_offline_backup_for_todoist.controller import DownloadOptions
+from full_offline_backup_for_todoist.backup_verifier import BackupVerificationResult
+from full_offline_backup_for_todoist.tracer import NullTracer
+
+def _fake_dependencies_factory():
+    """ Creates a fake factory of the dependencies of the controller """
+    return Mock(return_value=Mock(tracer=NullTracer()))
 
 class TestFrontend(unittest.TestCase):
     """ Tests for the console frontend """
@@ -15,7 +24,7 @@ class TestFrontend(unittest.TestCase):
 
         # Arrange
         controller = MagicMock()
-        frontend = ConsoleFrontend(Mock(return_value=controller), Mock())
+        frontend = ConsoleFrontend(Mock(return_value=controller), _fake_dependencies_factory())
 
         # Act
         frontend.run("util", ["download"], {"TODOIST_TOKEN": "1234"})
@@ -29,7 +38,7 @@ class TestFrontend(unittest.TestCase):
             the corresponding method of the controller is called (with attachments) """
         # Arrange
         controller = MagicMock()
-        frontend = ConsoleFrontend(Mock(return_value=controller), Mock())
+        frontend = ConsoleFrontend(Mock(return_value=controller), _fake_dependencies_factory())
 
         # Act
         frontend.run("util", ["download", "--with-attachments"],
@@ -37,3 +46,116 @@ class TestFrontend(unittest.TestCase):
 
         # Assert
         controller.download.assert_called_with(ANY, with_attachments=True)
+
+    def test_on_download_closes_dependencies(self):
+        """ Tests that the dependencies are closed once the download is done,
+            even if it fails, so that no connections are left open """
+        # Arrange
+        dependencies_factory = _fake_dependencies_factory()
+        controller = MagicMock()
+        controller.download.side_effect = RuntimeError("Test")
+        frontend = ConsoleFrontend(Mock(return_value=controller), dependencies_factory)
+
+        # Act
+        self.assertRaises(RuntimeError, frontend.run, "util", ["download"],
+                          {"TODOIST_TOKEN": "1234"})
+
+        # Assert
+        dependencies_factory.return_value.close.assert_called_once_with()
+
+    @staticmethod
+    def test_on_download_with_jobs_passes_jobs_to_dependencies():
+        """ Tests that the number of parallel jobs is passed to the dependency container """
+        # Arrange
+        dependencies_factory = _fake_dependencies_factory()
+        frontend = ConsoleFrontend(Mock(return_value=MagicMock()), dependencies_factory)
+
+        # Act
+        frontend.run("util", ["download", "--jobs", "8"], {"TODOIST_TOKEN": "1234"})
+
+        # Assert
+        dependencies_factory.assert_called_with(ANY, False, False, DownloadOptions(jobs=8))
+
+    def test_on_download_to_stdout_requires_tar_format(self):
+        """ Tests that only tar backups can be written to the standard output,
+            since the other formats can't be written as a stream """
+        # Arrange
+        frontend = ConsoleFrontend(Mock(return_value=MagicMock()), Mock())
+
+        # Act/Assert
+        with patch('sys.stderr', new_callable=io.StringIO):
+            self.assertRaises(SystemExit, frontend.run, "util",
+                              ["download", "--output-file", "-"], {"TODOIST_TOKEN": "1234"})
+
+    def test_on_download_to_stdout_writes_only_the_backup_to_stdout(self):
+        """ Tests that when the backup is written to the standard output, any other output,
+            such as the warnings while getting the credentials, goes to the standard error """
+        # Arrange
+        frontend = ConsoleFrontend(Mock(return_value=MagicMock()), _fake_dependencies_factory())
+        stdout = Mock(buffer=io.BytesIO())
+
+        # Act
+        with patch('sys.stdout', stdout), \
+             patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            frontend.run("util", ["download", "--output-format", "tar", "--output-file", "-"],
+                         {"TODOIST_TOKEN": "1234", "TODOIST_EMAIL": "me@example.com"})
+
+        # Assert
+        stdout.write.assert_not_called()
+        self.assertIn("TODOIST_EMAIL", stderr.getvalue())
+        stdout.buffer.seek(0)
+        with tarfile.open(fileobj=stdout.buffer) as tar_file:
+            self.assertEqual(tar_file.getnames(), [])
+
+    def test_on_download_rejects_compression_level_unsupported_by_method(self):
+        """ Tests that compression levels are validated for the chosen compression method,
+            instead of failing once the backup is being written """
+        # Arrange
+        dependencies_factory = _fake_dependencies_factory()
+        frontend = ConsoleFrontend(Mock(), dependencies_factory)
+
+        # Act/Assert
+        for arguments in (["--compression-level", "6"],
+                          ["--compression", "bzip2", "--compression-level", "0"],
+                          ["--compression", "lzma", "--compression-level", "9"]):
+            with patch('sys.stderr', new_callable=io.StringIO):
+                self.assertRaises(SystemExit, frontend.run, "util", ["download"] + arguments,
+                                  {"TODOIST_TOKEN": "1234"})
+        dependencies_factory.assert_not_called()
+
+    def test_on_download_with_state_file_rejects_relative_dates(self):
+        """ Tests that incremental backups can't use relative dates, since the dates
+            of the projects copied from the previous backup would be outdated """
+        # Arrange
+        dependencies_factory = _fake_dependencies_factory()
+        frontend = ConsoleFrontend(Mock(), dependencies_factory)
+
+        # Act/Assert
+        with patch('sys.stderr', new_callable=io.StringIO):
+            self.assertRaises(SystemExit, frontend.run, "util",
+                              ["download", "--state-file", "state.json", "--use-relative-dates"],
+                              {"TODOIST_TOKEN": "1234"})
+        dependencies_factory.assert_not_called()
+
+    def test_on_verify_reports_results_and_fails_on_problems(self):
+        """ Tests that when verifying backups, the result of each one is printed,
+            and the program fails if any backup has problems """
+        # Arrange
+        backup_verifier = MagicMock()
+        backup_verifier.verify.return_value = [
+            BackupVerificationResult("good.zip", []),
+            BackupVerificationResult("bad.zip", ["'file.csv' is corrupted"])]
+        backup_verifier_factory = Mock(return_value=backup_verifier)
+        frontend = ConsoleFrontend(Mock(), Mock(), backup_verifier_factory)
+
+        # Act
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            with self.assertRaises(SystemExit) as exit_context:
+                frontend.run("util", ["verify", "--jobs", "4", "good.zip", "bad.zip"], {})
+
+        # Assert
+        backup_verifier_factory.assert_called_with(False, 4)
+        backup_verifier.verify.assert_called_with(["good.zip", "bad.zip"])
+        self.assertEqual(exit_context.exception.code, 1)
+        self.assertEqual(stdout.getvalue(),
+                         "OK good.zip\nFAILED bad.zip: 'file.csv' is corrupted\n")
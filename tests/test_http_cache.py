@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+""" Tests for the persistent HTTP cache """
+# pylint: disable=invalid-name
+import io
+import os
+import tempfile
+import unittest
+from full_offline_backup_for_todoist.http_cache import HTTPCache
+
+class TestHTTPCache(unittest.TestCase):
+    """ Tests for the persistent HTTP cache """
+
+    def setUp(self):
+        self.__cache_dir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+
+    def tearDown(self):
+        self.__cache_dir.cleanup()
+
+    def test_put_stores_response_with_validators(self):
+        """ Tests that a stored response can be read back along with its validators,
+            also from another instance of the cache on the same directory """
+        # Arrange
+        cache = HTTPCache(self.__cache_dir.name, 1024)
+
+        # Act
+        cache.put("http://host/file", '"abc"', None, io.BytesIO(b"contents"))
+        entry = HTTPCache(self.__cache_dir.name, 1024).get("http://host/file")
+        output = io.BytesIO()
+        found = cache.read_to(entry, output)
+
+        # Assert
+        self.assertTrue(found)
+        self.assertEqual(output.getvalue(), b"contents")
+        self.assertEqual(entry.validators, {'If-None-Match': '"abc"'})
+
+    def test_put_ignores_responses_without_validators(self):
+        """ Tests that responses that can't be revalidated are not stored """
+        # Arrange
+        cache = HTTPCache(self.__cache_dir.name, 1024)
+
+        # Act
+        cache.put("http://host/file", None, None, io.BytesIO(b"contents"))
+
+        # Assert
+        self.assertIsNone(cache.get("http://host/file"))
+
+    def test_put_evicts_least_recently_used_responses(self):
+        """ Tests that when the cache grows beyond its maximum size,
+            the least recently used responses are evicted """
+        # Arrange
+        cache = HTTPCache(self.__cache_dir.name, 20)
+        cache.put("http://host/1", '"1"', None, io.BytesIO(b"0123456789"))
+        cache.put("http://host/2", '"2"', None, io.BytesIO(b"0123456789"))
+
+        # Act
+        cache.read_to(cache.get("http://host/1"), io.BytesIO())
+        cache.put("http://host/3", '"3"', None, io.BytesIO(b"0123456789"))
+
+        # Assert
+        self.assertIsNotNone(cache.get("http://host/1"))
+        self.assertIsNone(cache.get("http://host/2"))
+        self.assertIsNotNone(cache.get("http://host/3"))
+
+    def test_open_leaves_unrelated_files_untouched(self):
+        """ Tests that files in the cache directory which were not created by the cache
+            are left untouched, while invalid cache entries are removed """
+        # Arrange
+        invalid_key = "0" * 64
+        for file_name, contents in (("settings.json", "not a cache entry"),
+                                    ("notes.txt", "hello"),
+                                    (invalid_key + ".json", "{corrupted"),
+                                    (invalid_key + ".data", "contents")):
+            with open(os.path.join(self.__cache_dir.name, file_name), "w",
+                      encoding="utf-8") as file:
+                file.write(contents)
+
+        # Act
+        HTTPCache(self.__cache_dir.name, 1024)
+
+        # Assert
+        self.assertEqual(sorted(os.listdir(self.__cache_dir.name)),
+                         ["notes.txt", "settings.json"])
@@ -11,6 +11,7 @@ import tempfile
 import zipfile
 import sys
 from full_offline_backup_for_todoist.__init__ import main
+from full_offline_backup_for_todoist.virtual_fs import ZipVirtualFs
 from .test_url_downloader import TestStaticHTTPServer
 
 class TestIntegration(unittest.TestCase):
@@ -75,10 +76,13 @@ class TestIntegration(unittest.TestCase):
         """ Compares the contents of the given two zip files """
         with zipfile.ZipFile(zip_path_1, 'r') as zip_file_1:
             with zipfile.ZipFile(zip_path_2, 'r') as zip_file_2:
-                # Compare the list of file names
+                # Compare the list of file names, except for the manifests, which contain the
+                # time when the backup was made, and are only present on the backup just made
                 name_list_1 = sorted(zip_file_1.namelist())
-                name_list_2 = sorted(zip_file_2.namelist())
+                name_list_2 = sorted(name for name in zip_file_2.namelist()
+                                     if not name.startswith(ZipVirtualFs.MANIFEST_FOLDER))
                 self.assertEqual(name_list_1, name_list_2)
+                self.assertIn(ZipVirtualFs.MANIFEST_FOLDER + "0001.jsonl", zip_file_2.namelist())
 
                 # Compare the contents of every file
                 for filename in name_list_1:
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+""" Tests for the incremental JSON decoder """
+# pylint: disable=invalid-name
+import unittest
+import io
+import json
+from unittest.mock import patch
+from full_offline_backup_for_todoist.json_stream import iterate_json_object
+
+class TestJsonStream(unittest.TestCase):
+    """ Tests for the incremental JSON decoder """
+
+    def test_iterate_json_object_yields_array_elements_one_by_one(self):
+        """ Tests that the elements of the given arrays are yielded one by one,
+            and the rest of the members as a whole """
+        # Arrange
+        document = {
+            "sync_token": "token",
+            "projects": [{"id": "1", "name": "Inbox"}, {"id": "2", "name": "Work"}],
+            "empty": [],
+            "user": {"id": "100", "tags": [1, 2]},
+        }
+
+        # Act
+        members = list(iterate_json_object(io.BytesIO(json.dumps(document).encode()),
+                                           ["projects", "empty", "user"]))
+
+        # Assert
+        self.assertEqual(members, [
+            ("sync_token", "token"),
+            ("projects", {"id": "1", "name": "Inbox"}),
+            ("projects", {"id": "2", "name": "Work"}),
+            ("user", {"id": "100", "tags": [1, 2]}),
+        ])
+
+    def test_iterate_json_object_decodes_values_split_across_chunks(self):
+        """ Tests that values are decoded correctly when they are split between the chunks
+            read from the stream, including integers, floats with exponents
+            and multi-byte UTF-8 characters """
+        # Arrange
+        items = [{"id": i, "content": "Ñandú " * i, "order": 1234567890123,
+                  "ratio": i + 0.5, "weight": -1.25e-7 * i} for i in range(64)]
+        document = json.dumps({"items": items, "ratio": 1.5, "scale": -2.5e+10,
+                               "count": 1234567890}, ensure_ascii=False)
+
+        for chunk_size in range(1, 32):
+            with self.subTest(chunk_size=chunk_size):
+                # Act
+                with patch('full_offline_backup_for_todoist.json_stream.CHUNK_SIZE', chunk_size):
+                    members = list(iterate_json_object(io.BytesIO(document.encode()), ["items"]))
+
+                # Assert
+                self.assertEqual(members, [("items", item) for item in items] +
+                                          [("ratio", 1.5), ("scale", -2.5e+10),
+                                           ("count", 1234567890)])
+
+    def test_iterate_json_object_throws_on_invalid_json(self):
+        """ Tests that an exception is thrown when the stream doesn't contain a valid object """
+        for document in [b"", b"[]", b'{"items": [1, 2', b'{"items": [1, ]}', b'{"a": 1,}',
+                         b'{"a": 1} {}', b'{1: 2}']:
+            with self.subTest(document=document):
+                # Act/Assert
+                self.assertRaises(json.JSONDecodeError, list,
+                                  iterate_json_object(io.BytesIO(document), ["items"]))
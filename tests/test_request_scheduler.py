@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+""" Tests for the HTTP request scheduler """
+# pylint: disable=invalid-name
+import unittest
+from full_offline_backup_for_todoist.request_scheduler import RequestScheduler, parse_retry_after
+from full_offline_backup_for_todoist.request_scheduler import RequestSchedulerConfig
+
+class FakeClock:
+    """ Clock whose time only advances when the test says so """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestRequestScheduler(unittest.TestCase):
+    """ Tests for the HTTP request scheduler """
+
+    def test_parse_retry_after_accepts_seconds_and_dates(self):
+        """ Tests that both forms of the 'Retry-After' header are parsed """
+        # Act/Assert
+        self.assertEqual(parse_retry_after("120"), 120.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412470.0),
+                         10.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_on_transient_failure_retries_with_backoff(self):
+        """ Tests that network errors and server errors are retried with an increasing
+            backoff, up to the maximum number of retries """
+        # Arrange
+        scheduler = RequestScheduler(RequestSchedulerConfig(max_retries=3), FakeClock())
+
+        # Act
+        delays = [scheduler.on_failure("host", attempt, status, None)
+                  for attempt, status in enumerate((None, 503, 500, 502))]
+
+        # Assert
+        self.assertTrue(0.5 <= delays[0] <= 1)
+        self.assertTrue(1.5 <= delays[1] <= 3)
+        self.assertTrue(4.5 <= delays[2] <= 9)
+        self.assertIsNone(delays[3])
+
+    def test_on_client_error_doesnt_retry(self):
+        """ Tests that errors which won't go away by retrying, such as 404, are not retried """
+        # Arrange
+        scheduler = RequestScheduler(clock=FakeClock())
+
+        # Act/Assert
+        self.assertIsNone(scheduler.on_failure("host", 0, 404, None))
+        self.assertIsNone(scheduler.on_failure("host", 0, 403, None))
+
+    def test_on_rate_limited_honors_retry_after_for_all_requests_to_host(self):
+        """ Tests that after a 429 response with 'Retry-After', the failed request and
+            any other request to the same host wait for the requested time """
+        # Arrange
+        clock = FakeClock()
+        scheduler = RequestScheduler(clock=clock)
+
+        # Act
+        retry_delay = scheduler.on_failure("host", 0, 429, 30.0)
+        clock.now += 10
+        other_request_delay = scheduler.reserve("host")
+        other_host_delay = scheduler.reserve("otherhost")
+
+        # Assert
+        self.assertEqual(retry_delay, 30.0)
+        self.assertEqual(other_request_delay, 20.0)
+        self.assertEqual(other_host_delay, 0.0)
+
+    def test_token_bucket_limits_request_rate(self):
+        """ Tests that requests beyond the burst size are spaced according to the rate,
+            and that the rate is halved when being rate limited """
+        # Arrange
+        scheduler = RequestScheduler(RequestSchedulerConfig(initial_rate=10.0, burst=2.0),
+                                     FakeClock())
+
+        # Act
+        delays = [scheduler.reserve("host") for _ in range(4)]
+        scheduler.on_failure("host", 0, 429, None)
+        delay_after_rate_limit = scheduler.reserve("host")
+
+        # Assert
+        self.assertEqual(delays[:2], [0.0, 0.0])
+        self.assertAlmostEqual(delays[2], 0.1)
+        self.assertAlmostEqual(delays[3], 0.2)
+        self.assertAlmostEqual(delay_after_rate_limit, 0.6)
+
+    def test_retry_budget_limits_retries(self):
+        """ Tests that once the global retry budget is spent, requests are no longer retried,
+            until enough new requests refill it """
+        # Arrange
+        scheduler = RequestScheduler(
+            RequestSchedulerConfig(min_retry_budget=2.0, retry_budget_ratio=0.5), FakeClock())
+
+        # Act
+        first_retries = [scheduler.on_failure(f"host{i}", 0, None, None) for i in range(3)]
+        scheduler.reserve("host")
+        scheduler.reserve("host")
+        retry_after_refill = scheduler.on_failure("host", 0, None, None)
+
+        # Assert
+        self.assertIsNotNone(first_retries[0])
+        self.assertIsNotNone(first_retries[1])
+        self.assertIsNone(first_retries[2])
+        self.assertIsNotNone(retry_after_refill)
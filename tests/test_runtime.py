@@ -2,8 +2,10 @@
 """ Tests for the runtime dependency injection container """
 # pylint: disable=invalid-name
 import unittest
+from unittest.mock import patch
 from full_offline_backup_for_todoist.controller import TodoistAuth
 from full_offline_backup_for_todoist.runtime import RuntimeControllerDependencyInjector
+from full_offline_backup_for_todoist.url_downloader import URLLibURLDownloader
 
 class TestRuntime(unittest.TestCase):
     """ Tests for the runtime dependency injection container """
@@ -29,3 +31,16 @@ class TestRuntime(unittest.TestCase):
         self.assertIsNotNone(backup_downloader1)
         self.assertIs(backup_attachments_dl1, backup_attachments_dl2)
         self.assertIsNotNone(backup_attachments_dl1)
+
+    def test_runtime_dependency_injector_close_closes_url_downloader(self):
+        """ Tests that closing the DI container closes the connections
+            kept alive by the URL downloader """
+        # Arrange
+        runtimedi = RuntimeControllerDependencyInjector(TodoistAuth("1234"), False, False)
+
+        # Act
+        with patch.object(URLLibURLDownloader, 'close') as close:
+            runtimedi.close()
+
+        # Assert
+        close.assert_called_once_with()
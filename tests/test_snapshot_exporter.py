@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+""" Tests for the Todoist snapshot exporter class """
+# pylint: disable=invalid-name
+import unittest
+import csv
+import io
+import json
+from unittest.mock import MagicMock
+from full_offline_backup_for_todoist.snapshot_exporter import TodoistSnapshotExporter
+from full_offline_backup_for_todoist.backup_attachments_downloader import (
+    TodoistBackupAttachmentsDownloader)
+from full_offline_backup_for_todoist.todoist_api import TodoistProjectInfo, TodoistSnapshot
+from full_offline_backup_for_todoist.tracer import NullTracer
+from .test_util_memory_vfs import InMemoryVfs
+
+class TestSnapshotExporter(unittest.TestCase):
+    """ Tests for the Todoist snapshot exporter class """
+    _TEST_PROJECT = TodoistProjectInfo("Inbox", "1")
+    _TEST_FILE_URL = "http://www.example.com/image.jpg"
+
+    def setUp(self):
+        """ Creates the sample snapshot for the test """
+        self.__snapshot = TodoistSnapshot("token", [self._TEST_PROJECT], {
+            "user": {"id": "100", "full_name": "Alice", "tz_info": {"timezone": "Europe/Madrid"}},
+            "collaborators": [{"id": "101", "full_name": "Bob"}],
+            "projects": [{"id": "1", "name": "Inbox"}],
+            "sections": [
+                {"id": "20", "project_id": "1", "name": "Later", "section_order": 2},
+                {"id": "21", "project_id": "1", "name": "Soon", "section_order": 1},
+                {"id": "22", "project_id": "1", "name": "Gone", "is_deleted": True},
+            ],
+            "items": [
+                {"id": "10", "project_id": "1", "content": "Second", "child_order": 2,
+                 "priority": 4, "labels": ["home"], "added_by_uid": "101",
+                 "due": {"string": "every day", "lang": "en"}},
+                {"id": "11", "project_id": "1", "content": "First", "child_order": 1},
+                {"id": "12", "project_id": "1", "content": "Subtask", "parent_id": "11"},
+                {"id": "13", "project_id": "1", "content": "Done", "checked": True},
+                {"id": "14", "project_id": "1", "content": "In section", "section_id": "20"},
+                {"id": "15", "project_id": "1", "content": "Other section", "section_id": "21"},
+                {"id": "16", "project_id": "2", "content": "Other project"},
+            ],
+            "notes": [
+                {"id": "30", "item_id": "11", "content": "Look", "posted_uid": "100",
+                 "file_attachment": {"file_name": "image.jpg", "file_url": self._TEST_FILE_URL}},
+            ],
+            "labels": [{"id": "40", "name": "home"}],
+        })
+
+    def test_export_project_as_csv_follows_todoist_layout(self):
+        """ Tests that the CSV export lists the tasks without a section first, followed by each
+            section and its tasks, with the subtasks after their parent task """
+        # Arrange
+        exporter = TodoistSnapshotExporter(self.__snapshot)
+
+        # Act
+        csv_data = exporter.export_project_as_csv(self._TEST_PROJECT)
+
+        # Assert
+        rows = list(csv.reader(io.StringIO(csv_data.decode('utf-8-sig'))))
+        self.assertEqual(rows[0][:2], ["TYPE", "CONTENT"])
+        self.assertEqual([row[:2] for row in rows[1:] if row[0]], [
+            ["task", "First"],
+            ["note", 'Look [[file {"file_name": "image.jpg", "file_url": '
+                     '"http://www.example.com/image.jpg"}]]'],
+            ["task", "Subtask"],
+            ["task", "Second @home"],
+            ["section", "Soon"],
+            ["task", "Other section"],
+            ["section", "Later"],
+            ["task", "In section"],
+        ])
+        second_task = next(row for row in rows if row[1] == "Second @home")
+        self.assertEqual(second_task[3:], ["1", "1", "Bob (101)", "", "every day", "en",
+                                           "Europe/Madrid"])
+        subtask = next(row for row in rows if row[1] == "Subtask")
+        self.assertEqual(subtask[4:6], ["2", "Alice (100)"])
+
+    def test_export_project_as_csv_attachments_can_be_downloaded(self):
+        """ Tests that the attachments of the comments in the CSV export are found
+            and downloaded like those of the CSV files exported by Todoist """
+        # Arrange
+        vfs = InMemoryVfs()
+        vfs.write_file("Inbox [1].csv", TodoistSnapshotExporter(
+            self.__snapshot).export_project_as_csv(self._TEST_PROJECT))
+        fake_urldownloader = MagicMock(
+            get_to_file=lambda url, output: output.write(url.encode()))
+
+        # Act
+        TodoistBackupAttachmentsDownloader(
+            NullTracer(), fake_urldownloader).download_attachments(vfs)
+
+        # Assert
+        self.assertEqual(vfs.read_file("attachments/image.jpg"), self._TEST_FILE_URL.encode())
+
+    def test_export_project_as_json_includes_project_resources(self):
+        """ Tests that the JSON export contains the active sections, items and comments
+            of the project, but nothing from other projects """
+        # Arrange
+        exporter = TodoistSnapshotExporter(self.__snapshot)
+
+        # Act
+        project_json = json.loads(exporter.export_project_as_json(self._TEST_PROJECT))
+        labels_json = json.loads(exporter.export_labels_as_json())
+
+        # Assert
+        self.assertEqual(project_json["project"]["name"], "Inbox")
+        self.assertEqual([section["id"] for section in project_json["sections"]], ["20", "21"])
+        self.assertEqual([item["id"] for item in project_json["items"]],
+                         ["10", "11", "12", "13", "14", "15"])
+        self.assertEqual([note["id"] for note in project_json["notes"]], ["30"])
+        self.assertEqual([label["name"] for label in labels_json], ["home"])
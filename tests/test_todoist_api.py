@@ -8,6 +8,11 @@ from full_offline_backup_for_todoist.todoist_api import TodoistApi, TodoistProje
 from full_offline_backup_for_todoist.url_downloader import URLDownloaderException
 from full_offline_backup_for_todoist.tracer import NullTracer
 
+def _fake_urldownloader(response):
+    """ Creates a fake URL downloader, which returns the given response to POST requests """
+    return MagicMock(post_to_file=MagicMock(
+        side_effect=lambda url, output, data: output.write(response)))
+
 class TestTodoistApi(unittest.TestCase):
     """ Tests for the Todoist API wrapper """
 
@@ -15,8 +20,7 @@ class TestTodoistApi(unittest.TestCase):
         """ Tests that when the operation to get the projects returns an empty JSON list,
             an empty list of projects is returned """
         # Arrange
-        mock_urldownloader = MagicMock()
-        mock_urldownloader.post.return_value = b'{"projects": []}'
+        mock_urldownloader = _fake_urldownloader(b'{"projects": []}')
 
         # Act
         projects = TodoistApi("FAKE_TOKEN", NullTracer(), mock_urldownloader).get_projects()
@@ -29,11 +33,10 @@ class TestTodoistApi(unittest.TestCase):
             the correct list of projects is returned """
 
         # Arrange
-        mock_urldownloader = MagicMock()
-        mock_urldownloader.post.return_value = b"""{ "projects" : [
+        mock_urldownloader = _fake_urldownloader(b"""{ "projects" : [
             { "id" : 2181147711, "name" : "Not Work" },
             { "id" : 2181147713, "name" : "Work" }
-        ]}"""
+        ]}""")
 
         todoist_api = TodoistApi("FAKE_TOKEN", NullTracer(), mock_urldownloader)
 
@@ -53,8 +56,7 @@ class TestTodoistApi(unittest.TestCase):
         """ Tests that the token is correctly URL encoded when using the Todoist API """
 
         # Arrange
-        mock_urldownloader = MagicMock()
-        mock_urldownloader.post.return_value = b'{"projects": []}'
+        mock_urldownloader = _fake_urldownloader(b'{"projects": []}')
 
         todoist_api = TodoistApi("FAKE TOKEN", NullTracer(), mock_urldownloader)
 
@@ -63,7 +65,7 @@ class TestTodoistApi(unittest.TestCase):
 
         # Assert
         mock_urldownloader.set_bearer_token.assert_called_with('FAKE TOKEN')
-        mock_urldownloader.post.assert_called_with(ANY, {
+        mock_urldownloader.post_to_file.assert_called_with(ANY, ANY, {
             'sync_token': '*',
             'resource_types': '["projects"]'
         })
@@ -72,8 +74,7 @@ class TestTodoistApi(unittest.TestCase):
         """ Tests that an exception is thrown when the Todoist API returns an invalid JSON """
 
         # Arrange
-        mock_urldownloader = MagicMock()
-        mock_urldownloader.post.return_value = b"["
+        mock_urldownloader = _fake_urldownloader(b"[")
 
         todoist_api = TodoistApi("FAKE_TOKEN", NullTracer(), mock_urldownloader)
 
@@ -85,7 +86,7 @@ class TestTodoistApi(unittest.TestCase):
 
         # Arrange
         mock_urldownloader = MagicMock()
-        mock_urldownloader.post.side_effect = URLDownloaderException('Test')
+        mock_urldownloader.post_to_file.side_effect = URLDownloaderException('Test')
 
         todoist_api = TodoistApi("FAKE_TOKEN", NullTracer(), mock_urldownloader)
 
@@ -116,3 +117,67 @@ class TestTodoistApi(unittest.TestCase):
             "project_id": 123,
             "use_relative_dates": "true",
         })
+
+    def test_get_project_changes_returns_changed_projects_and_items(self):
+        """ Tests that the changes since a previous synchronization are parsed,
+            telling apart the updated projects from the removed ones """
+        # Arrange
+        mock_urldownloader = _fake_urldownloader(b"""{
+            "sync_token": "newtoken", "full_sync": false,
+            "projects": [
+                { "id": "1", "name": "Updated" },
+                { "id": "2", "name": "Deleted", "is_deleted": true },
+                { "id": "3", "name": "Archived", "is_archived": true }
+            ],
+            "items": [
+                { "id": "10", "project_id": "1" },
+                { "id": "11", "project_id": "4", "is_deleted": true }
+            ],
+            "sections": [ { "id": "20", "project_id": "5" } ],
+            "notes": [ { "id": "30", "item_id": "12" } ]
+        }""")
+
+        # Act
+        changes = TodoistApi("FAKE_TOKEN", NullTracer(), mock_urldownloader).get_project_changes(
+            "oldtoken")
+
+        # Assert
+        mock_urldownloader.post_to_file.assert_called_with(ANY, ANY, {
+            'sync_token': 'oldtoken',
+            'resource_types': '["projects", "items", "sections", "notes"]'
+        })
+        self.assertEqual(changes.sync_token, "newtoken")
+        self.assertFalse(changes.full_sync)
+        self.assertEqual([(project.name, project.identifier) for project in changes.projects],
+                         [("Updated", "1")])
+        self.assertEqual(changes.removed_project_ids, {"2", "3"})
+        self.assertEqual(changes.item_projects, {"10": "1", "11": None})
+        self.assertEqual(changes.changed_project_ids, {"5"})
+        self.assertEqual(changes.changed_note_item_ids, {"12"})
+
+    def test_get_snapshot_returns_active_projects_and_resources(self):
+        """ Tests that the snapshot requests all the resources with a single request,
+            and lists only the projects which are not archived nor deleted """
+        # Arrange
+        mock_urldownloader = _fake_urldownloader(b"""{
+            "sync_token": "token",
+            "projects": [
+                { "id": "1", "name": "Active" },
+                { "id": "2", "name": "Deleted", "is_deleted": true },
+                { "id": "3", "name": "Archived", "is_archived": true }
+            ],
+            "items": [ { "id": "10", "project_id": "1" } ]
+        }""")
+
+        # Act
+        snapshot = TodoistApi("FAKE_TOKEN", NullTracer(), mock_urldownloader).get_snapshot()
+
+        # Assert
+        mock_urldownloader.post_to_file.assert_called_once_with(ANY, ANY, {
+            'sync_token': '*',
+            'resource_types': '["all"]'
+        })
+        self.assertEqual(snapshot.sync_token, "token")
+        self.assertEqual([(project.name, project.identifier) for project in snapshot.projects],
+                         [("Active", "1")])
+        self.assertEqual(snapshot.resources["items"], [{"id": "10", "project_id": "1"}])
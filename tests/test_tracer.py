@@ -4,7 +4,10 @@
 import unittest
 from unittest.mock import patch
 import io
-from full_offline_backup_for_todoist.tracer import NullTracer, ConsoleTracer
+import json
+import os
+import tempfile
+from full_offline_backup_for_todoist.tracer import NullTracer, ConsoleTracer, JsonLinesTracer
 
 class TestTracer(unittest.TestCase):
     """ Tests for the tracer classes """
@@ -32,3 +35,33 @@ class TestTracer(unittest.TestCase):
 
             # Assert
             self.assertEqual(mock_stdout.getvalue().strip(), "")
+
+    def test_json_lines_tracer_traces_spans_with_duration_and_counters(self):
+        """ Tests that the JSON lines tracer appends the messages and the finished spans
+            (with their duration, attributes, counters and error) to the file """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Arrange
+            trace_path = os.path.join(tmp_dir, "trace.jsonl")
+            tracer = JsonLinesTracer(trace_path)
+
+            # Act
+            tracer.trace("this is a string")
+            with tracer.span("download", url="http://www.example.com") as span:
+                span.count("bytes", 100)
+                span.count("retries")
+                span.count("bytes", 20)
+            with self.assertRaises(ValueError):
+                with tracer.span("parse"):
+                    raise ValueError("invalid")
+
+            # Assert
+            with open(trace_path, encoding='utf-8') as trace_file:
+                records = [json.loads(line) for line in trace_file]
+            self.assertEqual([record["type"] for record in records], ["trace", "span", "span"])
+            self.assertEqual(records[0]["message"], "this is a string")
+            self.assertEqual(records[1]["name"], "download")
+            self.assertEqual(records[1]["attributes"], {"url": "http://www.example.com"})
+            self.assertEqual(records[1]["counters"], {"bytes": 120, "retries": 1})
+            self.assertIsNone(records[1]["error"])
+            self.assertGreaterEqual(records[1]["duration"], 0)
+            self.assertEqual(records[2]["error"], "ValueError('invalid')")
@@ -2,14 +2,28 @@
 """ Tests for the URL downloader """
 # pylint: disable=invalid-name
 import unittest
+import asyncio
+import io
 import time
 import socket
-import sys
-from unittest.mock import patch
+import tempfile
+from unittest.mock import patch, AsyncMock
 from full_offline_backup_for_todoist.url_downloader import URLLibURLDownloader, URLDownloaderException
+from full_offline_backup_for_todoist.url_downloader import AsyncURLDownloader
+from full_offline_backup_for_todoist.http_cache import HTTPCache
+from full_offline_backup_for_todoist.request_scheduler import RequestScheduler
+from full_offline_backup_for_todoist.request_scheduler import RequestSchedulerConfig
 from full_offline_backup_for_todoist.tracer import NullTracer
 from .test_util_static_http_request_handler import TestStaticHTTPServer
 
+class _SpanRecordingTracer(NullTracer):
+    """ Tracer which keeps the finished spans, for the tests """
+    def __init__(self):
+        self.spans = []
+
+    def finish_span(self, span):
+        self.spans.append(span)
+
 @patch.object(time, 'sleep', lambda secs: None) # For faster tests
 class TestFrontend(unittest.TestCase):
     """ Tests for the URL downloader """
@@ -29,11 +43,26 @@ class TestFrontend(unittest.TestCase):
 
         self.__httpd = TestStaticHTTPServer(("127.0.0.1", 33327), route_responses)
         self.__flaky_httpd = TestStaticHTTPServer(("127.0.0.1", 33328), route_responses, True)
+        self.__keep_alive_httpd = TestStaticHTTPServer(("127.0.0.1", 33330), route_responses,
+                                                       keep_alive=True)
+        self.__compressing_httpd = TestStaticHTTPServer(("127.0.0.1", 33331), route_responses,
+                                                        compress=True)
+        self.__revalidating_httpd = TestStaticHTTPServer(("127.0.0.1", 33332), route_responses,
+                                                         etag=True)
+        self.__truncating_httpd = TestStaticHTTPServer(("127.0.0.1", 33333), route_responses,
+                                                       truncate=True)
+        self.__truncating_compressing_httpd = TestStaticHTTPServer(
+            ("127.0.0.1", 33335), route_responses, compress=True, truncate=True)
 
     def tearDown(self):
         """ Destroys the sample HTTP server for the test """
         self.__httpd.shutdown()
         self.__flaky_httpd.shutdown()
+        self.__truncating_httpd.shutdown()
+        self.__truncating_compressing_httpd.shutdown()
+        self.__keep_alive_httpd.shutdown()
+        self.__compressing_httpd.shutdown()
+        self.__revalidating_httpd.shutdown()
 
     def test_urldownloader_can_download_local_file(self):
         """ Tests that the downloader can successfully download an existing file """
@@ -58,6 +87,117 @@ class TestFrontend(unittest.TestCase):
         # Assert
         self.assertEqual(data.decode(), "this is a sample")
 
+    def test_urldownloader_retries_truncated_response(self):
+        """ Tests that a response which is cut off before the length given by its
+            'Content-Length' header is not accepted as complete, but retried """
+        # Arrange
+        tracer = _SpanRecordingTracer()
+        urldownloader = URLLibURLDownloader(tracer)
+
+        # Act
+        data = urldownloader.get("http://127.0.0.1:33333/sample.txt")
+
+        # Assert
+        self.assertEqual(data.decode(), "this is a sample")
+        self.assertEqual(tracer.spans[0].counters["retries"], 1)
+
+    def test_urldownloader_traces_request_span_with_bytes_and_retries(self):
+        """ Tests that each request is traced as a span, which counts the bytes downloaded
+            and the retries needed to download them """
+        # Arrange
+        tracer = _SpanRecordingTracer()
+        urldownloader = URLLibURLDownloader(tracer)
+
+        # Act
+        urldownloader.get("http://127.0.0.1:33328/sample.txt")
+
+        # Assert
+        [span] = tracer.spans
+        self.assertEqual(span.name, "http_request")
+        self.assertEqual(span.attributes["status"], 200)
+        self.assertEqual(span.counters, {"bytes": len(b"this is a sample"), "retries": 1})
+
+    def test_urldownloader_can_download_to_file(self):
+        """ Tests that the downloader can download an existing file to a file object,
+            discarding the contents of the failed attempts """
+        # Arrange
+        urldownloader = URLLibURLDownloader(NullTracer())
+        output = io.BytesIO(b"header:")
+        output.seek(0, io.SEEK_END)
+
+        # Act
+        urldownloader.get_to_file("http://127.0.0.1:33328/sample.txt", output)
+
+        # Assert
+        self.assertEqual(output.getvalue(), b"header:this is a sample")
+
+    def test_urldownloader_decompresses_compressed_responses(self):
+        """ Tests that the downloader transparently decompresses responses
+            sent with a content encoding """
+        # Arrange
+        urldownloader = URLLibURLDownloader(NullTracer())
+
+        # Act
+        data = urldownloader.get("http://127.0.0.1:33331/sample.txt")
+
+        # Assert
+        self.assertEqual(data.decode(), "this is a sample")
+
+    def test_urldownloader_retries_truncated_compressed_response(self):
+        """ Tests that a response whose compressed stream is cut off is not accepted
+            as complete, but retried, even if it has the length given by its headers """
+        # Arrange
+        tracer = _SpanRecordingTracer()
+        urldownloader = URLLibURLDownloader(tracer)
+
+        # Act
+        data = urldownloader.get("http://127.0.0.1:33335/sample.txt")
+
+        # Assert
+        self.assertEqual(data.decode(), "this is a sample")
+        self.assertEqual(tracer.spans[0].counters["retries"], 1)
+
+    def test_urldownloader_revalidates_cached_responses(self):
+        """ Tests that a cached file is revalidated with the server instead of downloaded again,
+            and that the cache survives across downloader instances """
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Arrange
+            url = "http://127.0.0.1:33332/sample.txt"
+            first_output, second_output = io.BytesIO(), io.BytesIO()
+
+            # Act
+            URLLibURLDownloader(NullTracer(), cache=HTTPCache(cache_dir, 1024)).get_to_file(
+                url, first_output)
+            URLLibURLDownloader(NullTracer(), cache=HTTPCache(cache_dir, 1024)).get_to_file(
+                url, second_output)
+
+            # Assert
+            self.assertEqual(first_output.getvalue(), b"this is a sample")
+            self.assertEqual(second_output.getvalue(), b"this is a sample")
+            self.assertEqual(self.__revalidating_httpd.not_modified_paths, ["/sample.txt"])
+
+    def test_urldownloader_reuses_keep_alive_connections(self):
+        """ Tests that the downloader reuses the same connection for consecutive requests
+            to a server that supports persistent connections """
+        # Arrange
+        urldownloader = URLLibURLDownloader(NullTracer())
+
+        # Act
+        data1 = urldownloader.get("http://127.0.0.1:33330/sample.txt")
+        data2 = urldownloader.get("http://127.0.0.1:33330/sample.txt", {'urlparam': 'yes'})
+        data3 = urldownloader.post("http://127.0.0.1:33330/sample.txt", {'param': 'value'})
+        self.assertRaises(URLDownloaderException, urldownloader.get,
+                          "http://127.0.0.1:33330/notfound.txt")
+        data4 = urldownloader.get("http://127.0.0.1:33330/sample.txt")
+        urldownloader.close()
+
+        # Assert
+        self.assertEqual(data1.decode(), "this is a sample")
+        self.assertEqual(data2.decode(), "this is a sample with query params")
+        self.assertEqual(data3.decode(), "this is a sample with form data")
+        self.assertEqual(data4.decode(), "this is a sample")
+        self.assertEqual(self.__keep_alive_httpd.connection_count, 1)
+
     def test_urldownloader_can_pass_query_params(self):
         """ Tests that the downloader can successfully download an existing file,
             passing parameters in the URL """
@@ -82,6 +222,20 @@ class TestFrontend(unittest.TestCase):
         # Assert
         self.assertEqual(data.decode(), "this is a sample with form data")
 
+    def test_urldownloader_can_post_to_file(self):
+        """ Tests that the downloader can write the response of a POST request to a file """
+        # Arrange
+        urldownloader = URLLibURLDownloader(NullTracer())
+
+        # Act
+        with io.BytesIO() as output:
+            urldownloader.post_to_file("http://127.0.0.1:33327/sample.txt", output,
+                                       {'param': 'value'})
+            data = output.getvalue()
+
+        # Assert
+        self.assertEqual(data.decode(), "this is a sample with form data")
+
     def test_urldownloader_throws_on_not_found(self):
         """ Tests that the downloader raises an exception on a non-existing file """
         # Arrange
@@ -91,14 +245,183 @@ class TestFrontend(unittest.TestCase):
         self.assertRaises(URLDownloaderException, urldownloader.get, "http://127.0.0.1:33327/notfound.txt")
 
     def test_urldownloader_throws_on_timeout(self):
+        """ Tests that the downloader raises a retryable exception when the server
+            doesn't respond in time """
+        # Arrange
+        scheduler = RequestScheduler(RequestSchedulerConfig(max_retries=0))
+        urldownloader = URLLibURLDownloader(NullTracer(), 0.3, scheduler)
+
+        # Act/Assert
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('127.0.0.1', 33329))
+            s.listen()
+            with self.assertRaises(URLDownloaderException) as context:
+                urldownloader.get("http://127.0.0.1:33329")
+            self.assertIsNone(context.exception.status)
+
+@patch.object(asyncio, 'sleep', AsyncMock()) # For faster tests
+class TestAsyncURLDownloader(unittest.TestCase):
+    """ Tests for the asyncio-based URL downloader """
+
+    def setUp(self):
+        """ Creates the sample HTTP server for the test """
+
+        # Set up a quick and dirty HTTP server
+        route_responses = {
+            ("GET", "/sample.txt", None, None):
+                b"this is a sample",
+            ("GET", "/sample.txt?urlparam=yes", None, None):
+                b"this is a sample with query params",
+            ("POST", "/sample.txt", b"param=value", "mysecrettoken"):
+                b"this is a sample with form data",
+        }
+
+        self.__httpd = TestStaticHTTPServer(("127.0.0.1", 33327), route_responses)
+        self.__flaky_httpd = TestStaticHTTPServer(("127.0.0.1", 33328), route_responses, True)
+        self.__compressing_httpd = TestStaticHTTPServer(("127.0.0.1", 33331), route_responses,
+                                                        compress=True)
+        self.__revalidating_httpd = TestStaticHTTPServer(("127.0.0.1", 33332), route_responses,
+                                                         etag=True)
+        self.__truncating_httpd = TestStaticHTTPServer(("127.0.0.1", 33333), route_responses,
+                                                       truncate=True)
+        self.__truncating_compressing_httpd = TestStaticHTTPServer(
+            ("127.0.0.1", 33335), route_responses, compress=True, truncate=True)
+        self.__malformed_httpd = TestStaticHTTPServer(("127.0.0.1", 33334), route_responses,
+                                                      malformed=True)
+
+    def tearDown(self):
+        """ Destroys the sample HTTP server for the test """
+        self.__httpd.shutdown()
+        self.__flaky_httpd.shutdown()
+        self.__compressing_httpd.shutdown()
+        self.__revalidating_httpd.shutdown()
+        self.__truncating_httpd.shutdown()
+        self.__truncating_compressing_httpd.shutdown()
+        self.__malformed_httpd.shutdown()
+
+    def test_async_urldownloader_can_download_local_file(self):
+        """ Tests that the downloader can successfully download an existing file,
+            both through the blocking and the coroutine interfaces """
+        # Arrange
+        urldownloader = AsyncURLDownloader(NullTracer())
+
+        # Act
+        data = urldownloader.get("http://127.0.0.1:33327/sample.txt")
+        data_async = asyncio.run(urldownloader.get_async("http://127.0.0.1:33327/sample.txt"))
+
+        # Assert
+        self.assertEqual(data.decode(), "this is a sample")
+        self.assertEqual(data_async.decode(), "this is a sample")
+
+    def test_async_urldownloader_can_retry(self):
+        """ Tests that the downloader can successfully retry downloading a file from a
+            flaky server which may occasionally fail """
+        # Arrange
+        urldownloader = AsyncURLDownloader(NullTracer())
+
+        # Act
+        data = asyncio.run(urldownloader.get_async("http://127.0.0.1:33328/sample.txt"))
+
+        # Assert
+        self.assertEqual(data.decode(), "this is a sample")
+
+    def test_async_urldownloader_can_pass_query_params_and_form_data(self):
+        """ Tests that the downloader can successfully pass parameters in the URL,
+            and in the request body as form data along with the authorization """
+        # Arrange
+        urldownloader = AsyncURLDownloader(NullTracer())
+        urldownloader.set_bearer_token("mysecrettoken")
+
+        # Act
+        data_get = asyncio.run(urldownloader.get_async("http://127.0.0.1:33327/sample.txt",
+                                                       {'urlparam': 'yes'}))
+        data_post = asyncio.run(urldownloader.post_async("http://127.0.0.1:33327/sample.txt",
+                                                         {'param': 'value'}))
+
+        # Assert
+        self.assertEqual(data_get.decode(), "this is a sample with query params")
+        self.assertEqual(data_post.decode(), "this is a sample with form data")
+
+    def test_async_urldownloader_decompresses_compressed_responses(self):
+        """ Tests that the downloader transparently decompresses responses
+            sent with a content encoding """
+        # Arrange
+        urldownloader = AsyncURLDownloader(NullTracer())
+
+        # Act
+        data = asyncio.run(urldownloader.get_async("http://127.0.0.1:33331/sample.txt"))
+
+        # Assert
+        self.assertEqual(data.decode(), "this is a sample")
+
+    def test_async_urldownloader_retries_truncated_compressed_response(self):
+        """ Tests that a response whose compressed stream is cut off is not accepted
+            as complete, but retried, even if it has the length given by its headers """
+        # Arrange
+        tracer = _SpanRecordingTracer()
+        urldownloader = AsyncURLDownloader(tracer)
+
+        # Act
+        data = asyncio.run(urldownloader.get_async("http://127.0.0.1:33335/sample.txt"))
+
+        # Assert
+        self.assertEqual(data.decode(), "this is a sample")
+        self.assertEqual(tracer.spans[0].counters["retries"], 1)
+
+    def test_async_urldownloader_revalidates_cached_responses(self):
+        """ Tests that a cached file is revalidated with the server instead of downloaded again """
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Arrange
+            url = "http://127.0.0.1:33332/sample.txt"
+            urldownloader = AsyncURLDownloader(NullTracer(), cache=HTTPCache(cache_dir, 1024))
+            first_output, second_output = io.BytesIO(), io.BytesIO()
+
+            # Act
+            asyncio.run(urldownloader.get_to_file_async(url, first_output))
+            asyncio.run(urldownloader.get_to_file_async(url, second_output))
+
+            # Assert
+            self.assertEqual(first_output.getvalue(), b"this is a sample")
+            self.assertEqual(second_output.getvalue(), b"this is a sample")
+            self.assertEqual(self.__revalidating_httpd.not_modified_paths, ["/sample.txt"])
+
+    def test_async_urldownloader_throws_on_not_found(self):
         """ Tests that the downloader raises an exception on a non-existing file """
         # Arrange
-        urldownloader = URLLibURLDownloader(NullTracer(), 0.3)
+        urldownloader = AsyncURLDownloader(NullTracer())
+
+        # Act/Assert
+        self.assertRaises(URLDownloaderException, asyncio.run,
+                          urldownloader.get_async("http://127.0.0.1:33327/notfound.txt"))
+
+    def test_async_urldownloader_retries_truncated_and_malformed_responses(self):
+        """ Tests that the downloader retries responses cut off before their end,
+            or with an invalid chunk size, like any other network error """
+        # Arrange
+        tracer = _SpanRecordingTracer()
+        urldownloader = AsyncURLDownloader(tracer)
+
+        # Act
+        data_truncated = asyncio.run(urldownloader.get_async(
+            "http://127.0.0.1:33333/sample.txt"))
+        data_malformed = asyncio.run(urldownloader.get_async(
+            "http://127.0.0.1:33334/sample.txt"))
+
+        # Assert
+        self.assertEqual(data_truncated.decode(), "this is a sample")
+        self.assertEqual(data_malformed.decode(), "this is a sample")
+        self.assertEqual([span.counters["retries"] for span in tracer.spans], [1, 1])
+
+    def test_async_urldownloader_throws_on_timeout(self):
+        """ Tests that the downloader raises a retryable exception when the server
+            doesn't respond in time """
+        # Arrange
+        scheduler = RequestScheduler(RequestSchedulerConfig(max_retries=0))
+        urldownloader = AsyncURLDownloader(NullTracer(), 0.3, scheduler)
 
         # Act/Assert
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.bind(('127.0.0.1', 33329))
             s.listen()
-            # See https://docs.python.org/3/whatsnew/3.10.html#socket
-            exception = TimeoutError if sys.version_info >= (3, 10) else socket.timeout
-            self.assertRaises(exception, urldownloader.get, "http://127.0.0.1:33329")
+            self.assertRaises(URLDownloaderException, asyncio.run,
+                              urldownloader.get_async("http://127.0.0.1:33329"))
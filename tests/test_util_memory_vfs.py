@@ -1,8 +1,21 @@
 #!/usr/bin/python3
 """ Implementation of a VFS over memory, for the tests """
 # pylint: disable=invalid-name
+import io
 from full_offline_backup_for_todoist.virtual_fs import VirtualFs
 
+class _InMemoryFile(io.BytesIO):
+    """ File object that stores its contents in the VFS when it is closed """
+    def __init__(self, files, file_path):
+        super().__init__()
+        self.__files = files
+        self.__file_path = file_path
+
+    def close(self):
+        if not self.closed:
+            self.__files[self.__file_path] = self.getvalue()
+        super().close()
+
 class InMemoryVfs(VirtualFs):
     """ Implementation of a VFS over memory, for the tests """
     def __init__(self):
@@ -11,6 +24,9 @@ class InMemoryVfs(VirtualFs):
     def set_path_hint(self, dst_path):
         pass
 
+    def get_path(self):
+        return None
+
     def existed(self):
         return len(self.files) != 0
 
@@ -20,5 +36,8 @@ class InMemoryVfs(VirtualFs):
     def read_file(self, file_path):
         return self.files[file_path]
 
-    def write_file(self, file_path, file_data):
+    def write_file(self, file_path, file_data, source=None):
         self.files[file_path] = file_data
+
+    def open_write(self, file_path, source=None):
+        return _InMemoryFile(self.files, file_path)
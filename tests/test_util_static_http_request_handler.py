@@ -1,19 +1,40 @@
 #!/usr/bin/python3
 """ Static mapping HTTP Server for the tests """
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+import gzip
+import hashlib
 import threading
 
 class TestStaticHTTPServer:
     """ Static mapping HTTP Server for the tests """
-    def __init__(self, server_address, route_responses, flaky=False):
-        handler = TestStaticHTTPServer.make_test_http_request_handler(route_responses, flaky)
-        self.__httpd = HTTPServer(server_address, handler)
+    def __init__(self, server_address, route_responses, flaky=False, keep_alive=False,
+                 compress=False, etag=False, truncate=False, malformed=False):
+        self.__connections = set()
+        self.__not_modified = []
+        handler = TestStaticHTTPServer.make_test_http_request_handler(
+            route_responses, flaky, keep_alive, self.__connections, compress,
+            self.__not_modified if etag else None, truncate, malformed)
+        if keep_alive:
+            self.__httpd = ThreadingHTTPServer(server_address, handler)
+            self.__httpd.daemon_threads = True
+        else:
+            self.__httpd = HTTPServer(server_address, handler)
         self.__httpd_thread = threading.Thread(target=self.__httpd.serve_forever,
                                                # Use a lower value for faster shutdown on tests
                                                kwargs={"poll_interval": 0.05})
         self.__httpd_thread.start()
         self._handled = set()
 
+    @property
+    def connection_count(self):
+        """ Gets the number of client connections accepted by the server """
+        return len(self.__connections)
+
+    @property
+    def not_modified_paths(self):
+        """ Gets the paths for which a '304 Not Modified' response has been sent """
+        return list(self.__not_modified)
+
     def shutdown(self):
         """ Destroys the sample HTTP server for the test """
         self.__httpd.shutdown()
@@ -21,13 +42,26 @@ class TestStaticHTTPServer:
         self.__httpd.server_close()
 
     @staticmethod
-    def make_test_http_request_handler(route_responses, flaky):
+    def make_test_http_request_handler(route_responses, flaky, keep_alive=False,
+                                       connections=None, compress=False, not_modified=None,
+                                       truncate=False, malformed=False):
         """ Creates an HTTP Request Handler class with a static
-            route mapping defined by the given parameter. """
+            route mapping defined by the given parameter.
+            If a not modified list is given, responses have an ETag and can be revalidated.
+            If truncate is set, the first response to each path is cut off before its end,
+            or if it is compressed, its compressed stream is cut off before its end.
+            If malformed is set, the first response to each path has an invalid chunk size. """
         handled = set()
 
         class TestHTTPRequestHandler(BaseHTTPRequestHandler):
             """ Static HTTP Request Handler class for the tests """
+            protocol_version = "HTTP/1.1" if keep_alive else "HTTP/1.0"
+
+            def setup(self):
+                super().setup()
+                if connections is not None:
+                    connections.add(self.client_address)
+
             def log_message(self, format, *args): # pylint: disable=redefined-builtin
                 """ Disables console output for the HTTP Request Handler """
 
@@ -46,13 +80,49 @@ class TestStaticHTTPServer:
                 if flaky and self.path not in handled:
                     handled.add(self.path)
                     self.send_response(503)
+                    self.send_header('Content-Length', '0')
                     self.end_headers()
                     return
 
                 response = self.__find_response_for_request_key(request_key)
+                etag = f'"{hashlib.sha256(response).hexdigest()}"' if response else None
+                if (not_modified is not None and etag is not None and
+                        self.headers.get('If-None-Match') == etag):
+                    not_modified.append(self.path)
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
                 self.send_response(200 if response else 404)
+                if not_modified is not None and etag is not None:
+                    self.send_header('ETag', etag)
 
                 self.send_header('Content-type', 'text/plain')
+                if response and compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    response = gzip.compress(response)
+                    self.send_header('Content-Encoding', 'gzip')
+                if truncate and response and compress and self.path not in handled:
+                    handled.add(self.path)
+                    response = response[:len(response) // 2]
+                elif truncate and response and self.path not in handled:
+                    handled.add(self.path)
+                    self.send_header('Content-Length', str(len(response) + 100))
+                    self.send_header('Connection', 'close')
+                    self.end_headers()
+                    self.wfile.write(response)
+                    self.close_connection = True
+                    return
+                if malformed and response and self.path not in handled:
+                    handled.add(self.path)
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.send_header('Connection', 'close')
+                    self.end_headers()
+                    self.wfile.write(b"not a chunk size\r\n")
+                    self.close_connection = True
+                    return
+
+                self.send_header('Content-Length', str(len(response) if response else 0))
                 self.end_headers()
 
                 if response:
@@ -3,9 +3,15 @@
 # pylint: disable=invalid-name
 import unittest
 import tempfile
+import hashlib
+import gzip
+import io
+import json
 import os
+import tarfile
 import zipfile
-from full_offline_backup_for_todoist.virtual_fs import ZipVirtualFs
+from full_offline_backup_for_todoist.virtual_fs import ZipVirtualFs, ZipCompressionPolicy
+from full_offline_backup_for_todoist.virtual_fs import DirectoryVirtualFs, TarVirtualFs
 
 class Test(unittest.TestCase):
     """ Tests for the VFS (Virtual FS) """
@@ -59,6 +65,19 @@ class Test(unittest.TestCase):
             self.assertEqual(zvfs.file_list(), ["test_🦋.txt"])
             self.assertEqual(zvfs.read_file("test_🦋.txt"), b"hello world")
 
+    def test_on_zip_vfs_open_write_is_written_and_can_be_read(self):
+        """ Tests that a file can be written in chunks (and then read back) correctly """
+        # Arrange
+        with ZipVirtualFs(None) as zvfs:
+            # Act
+            with zvfs.open_write("test_file.txt") as file:
+                file.write(b"hello ")
+                file.write(b"world")
+
+            # Act/Assert
+            self.assertEqual(zvfs.file_list(), ["test_file.txt"])
+            self.assertEqual(zvfs.read_file("test_file.txt"), b"hello world")
+
     def test_on_zip_vfs_write_file_in_folder_is_written_and_can_be_read(self):
         """ Tests that files can be written (and then read back) inside a folder correctly """
         # Arrange
@@ -82,7 +101,7 @@ class Test(unittest.TestCase):
 
         # Assert
         with zipfile.ZipFile("./testfile.zip") as zipf:
-            self.assertEqual(zipf.namelist(), ["test_file.txt"])
+            self.assertEqual(zipf.namelist(), ["test_file.txt", ".manifest/0001.jsonl"])
             self.assertEqual(zipf.read("test_file.txt"), b"hello world")
 
     def test_on_zip_vfs_read_from_disk(self):
@@ -97,3 +116,257 @@ class Test(unittest.TestCase):
             self.assertEqual(zvfs.existed(), True)
             self.assertEqual(zvfs.file_list(), ["test_file.txt"])
             self.assertEqual(zvfs.read_file("test_file.txt"), b"hello world")
+
+    def test_on_zip_vfs_open_read_from_disk_streams_file(self):
+        """ Tests that files can be read from disk (ZIP) as a stream """
+        # Arrange
+        with zipfile.ZipFile("./testfile.zip", "w") as zipf:
+            zipf.writestr("test_file.txt", b'hello world')
+
+        # Act
+        with ZipVirtualFs("testfile.zip") as zvfs:
+            with zvfs.open_read("test_file.txt") as file:
+                # Assert
+                self.assertEqual(file.read(5), b"hello")
+                self.assertEqual(file.read(), b" world")
+
+    def test_on_zip_vfs_write_to_disk_leaves_no_temporary_files(self):
+        """ Tests that a new ZIP is moved into place when complete,
+            without leaving any temporary files behind """
+        # Arrange
+        with ZipVirtualFs(None) as zvfs:
+            zvfs.set_path_hint("testfile")
+
+            # Act
+            zvfs.write_file("test_file.txt", b"hello world")
+
+        # Assert
+        self.assertEqual(os.listdir("."), ["testfile.zip"])
+
+    def test_on_zip_vfs_exception_doesnt_write_to_disk(self):
+        """ Tests that if the ZIP is not completed due to an exception,
+            nothing is left on disk, not even a partial ZIP """
+        # Arrange
+        def write_and_fail():
+            with ZipVirtualFs("testfile.zip") as zvfs:
+                zvfs.write_file("test_file.txt", b"hello world")
+                raise RuntimeError("Test")
+
+        # Act
+        self.assertRaises(RuntimeError, write_and_fail)
+
+        # Assert
+        self.assertEqual(os.listdir("."), [])
+
+    def test_on_zip_vfs_exception_while_appending_keeps_existing_zip(self):
+        """ Tests that if appending to an existing ZIP fails due to an exception,
+            the existing ZIP is left as it was, and a successful append replaces it """
+        # Arrange
+        with zipfile.ZipFile("./testfile.zip", "w") as zipf:
+            zipf.writestr("test_file.txt", b'hello world')
+
+        def append_and_fail():
+            with ZipVirtualFs("testfile.zip") as zvfs:
+                zvfs.write_file("test_file_2.txt", b"hello" * 100000)
+                raise RuntimeError("Test")
+
+        # Act
+        self.assertRaises(RuntimeError, append_and_fail)
+        with zipfile.ZipFile("testfile.zip") as zipf:
+            names_after_failure = zipf.namelist()
+        with ZipVirtualFs("testfile.zip") as zvfs:
+            zvfs.write_file("test_file_3.txt", b"hello again")
+
+        # Assert
+        self.assertEqual(names_after_failure, ["test_file.txt"])
+        self.assertEqual(os.listdir("."), ["testfile.zip"])
+        with zipfile.ZipFile("testfile.zip") as zipf:
+            self.assertEqual(zipf.read("test_file_3.txt"), b"hello again")
+            self.assertIn("test_file.txt", zipf.namelist())
+
+    def test_on_zip_vfs_compresses_files_according_to_policy(self):
+        """ Tests that text files (including the manifest) are compressed with the method
+            of the compression policy, while already compressed files are stored as is """
+        # Arrange
+        with ZipVirtualFs("testfile.zip",
+                          compression_policy=ZipCompressionPolicy(zipfile.ZIP_LZMA)) as zvfs:
+            # Act
+            zvfs.write_file("project.csv", b"hello world" * 100)
+            with zvfs.open_write("attachments/image.JPG") as file:
+                file.write(b"not really a JPG")
+            zvfs.write_file("attachments/document.pdf", b"not really a PDF")
+
+        # Assert
+        with zipfile.ZipFile("testfile.zip") as zipf:
+            self.assertEqual(zipf.getinfo("project.csv").compress_type, zipfile.ZIP_LZMA)
+            self.assertEqual(zipf.getinfo(".manifest/0001.jsonl").compress_type,
+                             zipfile.ZIP_LZMA)
+            self.assertEqual(zipf.getinfo("attachments/image.JPG").compress_type,
+                             zipfile.ZIP_STORED)
+            self.assertEqual(zipf.getinfo("attachments/document.pdf").compress_type,
+                             zipfile.ZIP_STORED)
+            self.assertEqual(zipf.read("project.csv"), b"hello world" * 100)
+
+    def test_on_zip_vfs_stores_files_uncompressed_by_default(self):
+        """ Tests that the files are stored uncompressed without a compression policy """
+        # Arrange
+        with ZipVirtualFs("testfile.zip") as zvfs:
+            # Act
+            zvfs.write_file("project.csv", b"hello world" * 100)
+
+        # Assert
+        with zipfile.ZipFile("testfile.zip") as zipf:
+            self.assertEqual(zipf.getinfo("project.csv").compress_type, zipfile.ZIP_STORED)
+
+    def test_on_directory_vfs_write_is_moved_in_place_and_can_be_read(self):
+        """ Tests that files written to a new directory VFS can be read back,
+            and that the directory only appears once the VFS is complete """
+        # Arrange
+        with DirectoryVirtualFs(None) as dvfs:
+            dvfs.set_path_hint("testdir")
+
+            # Act
+            dvfs.write_file("test_file.txt", b"hello world")
+            with dvfs.open_write("folder/test_file_2.txt") as file:
+                file.write(b"hello ")
+                file.write(b"folder")
+            listdir_before_exit = os.listdir(".")
+
+            # Assert
+            self.assertEqual(dvfs.existed(), False)
+            self.assertEqual(dvfs.file_list(), ["test_file.txt", "folder/test_file_2.txt"])
+            self.assertEqual(dvfs.read_file("folder/test_file_2.txt"), b"hello folder")
+            self.assertNotIn("testdir", listdir_before_exit)
+
+        with open(os.path.join("testdir", "test_file.txt"), "rb") as file:
+            self.assertEqual(file.read(), b"hello world")
+
+    def test_on_directory_vfs_existing_is_written_in_place(self):
+        """ Tests that when writing to an existing directory, the files are written
+            to it directly, and the files that were already there can be read """
+        # Arrange
+        os.mkdir("testdir")
+        with open(os.path.join("testdir", "test_file.txt"), "wb") as file:
+            file.write(b"hello world")
+
+        with DirectoryVirtualFs("testdir") as dvfs:
+            # Act
+            dvfs.write_file("test_file_2.txt", b"")
+
+            # Assert
+            self.assertEqual(dvfs.existed(), True)
+            self.assertEqual(sorted(os.listdir("testdir")), ["test_file.txt", "test_file_2.txt"])
+            self.assertEqual(dvfs.read_file("test_file.txt"), b"hello world")
+            self.assertEqual(dvfs.read_file("test_file_2.txt"), b"")
+            self.assertRaises(KeyError, dvfs.read_file, "non_existing.txt")
+
+    def test_on_directory_vfs_exception_doesnt_write_to_disk(self):
+        """ Tests that if a new directory VFS is not completed due to an exception,
+            nothing is left on disk, not even partially written files """
+        # Arrange
+        def write_and_fail():
+            with DirectoryVirtualFs("testdir") as dvfs:
+                dvfs.write_file("test_file.txt", b"hello world")
+                with dvfs.open_write("test_file_2.txt") as file:
+                    file.write(b"hello")
+                    raise RuntimeError("Test")
+
+        # Act
+        self.assertRaises(RuntimeError, write_and_fail)
+
+        # Assert
+        self.assertEqual(os.listdir("."), [])
+
+    def test_on_tar_vfs_files_are_written_to_stream(self):
+        """ Tests that files written to a tar VFS are written to the output stream,
+            in the same order and with the same contents """
+        # Arrange
+        output = io.BytesIO()
+        with TarVirtualFs(None, "xz", output) as tvfs:
+            # Act
+            tvfs.write_file("test_file.txt", b"hello world")
+            tvfs.write_file_from("folder/test_file_2.txt", io.BytesIO(b"hello folder"))
+            with tvfs.open_write("test_file_3.txt") as file:
+                file.write(b"hello ")
+                file.write(b"again")
+
+            # Assert
+            self.assertEqual(tvfs.file_list(), ["test_file.txt", "folder/test_file_2.txt",
+                                                "test_file_3.txt"])
+            self.assertRaises(io.UnsupportedOperation, tvfs.read_file, "test_file.txt")
+
+        output.seek(0)
+        with tarfile.open(fileobj=output, mode="r|xz") as tarf:
+            self.assertEqual([(member.name, tarf.extractfile(member).read()) for member in tarf], [
+                ("test_file.txt", b"hello world"),
+                ("folder/test_file_2.txt", b"hello folder"),
+                ("test_file_3.txt", b"hello again"),
+            ])
+        self.assertEqual(os.listdir("."), [])
+
+    def test_on_tar_vfs_exception_leaves_stream_truncated(self):
+        """ Tests that if a tar VFS is not completed due to an exception, the end of the
+            archive is not written, so the stream is seen as truncated,
+            and nothing is left on disk for a tar file """
+        # Arrange
+        def write_and_fail(tvfs):
+            with tvfs:
+                tvfs.write_file("test_file.txt", os.urandom(100000))
+                raise RuntimeError("Test")
+
+        output = io.BytesIO()
+
+        # Act
+        self.assertRaises(RuntimeError, write_and_fail, TarVirtualFs(None, "gz", output))
+        self.assertRaises(RuntimeError, write_and_fail, TarVirtualFs("testfile.tar.gz", "gz"))
+
+        # Assert
+        self.assertGreater(len(output.getvalue()), 0)
+        self.assertRaises(EOFError, gzip.decompress, output.getvalue())
+        self.assertEqual(os.listdir("."), [])
+
+    def test_on_tar_vfs_write_to_disk_moves_file_in_place(self):
+        """ Tests that a tar file is only written to its destination once complete,
+            and that an existing tar file is left alone """
+        # Arrange
+        with TarVirtualFs(None) as tvfs:
+            tvfs.set_path_hint("testfile")
+
+            # Act
+            tvfs.write_file("test_file.txt", b"hello world")
+
+            # Assert
+            self.assertNotIn("testfile.tar", os.listdir("."))
+
+        with TarVirtualFs("testfile.tar") as tvfs:
+            self.assertEqual(tvfs.existed(), True)
+
+        self.assertEqual(os.listdir("."), ["testfile.tar"])
+        with tarfile.open("testfile.tar") as tarf:
+            self.assertEqual(tarf.getnames(), ["test_file.txt"])
+
+    def test_on_zip_vfs_each_session_writes_manifest(self):
+        """ Tests that each session writing to a ZIP adds a manifest of the files it wrote,
+            which is not listed as a file of the VFS """
+        # Arrange
+        with ZipVirtualFs("testfile.zip") as zvfs:
+            zvfs.write_file("project.csv", b"hello world", "1234")
+
+        # Act
+        with ZipVirtualFs("testfile.zip") as zvfs:
+            with zvfs.open_write("attachments/file.txt", "http://example.com/file.txt") as file:
+                file.write(b"hello ")
+                file.write(b"attachment")
+            file_list = zvfs.file_list()
+
+        # Assert
+        self.assertEqual(file_list, ["project.csv", "attachments/file.txt"])
+        with zipfile.ZipFile("testfile.zip") as zipf:
+            manifests = [[json.loads(line) for line in zipf.read(name).splitlines()]
+                         for name in (".manifest/0001.jsonl", ".manifest/0002.jsonl")]
+        self.assertEqual([[(record["path"], record["size"], record["sha256"], record["source"])
+                           for record in manifest] for manifest in manifests], [
+            [("project.csv", 11, hashlib.sha256(b"hello world").hexdigest(), "1234")],
+            [("attachments/file.txt", 16, hashlib.sha256(b"hello attachment").hexdigest(),
+              "http://example.com/file.txt")],
+        ])